@@ -3,13 +3,14 @@ import hashlib
 import os
 import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
 
 from .analyzer import analyze_apk
 from .db import init_db, save_scan, get_scan, list_scans
+from .streaming import stream_scan, wants_ndjson
 
 app = FastAPI(title="APKScanner", version="1.0")
 
@@ -56,22 +57,8 @@ def _unified_response(
     }
 
 
-@app.post("/scan-apk")
-async def scan_apk(
-    file: UploadFile = File(...),
-    parent_scan_id: Optional[int] = Form(default=None),
-):
-    if not file.filename.lower().endswith(".apk"):
-        raise HTTPException(status_code=400, detail="Fichier invalide: .apk requis")
-
-    content = await file.read()
-    if not content:
-        raise HTTPException(status_code=400, detail="Fichier vide")
-
-    sha256 = hashlib.sha256(content).hexdigest()
-    out_path = UPLOAD_DIR / f"{sha256}_{file.filename}"
-    out_path.write_bytes(content)
-
+def _scan(out_path: Path, sha256: str, parent_scan_id: Optional[int]) -> Tuple[int, Dict[str, Any]]:
+    """Analyzes + stores the scan. Returns (HTTP status, unified response)."""
     t0 = time.perf_counter()
 
     try:
@@ -106,7 +93,7 @@ async def scan_apk(
             sha256=sha256,
         )
 
-        return _unified_response(
+        return 200, _unified_response(
             scan_id,
             package=findings.get("package_name"),
             findings_list=findings.get("findings_list", []),
@@ -146,21 +133,45 @@ async def scan_apk(
             sha256=sha256,
         )
 
-        return JSONResponse(
-            status_code=500,
-            content=_unified_response(
-                scan_id,
-                package=None,
-                findings_list=[],
-                duration_ms=duration_ms,
-                status="FAILED",
-                error=str(e),
-                engines=[],
-                context={"file_name": failed_findings["file_name"], "sha256": sha256},
-            ),
+        return 500, _unified_response(
+            scan_id,
+            package=None,
+            findings_list=[],
+            duration_ms=duration_ms,
+            status="FAILED",
+            error=str(e),
+            engines=[],
+            context={"file_name": failed_findings["file_name"], "sha256": sha256},
         )
 
 
+@app.post("/scan-apk")
+async def scan_apk(
+    request: Request,
+    file: UploadFile = File(...),
+    parent_scan_id: Optional[int] = Form(default=None),
+):
+    if not file.filename.lower().endswith(".apk"):
+        raise HTTPException(status_code=400, detail="Fichier invalide: .apk requis")
+
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Fichier vide")
+
+    sha256 = hashlib.sha256(content).hexdigest()
+    out_path = UPLOAD_DIR / f"{sha256}_{file.filename}"
+    out_path.write_bytes(content)
+
+    if wants_ndjson(request):
+        # findings are only known once the manifest analysis is done: streamed from the final payload
+        return stream_scan(lambda _emit: _scan(out_path, sha256, parent_scan_id)[1], lambda payload: payload, live=False)
+
+    status_code, payload = _scan(out_path, sha256, parent_scan_id)
+    if status_code != 200:
+        return JSONResponse(status_code=status_code, content=payload)
+    return payload
+
+
 @app.get("/scan/{scan_id}")
 def read_scan(scan_id: int):
     row = get_scan(scan_id)
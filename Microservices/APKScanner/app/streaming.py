@@ -0,0 +1,64 @@
+# app/streaming.py
+import json
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_DONE = object()
+
+Emit = Callable[[Dict[str, Any]], None]
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_record(kind: str, data: Any) -> bytes:
+    return (json.dumps({"type": kind, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def stream_scan(
+    run: Callable[[Optional[Emit]], Dict[str, Any]],
+    finish: Callable[[Dict[str, Any]], Dict[str, Any]],
+    live: bool = True,
+) -> StreamingResponse:
+    """
+    NDJSON response: one {"type": "finding"} record per finding, then a trailing
+    {"type": "meta"} record (the payload without findings_list, scan_id included).
+
+    run(emit) performs the scan, calling emit(finding) as findings are produced
+    (emit is None when live=False: findings are then sent from the final payload).
+    finish(payload) stores it and returns the payload to report.
+    Both run in a worker thread, so the scan is saved even if the client goes away.
+    """
+    records: "queue.Queue[Any]" = queue.Queue()
+
+    def _worker() -> None:
+        try:
+            payload = finish(run(records.put if live else None))
+            if not live:
+                for f in payload.get("findings_list") or []:
+                    records.put(f)
+            records.put(("meta", {k: v for k, v in payload.items() if k != "findings_list"}))
+        except Exception as e:
+            records.put(("error", {"detail": str(e) or type(e).__name__}))
+        finally:
+            records.put(_DONE)
+
+    def _lines() -> Iterator[bytes]:
+        while True:
+            item = records.get()
+            if item is _DONE:
+                return
+            if isinstance(item, tuple):
+                yield ndjson_record(*item)
+            else:
+                yield ndjson_record("finding", item)
+
+    threading.Thread(target=_worker, name="scan-stream", daemon=True).start()
+    return StreamingResponse(_lines(), media_type=NDJSON_MEDIA_TYPE)
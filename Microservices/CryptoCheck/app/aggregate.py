@@ -0,0 +1,71 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+AGGREGATE_ENABLED = os.getenv("CC_AGGREGATE", "0") == "1"
+# locations kept inline per group
+AGGREGATE_SAMPLES = int(os.getenv("CC_AGGREGATE_SAMPLES", "5"))
+# locations stored per group for the drill-down (0 = all of them); the count is always exact
+AGGREGATE_STORED = int(os.getenv("CC_AGGREGATE_STORED", "0"))
+# file: one group per rule + file (DEX: + class) | rule: one group per rule
+AGGREGATE_BY = os.getenv("CC_AGGREGATE_BY", "file")
+
+# evidence fields naming a group, per AGGREGATE_BY; the others vary inside it
+GROUP_FIELDS = {"file": ("file", "class"), "rule": ()}
+LOCATION_FIELDS = ("file", "class", "line", "method", "match_preview")
+
+Location = Tuple[int, Dict[str, Any]]  # (group, location evidence)
+
+
+def aggregate_findings(
+    findings: List[Dict[str, Any]],
+    samples: int = AGGREGATE_SAMPLES,
+    by: str = AGGREGATE_BY,
+    stored: int = AGGREGATE_STORED,
+) -> Tuple[List[Dict[str, Any]], List[Location]]:
+    """
+    One finding per rule + group fields (by="file": file and DEX class), in order
+    of first hit: rule fields once, evidence = {group, file, class, count,
+    samples (first N locations)}.
+    Returns (groups, every location with its group index) for the drill-down;
+    stored > 0 keeps only the first `stored` of each group.
+    """
+    group_fields = GROUP_FIELDS.get(by, GROUP_FIELDS["file"])
+    groups: List[Dict[str, Any]] = []
+    index: Dict[Tuple[Any, ...], int] = {}
+    locations: List[Location] = []
+
+    for f in findings:
+        ev = f.get("evidence") or {}
+        key = (f.get("id"), *(ev.get(k) for k in group_fields))
+        g = index.get(key)
+        if g is None:
+            g = index[key] = len(groups)
+            evidence = {"group": g, **{k: ev[k] for k in group_fields if ev.get(k) is not None}}
+            evidence.update({"count": 0, "samples": []})
+            groups.append({**f, "evidence": evidence})
+        loc = {k: ev[k] for k in LOCATION_FIELDS if ev.get(k) is not None and k not in group_fields}
+        evidence = groups[g]["evidence"]
+        evidence["count"] += 1
+        if len(evidence["samples"]) < samples:
+            evidence["samples"].append(loc)
+        if not stored or evidence["count"] <= stored:
+            locations.append((g, loc))
+
+    return groups, locations
+
+
+def aggregate_payload(
+    payload: Dict[str, Any],
+    samples: int = AGGREGATE_SAMPLES,
+    by: str = AGGREGATE_BY,
+    stored: int = AGGREGATE_STORED,
+) -> List[Location]:
+    """Replaces findings_list by its groups (in place); returns the locations to store."""
+    findings = payload.get("findings_list") or []
+    groups, locations = aggregate_findings(findings, samples, by, stored)
+    payload["findings_list"] = groups
+    context = payload.setdefault("meta", {}).setdefault("context", {})
+    context["aggregate"] = {
+        "by": by, "groups": len(groups), "findings": len(findings), "samples": samples, "stored": stored,
+    }
+    return locations
@@ -0,0 +1,138 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from .engines.apktool_engine import ApktoolCancelled, apktool_decode
+
+# decodes running at once: each one is a JVM of several hundred MB
+APKTOOL_CONCURRENCY = int(os.getenv("CC_APKTOOL_CONCURRENCY", "2"))
+# decodes allowed to wait for a slot; beyond that the request gets a 429
+APKTOOL_QUEUE = int(os.getenv("CC_APKTOOL_QUEUE", "4"))
+APKTOOL_TIMEOUT_S = float(os.getenv("CC_APKTOOL_TIMEOUT", "300"))
+
+_POLL_S = 0.5  # queued callers re-check cancellation this often
+_HISTORY = 50  # recent decodes used for the averages / Retry-After
+
+
+class ApktoolBusy(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"apktool queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ApktoolExecutor:
+    """
+    Shared limit on apktool decodes: at most max_concurrent run, at most
+    max_queue wait for a slot (FIFO is not guaranteed), the next caller gets
+    ApktoolBusy with a Retry-After estimate from recent decode times.
+    Each decode is killed after timeout seconds; a caller whose cancelled()
+    turns True leaves the queue, or has its decode killed.
+    Per process: the service runs one worker.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = APKTOOL_CONCURRENCY,
+        max_queue: int = APKTOOL_QUEUE,
+        timeout: float = APKTOOL_TIMEOUT_S,
+    ) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queued = 0
+        self._counts = {"completed": 0, "failed": 0, "timeouts": 0, "cancelled": 0, "rejected": 0}
+        self._durations: Deque[float] = deque(maxlen=_HISTORY)
+        self._waits: Deque[float] = deque(maxlen=_HISTORY)
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely free; caller holds the lock."""
+        per_decode = sum(self._durations) / len(self._durations) if self._durations else self.timeout / 4
+        rounds = math.ceil((self._queued + 1) / self.max_concurrent)
+        return int(min(max(1.0, per_decode * rounds), self.timeout))
+
+    def _reject_if_full(self) -> None:
+        """Caller holds the lock."""
+        if self._running >= self.max_concurrent and self._queued >= self.max_queue:
+            self._counts["rejected"] += 1
+            raise ApktoolBusy(self._retry_after())
+
+    def check_room(self) -> None:
+        """Raises ApktoolBusy (counted as rejected) if a decode submitted now would be."""
+        with self._cond:
+            self._reject_if_full()
+
+    def _acquire(self, cancelled: Optional[Callable[[], bool]]) -> float:
+        """Takes a slot, waiting in the queue if needed; returns the wait in seconds."""
+        t0 = time.monotonic()
+        with self._cond:
+            self._reject_if_full()
+            if self._running >= self.max_concurrent:
+                self._queued += 1
+                try:
+                    while self._running >= self.max_concurrent:
+                        if cancelled is not None and cancelled():
+                            self._counts["cancelled"] += 1
+                            raise ApktoolCancelled("apktool decode cancelled while queued")
+                        self._cond.wait(_POLL_S)
+                finally:
+                    self._queued -= 1
+            self._running += 1
+            waited = time.monotonic() - t0
+            self._waits.append(waited)
+            return waited
+
+    def _release(self, outcome: str, duration: Optional[float]) -> None:
+        with self._cond:
+            self._running -= 1
+            self._counts[outcome] += 1
+            if duration is not None:
+                self._durations.append(duration)
+            self._cond.notify()
+
+    def decode(
+        self,
+        apk_path: Path,
+        out_dir: Path,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Tuple[bool, Optional[str], int]:
+        """
+        Returns (ok, error, queued_ms). Raises ApktoolBusy if the queue is full,
+        ApktoolCancelled if cancelled() turned True.
+        """
+        waited = self._acquire(cancelled)
+        t0 = time.monotonic()
+        outcome, duration = "failed", None
+        try:
+            ok, err = apktool_decode(apk_path, out_dir, timeout=self.timeout, cancelled=cancelled)
+            elapsed = time.monotonic() - t0
+            if ok:
+                outcome, duration = "completed", elapsed
+            elif elapsed >= self.timeout:
+                outcome, duration = "timeouts", elapsed
+            return ok, err, int(waited * 1000)
+        except ApktoolCancelled:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._release(outcome, duration)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "timeout_s": self.timeout,
+                "running": self._running,
+                "queued": self._queued,
+                **self._counts,
+                "avg_decode_ms": int(1000 * sum(self._durations) / len(self._durations)) if self._durations else None,
+                "avg_wait_ms": int(1000 * sum(self._waits) / len(self._waits)) if self._waits else None,
+                "max_wait_ms": int(1000 * max(self._waits)) if self._waits else None,
+                "retry_after_s": self._retry_after(),
+            }
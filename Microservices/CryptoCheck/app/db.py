@@ -1,7 +1,8 @@
 import json
 import sqlite3
+import zlib
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
@@ -12,6 +13,15 @@ UPLOADS_DIR = DATA_DIR / "uploads"
 WORK_DIR.mkdir(exist_ok=True, parents=True)
 UPLOADS_DIR.mkdir(exist_ok=True, parents=True)
 
+# columns added after the first version of crypto_scans (ALTER TABLE at startup)
+ADDED_COLUMNS = {
+    "status": "TEXT",
+    "rules_hash": "TEXT",
+}
+
+# evidence fields of a stored location, in packed row order
+LOCATION_FIELDS = ("file", "class", "line", "method", "match_preview")
+
 def init_db() -> None:
     conn = sqlite3.connect(DB_PATH)
     try:
@@ -30,18 +40,41 @@ def init_db() -> None:
             )
             """
         )
+        existing = {r[1] for r in cur.execute("PRAGMA table_info(crypto_scans)")}
+        for col, decl in ADDED_COLUMNS.items():
+            if col not in existing:
+                cur.execute(f"ALTER TABLE crypto_scans ADD COLUMN {col} {decl}")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_crypto_scans_sha256 ON crypto_scans (sha256, rules_hash, id)")
+        # locations of an aggregated finding group (CC_AGGREGATE), findings_json keeps the first few:
+        # one row per group, its locations packed (fields = the columns of each zlib'd JSON row)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cc_finding_groups (
+                scan_id INTEGER NOT NULL,
+                grp INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                fields TEXT NOT NULL,
+                locations BLOB NOT NULL,
+                PRIMARY KEY (scan_id, grp)
+            ) WITHOUT ROWID
+            """
+        )
         conn.commit()
     finally:
         conn.close()
 
-def save_scan(payload: Dict[str, Any]) -> int:
+def save_scan(payload: Dict[str, Any], locations: Optional[Sequence[Tuple[int, Dict[str, Any]]]] = None) -> int:
+    """
+    locations: (group, location evidence) of an aggregated payload, stored with it:
+    one row per group with its count (evidence.count) and its locations packed.
+    """
     conn = sqlite3.connect(DB_PATH)
     try:
         cur = conn.cursor()
         cur.execute(
             """
-            INSERT INTO crypto_scans(parent_scan_id, service, file_name, sha256, package_name, findings_json)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO crypto_scans(parent_scan_id, service, file_name, sha256, package_name, status, rules_hash, findings_json)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 payload.get("parent_scan_id"),
@@ -49,11 +82,28 @@ def save_scan(payload: Dict[str, Any]) -> int:
                 payload.get("meta", {}).get("context", {}).get("file_name"),
                 payload.get("meta", {}).get("context", {}).get("sha256"),
                 payload.get("package"),
+                payload.get("meta", {}).get("status"),
+                payload.get("meta", {}).get("context", {}).get("rules_hash"),
                 json.dumps(payload),
             ),
         )
+        scan_id = cur.lastrowid
+        if locations is not None:
+            per_group: Dict[int, List[Dict[str, Any]]] = {}
+            for grp, loc in locations:
+                per_group.setdefault(grp, []).append(loc)
+            rows = []
+            for f in payload.get("findings_list") or []:
+                ev = f.get("evidence") or {}
+                if "group" in ev:
+                    fields, packed = _pack_locations(per_group.get(ev["group"], []))
+                    rows.append((scan_id, ev["group"], ev["count"], fields, packed))
+            cur.executemany(
+                "INSERT INTO cc_finding_groups(scan_id, grp, count, fields, locations) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
         conn.commit()
-        return cur.lastrowid
+        return scan_id
     finally:
         conn.close()
 
@@ -69,6 +119,62 @@ def get_scan(scan_id: int) -> Optional[Dict[str, Any]]:
     finally:
         conn.close()
 
+def _pack_locations(locations: List[Dict[str, Any]]) -> Tuple[str, bytes]:
+    """(fields present, zlib'd JSON rows): only line / method / preview vary inside a group."""
+    fields = [k for k in LOCATION_FIELDS if any(k in loc for loc in locations)]
+    rows = [[loc.get(k) for k in fields] for loc in locations]
+    return ",".join(fields), zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+
+def get_locations(
+    scan_id: int, group: int, offset: int = 0, limit: int = 100
+) -> Tuple[int, int, List[Dict[str, Any]]]:
+    """
+    (total, stored, one page of locations) of a finding group, in scan order; fields
+    naming the group are left out. stored < total with CC_AGGREGATE_STORED set.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute(
+            "SELECT count, fields, locations FROM cc_finding_groups WHERE scan_id = ? AND grp = ?", (scan_id, group)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return 0, 0, []
+    total, fields, packed = row
+    keys = fields.split(",") if fields else []
+    rows = json.loads(zlib.decompress(packed))
+    items = [{k: v for k, v in zip(keys, r) if v is not None} for r in rows[offset:offset + limit]]
+    return total, len(rows), items
+
+def find_completed_scan(sha256: str, rules_hash: str) -> Optional[Dict[str, Any]]:
+    """Latest scan of this APK that completed without error under the same rules."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, findings_json FROM crypto_scans
+            WHERE sha256 = ? AND rules_hash = ? AND status = 'COMPLETED'
+            ORDER BY id DESC LIMIT 1
+            """,
+            (sha256, rules_hash),
+        )
+        row = cur.fetchone()
+        if not row:
+            return None
+        payload = json.loads(row[1])
+        meta = payload.get("meta", {})
+        context = meta.get("context", {})
+        # apktool is only run when smali is scanned (scan_root set)
+        apktool_failed = context.get("apktool_enabled") and context.get("scan_root") and not context.get("apktool_ok")
+        if meta.get("error") or context.get("dex_error") or apktool_failed:
+            return None  # partial scan: worth running again
+        payload["scan_id"] = row[0]
+        return payload
+    finally:
+        conn.close()
+
 def list_scans(limit: int = 20) -> List[Dict[str, Any]]:
     conn = sqlite3.connect(DB_PATH)
     try:
@@ -1,21 +1,70 @@
 import os
+import signal
 import subprocess
+import time
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
-def apktool_decode(apk_path: Path, out_dir: Path, apktool_bin: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+_POLL_S = 0.5  # how often a running decode checks its deadline / cancellation
+
+
+class ApktoolCancelled(Exception):
+    """The decode was abandoned (client gone): the process was killed, nothing to report."""
+
+
+def _kill(proc: subprocess.Popen) -> None:
+    """apktool is a wrapper script around a JVM: kill the whole process group."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+    proc.communicate()
+
+
+def apktool_decode(
+    apk_path: Path,
+    out_dir: Path,
+    apktool_bin: Optional[str] = None,
+    timeout: Optional[float] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+) -> Tuple[bool, Optional[str]]:
+    """
+    timeout (seconds) kills the decode and reports it as failed.
+    cancelled is polled while apktool runs; when it returns True the decode is
+    killed and ApktoolCancelled raised.
+    """
     apktool = apktool_bin or os.getenv("APKTOOL_BIN", "apktool")
 
     cmd = [apktool, "d", "-f", "-o", str(out_dir), str(apk_path)]
     try:
-        subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return True, None
-
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True
+        )
     except FileNotFoundError:
         return False, f"apktool not found. Install it or set APKTOOL_BIN. Tried: {apktool}"
 
-    except subprocess.CalledProcessError as e:
-        msg = (e.stderr or e.stdout or "").strip()
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=_POLL_S)
+            break
+        except subprocess.TimeoutExpired:
+            if cancelled is not None and cancelled():
+                _kill(proc)
+                raise ApktoolCancelled("apktool decode cancelled")
+            if deadline is not None and time.monotonic() >= deadline:
+                _kill(proc)
+                return False, f"apktool timed out after {timeout:g}s"
+        except BaseException:
+            _kill(proc)
+            raise
+
+    if proc.returncode != 0:
+        msg = (stderr or stdout or "").strip()
         if len(msg) > 2500:
             msg = msg[-2500:]
-        return False, f"apktool failed (exit={e.returncode}): {msg}"
+        return False, f"apktool failed (exit={proc.returncode}): {msg}"
+    return True, None
@@ -0,0 +1,461 @@
+import re
+import struct
+import time
+import zipfile
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .rule_registry import RULES, RuleFile
+from .smali_sast_engine import CompiledRules, finding_dict
+
+NO_INDEX = 0xFFFFFFFF
+
+# rules needing what the DEX listing does not render (debug info, operands of arithmetic / branches)
+# are marked "engine": "smali" and only run on the apktool output
+SMALI_ONLY = "smali"
+
+# width in 16-bit code units of every opcode (Dalvik formats); payloads are sized separately
+OPCODE_WIDTH = [1] * 256
+for _ops, _w in (
+    ((0x02, 0x05, 0x08, 0x13, 0x15, 0x16, 0x19, 0x1a, 0x1c, 0x1f, 0x20, 0x22, 0x23, 0x29, 0xfe, 0xff), 2),
+    ((0x03, 0x06, 0x09, 0x14, 0x17, 0x1b, 0x24, 0x25, 0x26, 0x2a, 0x2b, 0x2c, 0xfc, 0xfd), 3),
+    ((0x18,), 5),
+    ((0xfa, 0xfb), 4),
+    (range(0x2d, 0x3e), 2),   # cmp*, if-*, if-*z
+    (range(0x44, 0x6e), 2),   # aget/aput, iget/iput, sget/sput
+    (range(0x6e, 0x73), 3),   # invoke-*
+    (range(0x74, 0x79), 3),   # invoke-*/range
+    (range(0x90, 0xb0), 2),   # binop
+    (range(0xd0, 0xe3), 2),   # binop/lit16, binop/lit8
+):
+    for _op in _ops:
+        OPCODE_WIDTH[_op] = _w
+
+_FIELD_OPS = ("", "-wide", "-object", "-boolean", "-byte", "-char", "-short")
+_INVOKE_KINDS = ("virtual", "super", "direct", "static", "interface")
+
+# names of the instructions that reference the constant pools
+OPCODE_NAME: Dict[int, str] = {
+    0x1a: "const-string", 0x1b: "const-string/jumbo", 0x1c: "const-class", 0x1f: "check-cast",
+    0x20: "instance-of", 0x22: "new-instance", 0x23: "new-array",
+    0x24: "filled-new-array", 0x25: "filled-new-array/range",
+    0xfa: "invoke-polymorphic", 0xfb: "invoke-polymorphic/range",
+}
+for _k, _suffix in enumerate(_FIELD_OPS):
+    OPCODE_NAME[0x52 + _k] = "iget" + _suffix
+    OPCODE_NAME[0x59 + _k] = "iput" + _suffix
+    OPCODE_NAME[0x60 + _k] = "sget" + _suffix
+    OPCODE_NAME[0x67 + _k] = "sput" + _suffix
+for _k, _kind in enumerate(_INVOKE_KINDS):
+    OPCODE_NAME[0x6e + _k] = f"invoke-{_kind}"
+    OPCODE_NAME[0x74 + _k] = f"invoke-{_kind}/range"
+
+# instructions rendered with their destination register only (the method index needs
+# every register write, not the operands): opcode -> (name, how vA is encoded)
+_UNOPS = (
+    "neg-int not-int neg-long not-long neg-float neg-double int-to-long int-to-float int-to-double "
+    "long-to-int long-to-float long-to-double float-to-int float-to-long float-to-double "
+    "double-to-int double-to-long double-to-float int-to-byte int-to-char int-to-short"
+).split()
+_INT_BINOPS = "add sub mul div rem and or xor shl shr ushr".split()
+_BINOPS = (
+    [f"{o}-int" for o in _INT_BINOPS] + [f"{o}-long" for o in _INT_BINOPS]
+    + [f"{o}-float" for o in _INT_BINOPS[:5]] + [f"{o}-double" for o in _INT_BINOPS[:5]]
+)
+_LIT16 = "add-int/lit16 rsub-int mul-int/lit16 div-int/lit16 rem-int/lit16 and-int/lit16 or-int/lit16 xor-int/lit16".split()
+_ARITH_LIT8 = [f"{o}-int/lit8" for o in _INT_BINOPS]
+_ARITH_LIT8[1] = "rsub-int/lit8"
+WRITER_NAME: Dict[int, Tuple[str, str]] = {
+    0x04: ("move-wide", "4"), 0x05: ("move-wide/from16", "8"), 0x06: ("move-wide/16", "16"),
+    0x0d: ("move-exception", "8"), 0x21: ("array-length", "4"),
+    0xfe: ("const-method-handle", "8"), 0xff: ("const-method-type", "8"),
+}
+for _k, _n in enumerate(("cmpl-float", "cmpg-float", "cmpl-double", "cmpg-double", "cmp-long")):
+    WRITER_NAME[0x2d + _k] = (_n, "8")
+for _k, _suffix in enumerate(_FIELD_OPS):
+    WRITER_NAME[0x44 + _k] = ("aget" + _suffix, "8")
+for _k, _n in enumerate(_UNOPS):
+    WRITER_NAME[0x7b + _k] = (_n, "4")
+for _k, _n in enumerate(_BINOPS):
+    WRITER_NAME[0x90 + _k] = (_n, "8")
+    WRITER_NAME[0xb0 + _k] = (_n + "/2addr", "4")
+for _k, _n in enumerate(_LIT16):
+    WRITER_NAME[0xd0 + _k] = (_n, "4")
+for _k, _n in enumerate(_ARITH_LIT8):
+    WRITER_NAME[0xd8 + _k] = (_n, "8")
+
+_MOVES = {0x01: "move", 0x02: "move/from16", 0x03: "move/16", 0x07: "move-object", 0x08: "move-object/from16", 0x09: "move-object/16"}
+_MOVE_RESULTS = {0x0a: "move-result", 0x0b: "move-result-wide", 0x0c: "move-result-object"}
+_CONSTS = {
+    0x12: "const/4", 0x13: "const/16", 0x14: "const", 0x15: "const/high16",
+    0x16: "const-wide/16", 0x17: "const-wide/32", 0x18: "const-wide", 0x19: "const-wide/high16",
+}
+# .array-data element: struct format and baksmali suffix per element width
+_ARRAY_ELEMENT = {1: ("b", "t"), 2: ("h", "s"), 4: ("i", ""), 8: ("q", "L")}
+
+# access flags in baksmali order (the method index needs "static" to map parameters to p registers)
+_FIELD_FLAGS = ((0x1, "public"), (0x2, "private"), (0x4, "protected"), (0x8, "static"), (0x10, "final"),
+                (0x40, "volatile"), (0x80, "transient"), (0x1000, "synthetic"), (0x4000, "enum"))
+_METHOD_FLAGS = ((0x1, "public"), (0x2, "private"), (0x4, "protected"), (0x8, "static"), (0x10, "final"),
+                 (0x20, "synchronized"), (0x40, "bridge"), (0x80, "varargs"), (0x100, "native"),
+                 (0x400, "abstract"), (0x800, "strictfp"), (0x1000, "synthetic"), (0x10000, "constructor"),
+                 (0x20000, "declared-synchronized"))
+
+def _flags(access: int, names: Tuple[Tuple[int, str], ...]) -> str:
+    return "".join(f"{name} " for bit, name in names if access & bit)
+
+def _signed(n: int, bits: int) -> int:
+    return n - (1 << bits) if n >= 1 << (bits - 1) else n
+
+def _literal(n: int, suffix: str = "") -> str:
+    return f"-0x{-n:x}{suffix}" if n < 0 else f"0x{n:x}{suffix}"
+
+_SMALI_ESCAPES = {'"': '\\"', "'": "\\'", "\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_NEEDS_ESCAPE = re.compile(r"""["'\\]|[^\x20-\x7e]""")
+
+def smali_string(s: str) -> str:
+    """String literal as baksmali prints it."""
+    if not _NEEDS_ESCAPE.search(s):
+        return s
+    return "".join(_SMALI_ESCAPES.get(c) or (c if " " <= c <= "~" else f"\\u{ord(c):04x}") for c in s)
+
+def _uleb128(data: bytes, off: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = data[off]
+        off += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, off
+        shift += 7
+
+def _mutf8(raw: bytes) -> str:
+    """Modified UTF-8: NUL as C0 80, supplementary chars as two encoded surrogates."""
+    try:
+        return raw.decode("ascii")
+    except UnicodeDecodeError:
+        pass
+    s = raw.replace(b"\xc0\x80", b"\x00").decode("utf-8", errors="surrogatepass")
+    try:
+        return s.encode("utf-16-le", errors="surrogatepass").decode("utf-16-le")
+    except UnicodeDecodeError:
+        return s.encode("utf-16-le", errors="surrogatepass").decode("utf-16-le", errors="replace")
+
+class DexFile:
+    """
+    Read-only view of the id tables and code items of a DEX file, enough to
+    render the pool-referencing parts of each class the way baksmali does.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        if data[:4] != b"dex\n" or len(data) < 0x70:
+            raise ValueError("not a DEX file")
+        self.data = data
+        (
+            string_ids_size, string_ids_off, type_ids_size, type_ids_off,
+            proto_ids_size, proto_ids_off, field_ids_size, field_ids_off,
+            method_ids_size, method_ids_off, class_defs_size, class_defs_off,
+        ) = struct.unpack_from("<12I", data, 0x38)
+
+        self.string_offs = struct.unpack_from(f"<{string_ids_size}I", data, string_ids_off)
+        self.type_ids = struct.unpack_from(f"<{type_ids_size}I", data, type_ids_off)
+        self.protos = [struct.unpack_from("<3I", data, proto_ids_off + 12 * i) for i in range(proto_ids_size)]
+        self.field_ids = [struct.unpack_from("<HHI", data, field_ids_off + 8 * i) for i in range(field_ids_size)]
+        self.method_ids = [struct.unpack_from("<HHI", data, method_ids_off + 8 * i) for i in range(method_ids_size)]
+        self.class_defs = [struct.unpack_from("<8I", data, class_defs_off + 32 * i) for i in range(class_defs_size)]
+
+        self._strings: List[Optional[str]] = [None] * string_ids_size
+        self._methods: Dict[int, str] = {}
+        self._fields: Dict[int, str] = {}
+        self.skipped = 0  # classes left out by render_classes(keep)
+
+    def string(self, idx: int) -> str:
+        s = self._strings[idx]
+        if s is None:
+            _, off = _uleb128(self.data, self.string_offs[idx])
+            end = self.data.index(b"\x00", off)
+            s = self._strings[idx] = _mutf8(self.data[off:end])
+        return s
+
+    def type(self, idx: int) -> str:
+        return self.string(self.type_ids[idx])
+
+    def _type_list(self, off: int) -> List[str]:
+        if not off:
+            return []
+        (size,) = struct.unpack_from("<I", self.data, off)
+        return [self.type(t) for t in struct.unpack_from(f"<{size}H", self.data, off + 4)]
+
+    def proto(self, idx: int) -> str:
+        _, return_idx, params_off = self.protos[idx]
+        return f"({''.join(self._type_list(params_off))}){self.type(return_idx)}"
+
+    def method(self, idx: int) -> str:
+        """Lcom/Foo;->bar(Ljava/lang/String;)V"""
+        s = self._methods.get(idx)
+        if s is None:
+            class_idx, proto_idx, name_idx = self.method_ids[idx]
+            s = self._methods[idx] = f"{self.type(class_idx)}->{self.string(name_idx)}{self.proto(proto_idx)}"
+        return s
+
+    def field(self, idx: int) -> str:
+        """Lcom/Foo;->bar:Ljava/lang/String;"""
+        s = self._fields.get(idx)
+        if s is None:
+            class_idx, type_idx, name_idx = self.field_ids[idx]
+            s = self._fields[idx] = f"{self.type(class_idx)}->{self.string(name_idx)}:{self.type(type_idx)}"
+        return s
+
+    def _static_strings(self, off: int) -> List[Optional[str]]:
+        """Initial values of the static fields, when they are strings."""
+        if not off:
+            return []
+        data = self.data
+        size, off = _uleb128(data, off)
+        out: List[Optional[str]] = []
+        for _ in range(size):
+            value, off = self._encoded_value(off)
+            out.append(value)
+        return out
+
+    def _encoded_value(self, off: int) -> Tuple[Optional[str], int]:
+        data = self.data
+        header = data[off]
+        off += 1
+        vtype, arg = header & 0x1f, header >> 5
+        if vtype == 0x1c:  # array
+            size, off = _uleb128(data, off)
+            for _ in range(size):
+                _, off = self._encoded_value(off)
+            return None, off
+        if vtype == 0x1d:  # annotation
+            _, off = _uleb128(data, off)
+            size, off = _uleb128(data, off)
+            for _ in range(size):
+                _, off = _uleb128(data, off)
+                _, off = self._encoded_value(off)
+            return None, off
+        if vtype in (0x1e, 0x1f):  # null, boolean: no payload
+            return None, off
+        n = arg + 1
+        if vtype == 0x17:  # string
+            return self.string(int.from_bytes(data[off:off + n], "little")), off + n
+        return None, off + n
+
+    def _render_code(self, code_off: int, lines: List[str]) -> None:
+        data = self.data
+        registers, ins, _, _, _, insns_size = struct.unpack_from("<4HII", data, code_off)
+        units = struct.unpack_from(f"<{insns_size}H", data, code_off + 16)
+        first_param = registers - ins
+
+        def reg(r: int) -> str:
+            return f"p{r - first_param}" if r >= first_param else f"v{r}"
+
+        i = 0
+        while i < insns_size:
+            u = units[i]
+            op = u & 0xff
+            if op == 0 and u:  # switch / array payloads
+                if u == 0x0100:
+                    i += units[i + 1] * 2 + 4
+                elif u == 0x0200:
+                    i += units[i + 1] * 4 + 2
+                elif u == 0x0300:
+                    width, size = units[i + 1], units[i + 2] | (units[i + 3] << 16)
+                    self._render_array(code_off + 16 + 2 * (i + 4), i, width, size, lines)
+                    i += (size * width + 1) // 2 + 4
+                else:
+                    i += 1
+                continue
+
+            name = OPCODE_NAME.get(op)
+            if name is None:
+                self._render_data_op(op, u, units, i, reg, lines)
+            else:
+                if op == 0x1a:
+                    lines.append(f'    {name} {reg(u >> 8)}, "{smali_string(self.string(units[i + 1]))}"')
+                elif op == 0x1b:
+                    idx = units[i + 1] | (units[i + 2] << 16)
+                    lines.append(f'    {name} {reg(u >> 8)}, "{smali_string(self.string(idx))}"')
+                elif op in (0x1c, 0x1f, 0x22):
+                    lines.append(f"    {name} {reg(u >> 8)}, {self.type(units[i + 1])}")
+                elif op in (0x20, 0x23):
+                    lines.append(f"    {name} {reg((u >> 8) & 0xf)}, {reg(u >> 12)}, {self.type(units[i + 1])}")
+                elif 0x52 <= op <= 0x5f:
+                    lines.append(f"    {name} {reg((u >> 8) & 0xf)}, {reg(u >> 12)}, {self.field(units[i + 1])}")
+                elif 0x60 <= op <= 0x6d:
+                    lines.append(f"    {name} {reg(u >> 8)}, {self.field(units[i + 1])}")
+                elif op in (0x24, 0xfa) or 0x6e <= op <= 0x72:
+                    w = units[i + 2]
+                    regs = (w & 0xf, (w >> 4) & 0xf, (w >> 8) & 0xf, w >> 12, (u >> 8) & 0xf)[:u >> 12]
+                    ref = self.type(units[i + 1]) if op == 0x24 else self.method(units[i + 1])
+                    lines.append(f"    {name} {{{', '.join(reg(r) for r in regs)}}}, {ref}")
+                else:  # /range forms
+                    count, first = u >> 8, units[i + 2]
+                    regs_s = f"{reg(first)} .. {reg(first + count - 1)}" if count else ""
+                    ref = self.type(units[i + 1]) if op == 0x25 else self.method(units[i + 1])
+                    lines.append(f"    {name} {{{regs_s}}}, {ref}")
+            i += OPCODE_WIDTH[op]
+
+    def _render_data_op(self, op: int, u: int, units: Sequence[int], i: int, reg: Callable[[int], str], lines: List[str]) -> None:
+        """Constants, moves, move-result, fill-array-data, and the destination of every other register write."""
+        if op in _CONSTS:
+            if op == 0x12:
+                n = _signed(u >> 12, 4)
+            elif op in (0x13, 0x16):
+                n = _signed(units[i + 1], 16)
+            elif op in (0x14, 0x17):
+                n = _signed(units[i + 1] | (units[i + 2] << 16), 32)
+            elif op == 0x15:
+                n = _signed(units[i + 1] << 16, 32)
+            elif op == 0x18:
+                n = _signed(units[i + 1] | (units[i + 2] << 16) | (units[i + 3] << 32) | (units[i + 4] << 48), 64)
+            else:  # const-wide/high16
+                n = _signed(units[i + 1] << 48, 64)
+            dest = reg((u >> 8) & 0xf) if op == 0x12 else reg(u >> 8)
+            lines.append(f"    {_CONSTS[op]} {dest}, {_literal(n, 'L' if op in (0x18, 0x19) else '')}")
+        elif op in _MOVES:
+            if op in (0x01, 0x07):
+                a, b = (u >> 8) & 0xf, u >> 12
+            elif op in (0x02, 0x08):
+                a, b = u >> 8, units[i + 1]
+            else:
+                a, b = units[i + 1], units[i + 2]
+            lines.append(f"    {_MOVES[op]} {reg(a)}, {reg(b)}")
+        elif op in _MOVE_RESULTS:
+            lines.append(f"    {_MOVE_RESULTS[op]} {reg(u >> 8)}")
+        elif op == 0x26:
+            target = i + _signed(units[i + 1] | (units[i + 2] << 16), 32)
+            lines.append(f"    fill-array-data {reg(u >> 8)}, :array_{target:x}")
+        elif op in WRITER_NAME:
+            name, encoding = WRITER_NAME[op]
+            dest = (u >> 8) & 0xf if encoding == "4" else u >> 8 if encoding == "8" else units[i + 1]
+            lines.append(f"    {name} {reg(dest)}")
+
+    def _render_array(self, off: int, i: int, width: int, size: int, lines: List[str]) -> None:
+        """fill-array-data payload, as baksmali prints it."""
+        fmt, suffix = _ARRAY_ELEMENT.get(width, ("B", ""))
+        if fmt == "B":  # not a valid width: raw bytes
+            size *= width
+        values = struct.unpack_from(f"<{size}{fmt}", self.data, off)
+        lines.append(f"    :array_{i:x}")
+        lines.append(f"    .array-data {width}")
+        lines.extend(f"        {_literal(n, suffix)}" for n in values)
+        lines.append("    .end array-data")
+
+    def render_classes(
+        self, keep: Optional[Callable[[str], bool]] = None
+    ) -> Iterator[Tuple[str, str, List[Tuple[int, str]]]]:
+        """
+        Per class: (descriptor, smali-like listing, [(first line, method)]).
+        The listing holds the class / field / method declarations, static string
+        values, every instruction referencing a string, type, field or method, the
+        constants / moves / array payloads, and the destination of other register writes.
+        keep(descriptor) False: the class is skipped before its code is read.
+        """
+        data = self.data
+        for class_idx, _, super_idx, interfaces_off, _, _, class_data_off, static_values_off in self.class_defs:
+            desc = self.type(class_idx)
+            if keep is not None and not keep(desc):
+                self.skipped += 1
+                continue
+            lines = [f".class {desc}"]
+            if super_idx != NO_INDEX:
+                lines.append(f".super {self.type(super_idx)}")
+            for iface in self._type_list(interfaces_off):
+                lines.append(f".implements {iface}")
+            methods: List[Tuple[int, str]] = []
+
+            if class_data_off:
+                off = class_data_off
+                static_n, off = _uleb128(data, off)
+                instance_n, off = _uleb128(data, off)
+                direct_n, off = _uleb128(data, off)
+                virtual_n, off = _uleb128(data, off)
+
+                static_values = self._static_strings(static_values_off)
+                field_idx = 0
+                for k in range(static_n + instance_n):
+                    if k == static_n:
+                        field_idx = 0
+                    diff, off = _uleb128(data, off)
+                    access, off = _uleb128(data, off)
+                    field_idx += diff
+                    _, type_idx, name_idx = self.field_ids[field_idx]
+                    line = f".field {_flags(access, _FIELD_FLAGS)}{self.string(name_idx)}:{self.type(type_idx)}"
+                    value = static_values[k] if k < static_n and k < len(static_values) else None
+                    if value is not None:
+                        line += f' = "{smali_string(value)}"'
+                    lines.append(line)
+
+                method_idx = 0
+                for k in range(direct_n + virtual_n):
+                    if k == direct_n:
+                        method_idx = 0
+                    diff, off = _uleb128(data, off)
+                    access, off = _uleb128(data, off)
+                    code_off, off = _uleb128(data, off)
+                    method_idx += diff
+                    _, proto_idx, name_idx = self.method_ids[method_idx]
+                    sig = f"{self.string(name_idx)}{self.proto(proto_idx)}"
+                    methods.append((len(lines) + 1, sig))
+                    lines.append(f".method {_flags(access, _METHOD_FLAGS)}{sig}")
+                    if code_off:
+                        self._render_code(code_off, lines)
+                    lines.append(".end method")
+
+            yield desc, "\n".join(lines), methods
+
+def iter_dex_files(apk_path: Path) -> Iterator[Tuple[str, bytes]]:
+    """classes.dex, classes2.dex, ... in load order."""
+    with zipfile.ZipFile(apk_path) as z:
+        names = [n for n in z.namelist() if re.fullmatch(r"classes\d*\.dex", n)]
+        for name in sorted(names, key=lambda n: int(n[7:-4] or 1)):
+            yield name, z.read(name)
+
+def run_dex_sast(
+    apk_path: Path,
+    rules_path: Path,
+    on_finding: Optional[Callable[[Dict[str, Any]], None]] = None,
+    scope: Optional[Any] = None,
+    rule_file: Optional[RuleFile] = None,
+) -> Dict[str, Any]:
+    """
+    Evaluates the rules against the DEX of the APK, without apktool: each class
+    is rendered as smali-like lines (declarations + pool-referencing
+    instructions) and scanned like a smali file. Evidence points to the DEX,
+    class and method.
+    "smali_rules" lists the ids of the smali-only rules, left to the smali engine.
+    scope (PackageScope): classes of excluded packages (third-party SDKs) are skipped.
+    rule_file: the version of rules_path the scan started with (default: current one).
+    """
+    rule_file = rule_file or RULES.get(rules_path)
+    rules = rule_file.rules
+    smali_rules = [r["id"] for r in rules if r.get("engine") == SMALI_ONLY]
+    compiled = rule_file.compiled("dex", lambda: CompiledRules([r for r in rules if r.get("engine") != SMALI_ONLY]))
+    findings: List[Dict[str, Any]] = []
+    stats: Dict[str, Any] = {"dex_files": 0, "classes": 0, "skipped_classes": 0, "methods": 0, "rendered_lines": 0}
+    keep = (lambda desc: scope.is_scanned(desc[1:-1])) if scope is not None else None
+    t0 = time.perf_counter()
+
+    for dex_name, data in iter_dex_files(apk_path):
+        dex = DexFile(data)
+        stats["dex_files"] += 1
+        for desc, text, methods in dex.render_classes(keep):
+            stats["classes"] += 1
+            stats["methods"] += len(methods)
+            stats["rendered_lines"] += text.count("\n") + 1
+            starts = [line for line, _ in methods]
+            for line, i, start, end in compiled.scan(text):
+                k = bisect_right(starts, line) - 1
+                finding = finding_dict(compiled.rules[i], dex_name, line, text[start:end].strip()[:200])
+                finding["evidence"]["class"] = desc
+                finding["evidence"]["method"] = methods[k][1] if k >= 0 else None
+                findings.append(finding)
+                if on_finding is not None:
+                    on_finding(finding)
+        stats["skipped_classes"] += dex.skipped
+
+    stats["duration_ms"] = int((time.perf_counter() - t0) * 1000)
+    return {"findings": findings, "stats": stats, "smali_rules": smali_rules}
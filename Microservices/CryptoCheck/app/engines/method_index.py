@@ -0,0 +1,377 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# register values tracked through a method (anything else is None = unknown):
+#   ("string", str)   const-string
+#   ("int", int)      const*
+#   ("array", elems)  new-array (+ fill-array-data); elems None = zero-filled
+#   ("derived", v)    result of a pure transform (getBytes, Base64.decode, ...) of a constant v
+Value = Tuple[str, Any]
+
+CONSTANT_KINDS = ("string", "int", "array", "derived")
+
+# pure transforms: move-result of these is constant when the register at that position is
+PURE_TRANSFORMS: Tuple[Tuple[str, int], ...] = (
+    ("Ljava/lang/String;->getBytes(", 0),
+    ("Ljava/lang/String;->toCharArray(", 0),
+    ("Landroid/util/Base64;->decode(", 0),
+    ("Ljava/util/Base64$Decoder;->decode(", 1),
+)
+
+# instructions that do not write their first register (check-cast keeps the value)
+_NON_WRITERS = (
+    "if-", "goto", "return", "throw", "monitor-", "aput", "packed-switch",
+    "sparse-switch", "check-cast", "filled-new-array", "nop", "fill-array-data",
+)
+
+_INT_LITERAL = re.compile(r"(-?)0x([0-9a-fA-F]+)[LtsTS]?$|(-?\d+)[LtsTS]?$")
+_PARAM_TYPE = re.compile(r"\[*(?:L[^;]*;|[ZBSCIJFD])")
+
+# (line, line start, line end, stripped text) of a method body line
+BodyLine = Tuple[int, int, int, str]
+
+
+class InvokeSite(NamedTuple):
+    line: int
+    start: int  # offsets of the line in the text
+    end: int
+    target: str  # Lcls;->name(params)ret
+    args: List[Optional[Value]]  # per declared parameter, `this` excluded
+
+
+class MethodIndex:
+    """What one method does with constants: invoke sites with their argument values."""
+
+    __slots__ = ("name", "line", "static", "invokes")
+
+    def __init__(self, name: str, line: int, static: bool) -> None:
+        self.name = name  # name(params)ret
+        self.line = line
+        self.static = static
+        self.invokes: List[InvokeSite] = []
+
+
+def parse_int(literal: str) -> Optional[int]:
+    m = _INT_LITERAL.match(literal.strip())
+    if m is None:
+        return None
+    if m.group(2) is not None:
+        n = int(m.group(2), 16)
+        return -n if m.group(1) else n
+    return int(m.group(3))
+
+
+def unescape_smali(s: str) -> str:
+    try:
+        return s.encode("latin-1", "backslashreplace").decode("unicode_escape")
+    except UnicodeDecodeError:
+        return s
+
+
+def _param_slots(signature: str, static: bool) -> List[int]:
+    """Register position of each declared parameter (long / double take two)."""
+    params = signature[signature.index("(") + 1:signature.index(")")]
+    pos = 0 if static else 1
+    slots = []
+    for m in _PARAM_TYPE.finditer(params):
+        slots.append(pos)
+        pos += 2 if m.group(0) in ("J", "D") else 1
+    return slots
+
+
+def _invoke_regs(operands: str) -> Tuple[Optional[List[str]], str]:
+    """("{v0, v1}, Lx;->m()V") -> (["v0", "v1"], "Lx;->m()V"); a range mixing v and p registers -> None."""
+    close = operands.index("}")
+    inner = operands[operands.index("{") + 1:close].strip()
+    target = operands[close + 1:].lstrip(", ").strip()
+    if " .. " in inner:
+        first, last = inner.split(" .. ")
+        if first[0] != last[0]:
+            return None, target
+        return [f"{first[0]}{n}" for n in range(int(first[1:]), int(last[1:]) + 1)], target
+    return ([r.strip() for r in inner.split(",")] if inner else []), target
+
+
+def _wide(mnemonic: str) -> bool:
+    """Does the instruction write a register pair?"""
+    base = mnemonic.split("/")[0]
+    if "wide" in base:
+        return True
+    if "-to-" in base:
+        return base.split("-to-")[1] in ("long", "double")
+    if base.startswith("cmp"):
+        return False
+    return base.endswith("-long") or base.endswith("-double")
+
+
+def _next_reg(reg: str) -> str:
+    return f"{reg[0]}{int(reg[1:]) + 1}"
+
+
+def _array_payloads(body: List[BodyLine]) -> Dict[str, List[int]]:
+    """label -> elements of the .array-data blocks of a method"""
+    payloads: Dict[str, List[int]] = {}
+    label: Optional[str] = None
+    elems: Optional[List[int]] = None
+    for _, _, _, s in body:
+        if elems is not None:
+            if s.startswith(".end array-data"):
+                if label is not None:
+                    payloads[label] = elems
+                elems = None
+            else:
+                for tok in s.split():
+                    n = parse_int(tok)
+                    if n is not None:
+                        elems.append(n)
+        elif s.startswith(":"):
+            label = s.split()[0]
+        elif s.startswith(".array-data"):
+            elems = []
+    return payloads
+
+
+class _FileFlow:
+    """
+    What the methods of one class share: fields only ever set to one constant,
+    and calls between its own methods (constant arguments flow one call deep).
+    """
+
+    def __init__(self, class_desc: str, targets: Optional[Sequence[str]]) -> None:
+        self.class_desc = class_desc
+        self.targets = tuple(targets) if targets is not None else None
+        self.fields: Dict[str, Value] = {}
+        self.field_writes: Dict[str, List[Optional[Value]]] = {}  # until resolve_fields()
+        self.resolved = False
+        # per calling method: (callee name(params)ret, argument values)
+        self.calls: Dict[int, List[Tuple[str, List[Optional[Value]]]]] = {}
+
+    def index_method(
+        self,
+        k: int,
+        index: MethodIndex,
+        body: List[BodyLine],
+        params: Optional[Dict[str, Value]] = None,
+        record: bool = True,
+    ) -> None:
+        """
+        Linear register flow over the method body (branches are not followed: last
+        write wins). record: keep the calls it makes to other methods of the class.
+        """
+        payloads = _array_payloads(body) if any(s.startswith("fill-array-data") for *_, s in body) else {}
+        regs: Dict[str, Optional[Value]] = dict(params or {})
+        pending: Optional[Value] = None  # result of the previous invoke, for move-result
+        own_prefix = f"{self.class_desc}->"
+        index.invokes = []
+        calls: List[Tuple[str, List[Optional[Value]]]] = []
+
+        for line, start, end, s in body:
+            if s[0] in ".:#":
+                continue
+            mnemonic, _, operands = s.partition(" ")
+            result, pending = pending, None
+
+            if mnemonic.startswith("invoke-"):
+                try:
+                    reg_names, target = _invoke_regs(operands)
+                    if reg_names is None:
+                        continue
+                    slots = _param_slots(target, mnemonic.startswith("invoke-static"))
+                except ValueError:
+                    continue
+                values = [regs.get(r) for r in reg_names]
+                args = [values[n] if n < len(values) else None for n in slots]
+                consumer = self.targets is None or target.startswith(self.targets)
+                if consumer:
+                    index.invokes.append(InvokeSite(line, start, end, target, args))
+                if target.startswith(own_prefix):
+                    calls.append((target[len(own_prefix):], args))
+                for prefix, pos in PURE_TRANSFORMS:
+                    if target.startswith(prefix):
+                        src = values[pos] if pos < len(values) else None
+                        if src is not None and src[0] in ("string", "array", "derived"):
+                            pending = ("derived", src)
+                        break
+                if not consumer:
+                    # an array handed to other code may be filled there (SecureRandom.nextBytes, ...)
+                    for r, v in zip(reg_names, values):
+                        if v is not None and v[0] == "array":
+                            regs[r] = None
+                continue
+
+            reg, _, rest = operands.partition(",")
+            reg = reg.strip()
+            rest = rest.strip()
+            if not reg or reg[0] not in "vp":
+                continue
+
+            if mnemonic.startswith(("iput", "sput")):
+                if not self.resolved:
+                    self.field_writes.setdefault(rest.rsplit(",", 1)[-1].strip(), []).append(regs.get(reg))
+            elif mnemonic.startswith(("iget", "sget")):
+                regs[reg] = self.fields.get(rest.rsplit(",", 1)[-1].strip())
+                if mnemonic.endswith("-wide"):
+                    regs[_next_reg(reg)] = None
+            elif mnemonic.startswith("const-string"):
+                regs[reg] = ("string", unescape_smali(rest[1:-1])) if rest[:1] == '"' and rest[-1:] == '"' else None
+            elif mnemonic.startswith("const-wide") or mnemonic in ("const", "const/4", "const/16", "const/high16"):
+                n = parse_int(rest)
+                regs[reg] = ("int", n) if n is not None else None
+                if mnemonic.startswith("const-wide"):
+                    regs[_next_reg(reg)] = None
+            elif mnemonic.startswith("move-result"):
+                regs[reg] = result
+            elif mnemonic.startswith("move") and mnemonic != "move-exception":
+                regs[reg] = regs.get(rest)
+            elif mnemonic == "new-array":
+                regs[reg] = ("array", None) if rest.endswith("[B") or rest.endswith("[C") else None
+            elif mnemonic == "fill-array-data":
+                v = regs.get(reg)
+                if v is not None and v[0] == "array" and rest in payloads:
+                    regs[reg] = ("array", payloads[rest])
+            elif mnemonic.startswith("aput"):
+                # an element from unknown data (copy loop from a parameter, ...): the array is no longer constant
+                array = rest.split(",")[0].strip()
+                if regs.get(reg) is None and array in regs:
+                    regs[array] = None
+            elif not mnemonic.startswith(_NON_WRITERS):
+                regs[reg] = None
+                if _wide(mnemonic):
+                    regs[_next_reg(reg)] = None
+
+        if record:
+            self.calls[k] = calls
+
+    def resolve_fields(self) -> None:
+        """Fields whose every write (static initial value included) is the same constant."""
+        self.resolved = True
+        for field, writes in self.field_writes.items():
+            first = writes[0]
+            if first is not None and all(w == first for w in writes):
+                self.fields[field] = first
+
+    def reads_constant_field(self, body: List[BodyLine]) -> bool:
+        return any(
+            s.startswith(("iget", "sget")) and s.rsplit(",", 1)[-1].strip() in self.fields
+            for *_, s in body
+        )
+
+    def params_of(self, index: MethodIndex) -> Dict[str, Value]:
+        """p registers of the method receiving a constant from one of its callers in the class."""
+        try:
+            slots = _param_slots(index.name, index.static)
+        except ValueError:
+            return {}
+        params: Dict[str, Value] = {}
+        for calls in self.calls.values():
+            for callee, args in calls:
+                if callee != index.name:
+                    continue
+                for n, v in enumerate(args):
+                    if v is not None and n < len(slots):
+                        params.setdefault(f"p{slots[n]}", v)
+        return params
+
+
+def build_method_index(text: str, targets: Optional[Sequence[str]] = None) -> List[MethodIndex]:
+    """
+    One pass over a smali listing: per method, the invoke sites (only those whose
+    target starts with one of targets, if given) with the constant value, when
+    known, of each argument. Methods reading a constant field, or called with a
+    constant by another method of the class, are indexed again with those values.
+    """
+    methods: List[Tuple[MethodIndex, List[BodyLine]]] = []
+    current: Optional[MethodIndex] = None
+    body: List[BodyLine] = []
+    flow = _FileFlow("", targets)
+    start = 0
+    for n, raw in enumerate(text.split("\n"), 1):
+        end = start + len(raw)
+        s = raw.strip()
+        if s:
+            if current is not None:
+                if s.startswith(".end method"):
+                    methods.append((current, body))
+                    current = None
+                else:
+                    body.append((n, start, end, s))
+            elif s.startswith(".method"):
+                tokens = s.split()
+                current = MethodIndex(tokens[-1], n, "static" in tokens[1:-1])
+                body = []
+            elif s.startswith(".class"):
+                flow.class_desc = s.split()[-1]
+            elif s.startswith(".field") and " = " in s:
+                decl, _, value = s.partition(" = ")
+                if value[:1] == '"' and value[-1:] == '"':
+                    field = f"{flow.class_desc}->{decl.split()[-1]}"
+                    flow.field_writes.setdefault(field, []).append(("string", unescape_smali(value[1:-1])))
+        start = end + 1
+
+    for k, (index, body) in enumerate(methods):
+        flow.index_method(k, index, body)
+
+    flow.resolve_fields()
+    if flow.fields:
+        for k, (index, body) in enumerate(methods):
+            if flow.reads_constant_field(body):
+                flow.index_method(k, index, body)
+
+    for k, (index, body) in enumerate(methods):
+        params = flow.params_of(index)
+        if params:
+            flow.index_method(k, index, body, params, record=False)
+
+    return [index for index, _ in methods]
+
+
+def _string_of(value: Value) -> Optional[str]:
+    while value[0] == "derived":
+        value = value[1]
+    return value[1] if value[0] == "string" else None
+
+
+class MethodQueries:
+    """
+    METHOD_QUERY rules, evaluated on the method index of each file:
+
+        "query": {"invoke": "Ljavax/crypto/spec/SecretKeySpec;-><init>(",  # target prefix
+                  "arg": 0,                                   # declared parameter, `this` excluded
+                  "value": ["array", "derived"],              # constant kinds that match
+                  "pattern": "^AES$"}                         # optional, on the (source) string
+
+    Files not mentioning any queried class are not indexed.
+    """
+
+    def __init__(self, rules: List[Tuple[int, Dict[str, Any]]]) -> None:
+        self.queries: List[Tuple[int, str, int, Tuple[str, ...], Optional[re.Pattern]]] = []
+        for i, r in rules:
+            q = r.get("query") or {}
+            invoke = q.get("invoke", "")
+            if "->" not in invoke:
+                continue
+            pattern = re.compile(q["pattern"]) if q.get("pattern") else None
+            kinds = tuple(q.get("value") or CONSTANT_KINDS)
+            self.queries.append((i, invoke, int(q.get("arg", 0)), kinds, pattern))
+        self.targets = tuple(sorted({q[1] for q in self.queries}))
+        self.classes = tuple(sorted({t.split("->")[0] for t in self.targets}))
+
+    def scan(self, text: str) -> List[Tuple[int, int, int, int]]:
+        """(line, rule index, line start, line end) of each matching invoke site."""
+        if not self.queries or not any(c in text for c in self.classes):
+            return []
+        hits = []
+        for method in build_method_index(text, self.targets):
+            for site in method.invokes:
+                for i, invoke, arg, kinds, pattern in self.queries:
+                    if not site.target.startswith(invoke) or arg >= len(site.args):
+                        continue
+                    value = site.args[arg]
+                    if value is None or value[0] not in kinds:
+                        continue
+                    if pattern is not None:
+                        s = _string_of(value)
+                        if s is None or not pattern.search(s):
+                            continue
+                    hits.append((site.line, i, site.start, site.end))
+        return hits
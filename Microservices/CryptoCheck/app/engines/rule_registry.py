@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class RuleFile:
+    """
+    One version of a rule file: its content hash, parsed JSON, and what the
+    engines compiled from it (built on first use, then shared by every scan).
+    A scan keeps the RuleFile it started with, even if the file is reloaded.
+    """
+
+    def __init__(self, path: Path, raw: bytes, stamp: Tuple[int, int]) -> None:
+        self.path = path
+        self.hash = hashlib.sha256(raw).hexdigest()
+        self.data: Dict[str, Any] = json.loads(raw.decode("utf-8"))
+        self.stamp = stamp  # (mtime_ns, size) when read
+        self.loaded_at = time.time()
+        self._lock = threading.Lock()
+        self._compiled: Dict[Hashable, Any] = {}
+
+    @property
+    def rules(self) -> List[Dict[str, Any]]:
+        return self.data.get("rules", [])
+
+    def compiled(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key not in self._compiled:
+                self._compiled[key] = build()
+            return self._compiled[key]
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            compiled = len(self._compiled)
+        return {"hash": self.hash, "rules": len(self.rules), "loaded_at": self.loaded_at, "compiled": compiled}
+
+
+def _stamp(path: Path) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class RuleRegistry:
+    """
+    Process-wide rule files by path. get() stats the file (mtime + size) and
+    reads it again only if it changed; content with the same hash keeps the
+    compiled rules. A file that no longer parses keeps serving its last good
+    version (the error is reported by describe()). Per process: the service
+    runs one worker.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._files: Dict[str, RuleFile] = {}
+        self._errors: Dict[str, str] = {}
+        self.reloads = 0
+
+    def _load(self, path: Path, force: bool) -> RuleFile:
+        key = str(path)
+        with self._lock:
+            current = self._files.get(key)
+            try:
+                stamp = _stamp(path)
+                if current is not None and not force and stamp == current.stamp:
+                    return current
+                raw = path.read_bytes()
+                if current is not None and hashlib.sha256(raw).hexdigest() == current.hash:
+                    current.stamp = stamp
+                    return current
+                fresh = RuleFile(path, raw, stamp)
+            except (OSError, ValueError) as e:
+                if current is None:
+                    raise
+                self._errors[key] = f"{type(e).__name__}: {e}"
+                return current
+            self._files[key] = fresh
+            self._errors.pop(key, None)
+            if current is not None:
+                self.reloads += 1
+            return fresh
+
+    def get(self, path: Path) -> RuleFile:
+        return self._load(path, force=False)
+
+    def reload(self, path: Optional[Path] = None) -> Dict[str, Any]:
+        """Re-reads path (or every known file) whatever its mtime says."""
+        with self._lock:
+            paths = [path] if path is not None else [Path(p) for p in self._files]
+        for p in paths:
+            try:
+                self._load(p, force=True)
+            except (OSError, ValueError) as e:
+                with self._lock:
+                    self._errors[str(p)] = f"{type(e).__name__}: {e}"
+        return self.describe()
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            files = dict(self._files)
+            errors = dict(self._errors)
+        return {
+            "files": {p: {**f.describe(), "error": errors.get(p)} for p, f in files.items()},
+            "errors": {p: e for p, e in errors.items() if p not in files},
+            "reloads": self.reloads,
+        }
+
+
+# compiled rules shared by every scan of the process
+RULES = RuleRegistry()
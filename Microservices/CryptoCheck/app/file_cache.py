@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+from .db import DB_PATH
+
+FILE_CACHE_ENABLED = os.getenv("CC_FILE_CACHE", "1") == "1"
+# least recently used entries beyond this are dropped at startup
+FILE_CACHE_MAX_ROWS = int(os.getenv("CC_FILE_CACHE_MAX_ROWS", "500000"))
+
+_CHUNK = 500  # keys per IN (...) query
+
+
+def _chunks(items: List[str]) -> Iterable[List[str]]:
+    for i in range(0, len(items), _CHUNK):
+        yield items[i:i + _CHUNK]
+
+
+class FileResultCache:
+    """
+    SAST hits of one smali file keyed by (content sha256, rules fingerprint).
+    Between two builds of an app most smali files are byte-identical: only the
+    others are scanned again.
+    Values are the engine's hits as JSON; a file without hits is cached too.
+    """
+
+    def __init__(self, db_path: Path = DB_PATH) -> None:
+        self.db_path = db_path
+
+    def init(self) -> None:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cc_file_results (
+                    content_hash TEXT NOT NULL,
+                    rules_hash TEXT NOT NULL,
+                    hits_json TEXT NOT NULL,
+                    used_at INTEGER NOT NULL,
+                    PRIMARY KEY (content_hash, rules_hash)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cc_file_results_used ON cc_file_results (used_at)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_many(self, rules_hash: str, content_hashes: Iterable[str]) -> Dict[str, List[Any]]:
+        keys = sorted(set(content_hashes))
+        found: Dict[str, List[Any]] = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for chunk in _chunks(keys):
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT content_hash, hits_json FROM cc_file_results WHERE rules_hash = ? AND content_hash IN ({marks})",
+                    (rules_hash, *chunk),
+                )
+                for content_hash, hits_json in rows:
+                    found[content_hash] = json.loads(hits_json)
+            now = int(time.time())
+            for chunk in _chunks(sorted(found)):
+                marks = ",".join("?" * len(chunk))
+                conn.execute(
+                    f"UPDATE cc_file_results SET used_at = ? WHERE rules_hash = ? AND content_hash IN ({marks})",
+                    (now, rules_hash, *chunk),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        return found
+
+    def put_many(self, rules_hash: str, results: Dict[str, List[Any]]) -> None:
+        if not results:
+            return
+        now = int(time.time())
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cc_file_results(content_hash, rules_hash, hits_json, used_at) VALUES (?, ?, ?, ?)",
+                [(h, rules_hash, json.dumps(hits), now) for h, hits in results.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def prune(self, max_rows: int = FILE_CACHE_MAX_ROWS) -> int:
+        """Drops the least recently used entries beyond max_rows; returns how many."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            (count,) = conn.execute("SELECT COUNT(*) FROM cc_file_results").fetchone()
+            if count <= max_rows:
+                return 0
+            cur = conn.execute(
+                """
+                DELETE FROM cc_file_results WHERE (content_hash, rules_hash) IN (
+                    SELECT content_hash, rules_hash FROM cc_file_results ORDER BY used_at LIMIT ?
+                )
+                """,
+                (count - max_rows,),
+            )
+            conn.commit()
+            return cur.rowcount
+        finally:
+            conn.close()
+
@@ -1,35 +1,144 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 
-from fastapi import FastAPI, File, Form, UploadFile
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 
-from .db import init_db, save_scan, get_scan, list_scans, UPLOADS_DIR
-from .scanner import scan_crypto
+from .aggregate import AGGREGATE_ENABLED, aggregate_payload
+from .apktool_executor import ApktoolBusy
+from .db import init_db, save_scan, get_scan, get_locations, list_scans, find_completed_scan, UPLOADS_DIR
+from .engines.apktool_engine import ApktoolCancelled
+from .engines.rule_registry import RULES
+from .scanner import APKTOOL, FILE_CACHE, WORKDIRS, apktool_expected, rules_hash, scan_crypto
+from .singleflight import SingleFlight
+from .streaming import stream_scan, wants_ndjson
+from .utils import ensure_dir
 
 app = FastAPI(title="CryptoCheck", version="1.0")
 
+# one pipeline per APK at a time: WORK_DIR/<sha256> (apktool output) is shared by every scan of it
+SCANS_IN_FLIGHT = SingleFlight()
+
+DISCONNECT_POLL_S = 1.0
+MAX_LOCATIONS_PAGE = 1000
+
+def _store_upload(file: UploadFile) -> Tuple[Path, str]:
+    """Hashes while copying; the APK lands in UPLOADS_DIR/<sha256>/<name>, never over another upload."""
+    h = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(dir=UPLOADS_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+                h.update(chunk)
+                out.write(chunk)
+        sha256 = h.hexdigest()
+        # one dir per APK hash: concurrent uploads never overwrite a file being scanned
+        apk_dir = Path(UPLOADS_DIR) / sha256
+        ensure_dir(apk_dir)
+        apk_path = apk_dir / (Path(file.filename or "upload.apk").name or "upload.apk")
+        if not apk_path.exists():
+            os.replace(tmp_name, apk_path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+    return apk_path, sha256
+
+def _deduplicated(payload: Dict[str, Any], source: str) -> Dict[str, Any]:
+    """Copy of a shared / stored payload, marked with where it came from (in_flight | completed)."""
+    meta = dict(payload.get("meta") or {})
+    meta["context"] = {**(meta.get("context") or {}), "deduplicated": source}
+    return {**payload, "meta": meta}
+
+def _busy(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        {"error": f"apktool queue full, retry after {retry_after}s", "retry_after": retry_after},
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+    )
+
+async def _watch_disconnect(request: Request, gone: threading.Event) -> None:
+    """Sets gone when the client closes the connection while its scan runs in a thread."""
+    while not gone.is_set():
+        if await request.is_disconnected():
+            gone.set()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
 @app.on_event("startup")
 def _startup():
     init_db()
+    if FILE_CACHE is not None:
+        FILE_CACHE.init()
+        FILE_CACHE.prune()
 
 @app.post("/scan-crypto")
 async def scan_crypto_endpoint(
+    request: Request,
     file: UploadFile = File(...),
     parent_scan_id: Optional[int] = Form(default=None),
+    force: bool = Form(default=False),
 ): #enable_apktool: bool = Form(default=True)
-    apk_path = Path(UPLOADS_DIR) / file.filename
-    content = await file.read()
-    apk_path.write_bytes(content)
-
-    payload = scan_crypto(
-        apk_path=apk_path,
-        parent_scan_id=parent_scan_id,
-        enable_apktool=True,
-    )
-    scan_id = save_scan(payload)
-    payload["scan_id"] = scan_id
-    return JSONResponse(payload)
+    # Save upload to disk (blocking hash + copy: off the event loop)
+    apk_path, sha256 = await run_in_threadpool(_store_upload, file)
+
+    config_hash = rules_hash(enable_apktool=True)
+    gone = threading.Event()
+
+    def _cancelled() -> bool:
+        # a scan other requests are waiting for (in flight) keeps going
+        return gone.is_set() and not SCANS_IN_FLIGHT.waiting(sha256)
+
+    def _run(on_finding=None):
+        # same APK + same rules already scanned: answer from storage (force=true rescans)
+        if not force:
+            done = find_completed_scan(sha256, config_hash)
+            if done is not None:
+                return _deduplicated(done, "completed")
+
+        def _scan_and_store():
+            payload = scan_crypto(
+                apk_path=apk_path,
+                parent_scan_id=parent_scan_id,
+                enable_apktool=True,
+                # aggregated: the stream sends the groups once the scan is done
+                on_finding=None if AGGREGATE_ENABLED else on_finding,
+                sha256=sha256,
+                cancelled=_cancelled,
+            )
+            locations = aggregate_payload(payload) if AGGREGATE_ENABLED else None
+            scan_id = save_scan(payload, locations)
+            payload["scan_id"] = scan_id
+            return payload
+
+        # the same APK is being scanned: wait for that scan instead of starting another one
+        payload, shared = SCANS_IN_FLIGHT.run(sha256, _scan_and_store)
+        return _deduplicated(payload, "in_flight") if shared else payload
+
+    if wants_ndjson(request):
+        # the status line is sent before the scan starts: reject now rather than mid-stream
+        if apktool_expected():
+            try:
+                APKTOOL.check_room()
+            except ApktoolBusy as e:
+                return _busy(e.retry_after)
+        return stream_scan(_run, lambda payload: payload)
+
+    watcher = asyncio.create_task(_watch_disconnect(request, gone))
+    try:
+        return JSONResponse(await run_in_threadpool(_run))
+    except ApktoolBusy as e:
+        return _busy(e.retry_after)
+    except ApktoolCancelled:
+        # nobody is left to read it; nothing was stored
+        return JSONResponse({"error": "client disconnected, scan cancelled"}, status_code=499)
+    finally:
+        watcher.cancel()
 
 @app.get("/scans/{scan_id}")
 def get_scan_endpoint(scan_id: int):
@@ -38,6 +147,39 @@ def get_scan_endpoint(scan_id: int):
         return JSONResponse({"error": "not found"}, status_code=404)
     return data
 
+@app.get("/scans/{scan_id}/groups/{group}/locations")
+def group_locations_endpoint(scan_id: int, group: int, offset: int = 0, limit: int = 100):
+    """
+    Every location of one aggregated finding group (evidence.group), paged.
+    truncated: only the first CC_AGGREGATE_STORED of the group's total were stored.
+    """
+    limit = max(1, min(limit, MAX_LOCATIONS_PAGE))
+    offset = max(0, offset)
+    total, stored, items = get_locations(scan_id, group, offset=offset, limit=limit)
+    if not total:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return {
+        "scan_id": scan_id, "group": group, "total": total, "stored": stored, "truncated": stored < total,
+        "offset": offset, "limit": limit, "items": items,
+    }
+
 @app.get("/scans")
 def list_scans_endpoint(limit: int = 20):
     return {"items": list_scans(limit=limit)}
+
+@app.get("/rules")
+def rules_endpoint():
+    return RULES.describe()
+
+@app.post("/rules/reload")
+def rules_reload_endpoint():
+    """Re-reads the rule files now (they are otherwise reloaded when their mtime changes)."""
+    return RULES.reload()
+
+@app.get("/apktool")
+def apktool_endpoint():
+    return APKTOOL.stats()
+
+@app.get("/workdirs")
+def workdirs_endpoint():
+    return {**WORKDIRS.stats(), "scans_in_flight": SCANS_IN_FLIGHT.running(), "shared_scans": SCANS_IN_FLIGHT.shared}
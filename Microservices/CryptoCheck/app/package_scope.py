@@ -0,0 +1,116 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# opt-in: the exclude presets drop every finding inside third-party SDKs
+PACKAGE_SCOPE_ENABLED = os.getenv("CC_PACKAGE_SCOPE", "0") == "1"
+DEFAULT_SCOPE = Path(os.getenv("CC_PACKAGE_SCOPE_CONFIG", str(Path("config") / "package_scope.json")))
+
+INCLUDE = "include"
+EXCLUDE = "exclude"
+
+
+def package_parts(prefix: str) -> List[str]:
+    """Segments of a prefix: "com/google/" or "com.google" -> ["com", "google"]."""
+    return [p for p in prefix.replace(".", "/").split("/") if p]
+
+
+class _Node:
+    __slots__ = ("children", "action", "include_below")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.action: Optional[str] = None
+        self.include_below = False  # an include prefix somewhere under this node
+
+
+class PackageScope:
+    """
+    Include / exclude package prefixes in a trie over path segments ("com/google"
+    never matches "com/googlex"). The longest matching prefix decides; classes
+    matching none are scanned. Lets the walkers drop a whole excluded subtree
+    (directory, DEX classes) without reading it.
+    """
+
+    def __init__(self, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> None:
+        self.root = _Node()
+        self.include = sorted({"/".join(package_parts(p)) for p in include} - {""})
+        self.exclude = sorted({"/".join(package_parts(p)) for p in exclude} - {""})
+        for prefix in self.exclude:
+            self._add(prefix, EXCLUDE)
+        for prefix in self.include:  # same prefix in both: include wins
+            self._add(prefix, INCLUDE)
+
+    def _add(self, prefix: str, action: str) -> None:
+        node = self.root
+        path = [node]
+        for part in prefix.split("/"):
+            node = node.children.setdefault(part, _Node())
+            path.append(node)
+        node.action = action
+        if action == INCLUDE:
+            for parent in path[:-1]:
+                parent.include_below = True
+
+    def _decide(self, parts: Sequence[str]) -> Tuple[Optional[str], Optional[_Node]]:
+        """(decision of the longest matching prefix, deepest trie node reached or None if the path left the trie)"""
+        node = self.root
+        decision = node.action
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                return decision, None
+            if node.action is not None:
+                decision = node.action
+        return decision, node
+
+    def is_scanned(self, class_path: str) -> bool:
+        """class_path is slash-separated, e.g. com/google/foo/Bar."""
+        decision, _ = self._decide(class_path.split("/"))
+        return decision != EXCLUDE
+
+    def skips_subtree(self, parts: Sequence[str]) -> bool:
+        """True if no class under the package can be scanned."""
+        decision, node = self._decide(parts)
+        return decision == EXCLUDE and (node is None or not node.include_below)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"include": self.include, "exclude_prefixes": len(self.exclude)}
+
+
+def load_scope(
+    app_package: Optional[str] = None,
+    path: Path = DEFAULT_SCOPE,
+) -> Optional[PackageScope]:
+    """
+    Scope from config/package_scope.json: exclude_presets expanded from presets,
+    plus exclude / include lists. With include_app_package, the APK's own
+    package is never excluded (e.g. an app under com/google/). None if disabled
+    or unreadable.
+    """
+    if not PACKAGE_SCOPE_ENABLED:
+        return None
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+    presets: Dict[str, List[str]] = data.get("presets", {})
+    exclude: List[str] = list(data.get("exclude", []))
+    for name in data.get("exclude_presets", []):
+        exclude.extend(presets.get(name, []))
+    include: List[str] = list(data.get("include", []))
+    if app_package and data.get("include_app_package", True):
+        include.append(app_package)
+    return PackageScope(include=include, exclude=exclude)
+
+
+def scope_config_bytes(path: Path = DEFAULT_SCOPE) -> bytes:
+    """What the scope depends on, for the scan rules hash."""
+    if not PACKAGE_SCOPE_ENABLED:
+        return b"scope=off"
+    try:
+        return path.read_bytes()
+    except OSError:
+        return b"scope=missing"
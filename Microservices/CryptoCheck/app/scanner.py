@@ -1,59 +1,194 @@
+import hashlib
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from androguard.core.apk import APK
 
+from .aggregate import AGGREGATE_BY, AGGREGATE_ENABLED
+from .apktool_executor import ApktoolExecutor
 from .db import WORK_DIR
-from .utils import Timer, ensure_dir, sha256_file
-from .engines.apktool_engine import apktool_decode
+from .file_cache import FILE_CACHE_ENABLED, FileResultCache
+from .package_scope import load_scope, scope_config_bytes
+from .utils import Timer, sha256_file
+from .workdir_cache import WorkDirCache, WorkDirEntry
+from .engines.dex_engine import SMALI_ONLY, run_dex_sast
+from .engines.rule_registry import RULES, RuleFile
 from .engines.smali_sast_engine import run_smali_sast
 
 SERVICE_NAME = "CryptoCheck"
 
+WORKDIRS = WorkDirCache(WORK_DIR)
+
+# per-file SAST results, shared by the rescans of every version of an app (CC_FILE_CACHE)
+FILE_CACHE: Optional[FileResultCache] = FileResultCache() if FILE_CACHE_ENABLED else None
+
+# concurrency limit, wait queue and timeout shared by every apktool decode (CC_APKTOOL_*)
+APKTOOL = ApktoolExecutor()
+
+DEFAULT_RULES = Path("config") / "crypto_rules.json"
+
+# auto: rules evaluated on the DEX, apktool + smali only for smali-only rules (or if the DEX cannot be read)
+# dex: DEX only, smali-only rules are skipped | smali: apktool + smali for every rule
+ENGINE = os.getenv("CC_ENGINE", "auto")
+
 def _get_package(apk_path: Path) -> Optional[str]:
     try:
         return APK(str(apk_path)).get_package()
     except Exception:
         return None
 
+def _apktool_cached(
+    entry: WorkDirEntry, apk_path: Path, cancelled: Optional[Callable[[], bool]] = None
+) -> Tuple[bool, Optional[str], bool, int]:
+    """Returns (ok, error, reused, queued_ms). A previous decode is reused only if it completed."""
+    if entry.reuse("apktool") is not None:
+        return True, None, True, 0
+    ok, err, queued_ms = APKTOOL.decode(apk_path, entry.path / "apktool_out", cancelled=cancelled)
+    if ok:
+        entry.mark_done("apktool", verify=["apktool_out/apktool.yml"])
+    return ok, err, False, queued_ms
+
+def apktool_expected(rules_path: Optional[Path] = None) -> bool:
+    """Whether a scan with these rules decodes with apktool (unless the DEX cannot be read)."""
+    if ENGINE == "smali":
+        return True
+    if ENGINE == "dex":
+        return False
+    try:
+        rule_file = RULES.get(rules_path or DEFAULT_RULES)
+        return rule_file.compiled("smali_only", lambda: any(r.get("engine") == SMALI_ONLY for r in rule_file.rules))
+    except Exception:
+        return True
+
+def rules_hash(
+    rules_path: Optional[Path] = None,
+    enable_apktool: bool = True,
+    engine: str = ENGINE,
+    aggregate: Optional[str] = AGGREGATE_BY if AGGREGATE_ENABLED else None,
+) -> str:
+    """
+    Identifies what a scan looked for and how it reports it: rule file content +
+    engine mode + package scope + whether smali came from apktool + aggregated findings.
+    """
+    h = hashlib.sha256(f"apktool={int(enable_apktool)}\0engine={engine}\0aggregate={aggregate or ''}\0".encode("utf-8"))
+    h.update(scope_config_bytes())
+    h.update(b"\0")
+    try:
+        h.update(RULES.get(rules_path or DEFAULT_RULES).hash.encode("ascii"))
+    except (OSError, ValueError):
+        pass
+    return h.hexdigest()
+
 def scan_crypto(
     apk_path: Path,
     parent_scan_id: Optional[int],
     rules_path: Optional[Path] = None,
     enable_apktool: bool = True,
+    on_finding: Optional[Callable[[Dict[str, Any]], None]] = None,
+    sha256: Optional[str] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
 ) -> Dict[str, Any]:
+    """
+    on_finding (streaming mode) receives each finding as the SAST engine produces it.
+    sha256 (already computed at upload) skips hashing the APK again.
+    cancelled is polled while apktool is queued / running (ApktoolCancelled aborts the scan).
+    """
     timer = Timer()
-    sha256 = sha256_file(apk_path)
+    sha256 = sha256 or sha256_file(apk_path)
     package = _get_package(apk_path)
 
-    work_dir = WORK_DIR / sha256
-    ensure_dir(work_dir)
+    with WORKDIRS.use(sha256) as entry:
+        return _scan_in_workdir(
+            entry, timer, apk_path, sha256, package, parent_scan_id, rules_path, enable_apktool, on_finding,
+            cancelled,
+        )
+
+def _scan_in_workdir(
+    entry: WorkDirEntry,
+    timer: Timer,
+    apk_path: Path,
+    sha256: str,
+    package: Optional[str],
+    parent_scan_id: Optional[int],
+    rules_path: Optional[Path],
+    enable_apktool: bool,
+    on_finding: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+) -> Dict[str, Any]:
+    # WORK_DIR/<sha256> is kept between scans: a completed apktool decode is reused
+    work_dir = entry.path
 
-    scan_root = work_dir
+    scan_root: Optional[Path] = None
     apktool_ok = False
     apktool_error: Optional[str] = None
-
-    if enable_apktool:
-        out_dir = work_dir / "apktool_out"
-        apktool_ok, apktool_error = apktool_decode(apk_path, out_dir)
-        if apktool_ok:
-            scan_root = out_dir
+    apktool_reused = False
+    apktool_queued_ms = 0
 
     if rules_path is None:
-        rules_path = Path("config") / "crypto_rules.json"
+        rules_path = DEFAULT_RULES
+    # one version of the rules for the whole scan, even if the file is reloaded meanwhile
+    try:
+        rule_file: Optional[RuleFile] = RULES.get(rules_path)
+    except (OSError, ValueError):
+        rule_file = None  # reported by the engines
 
     engines_ok: List[str] = []
     engine_errors: List[str] = []
     findings_list: List[Dict[str, Any]] = []
+    sast_stats: Optional[Dict[str, Any]] = None
+    dex_stats: Optional[Dict[str, Any]] = None
+    dex_error: Optional[str] = None
+    skipped_rules: List[str] = []
+    # third-party packages left out (config/package_scope.json); the app's own package is always scanned
+    scope = load_scope(package)
 
-    try:
-        out = run_smali_sast(scan_root, rules_path)
-        findings_list.extend(out.get("findings", []))
-        engines_ok.append("smali_sast")
-        if enable_apktool and apktool_ok:
-            engines_ok.append("apktool")
-    except Exception as e:
-        engine_errors.append(f"sast failed: {e}")
+    # rules left to the smali engine: None = all of them
+    smali_rules: Optional[List[str]] = None
+    if ENGINE in ("auto", "dex"):
+        try:
+            out = run_dex_sast(apk_path, rules_path, on_finding=on_finding, scope=scope, rule_file=rule_file)
+            findings_list.extend(out.get("findings", []))
+            dex_stats = out.get("stats")
+            smali_rules = out.get("smali_rules", [])
+            engines_ok.append("dex_sast")
+        except Exception as e:
+            dex_error = f"dex failed: {e}"
+            if ENGINE == "dex":
+                engine_errors.append(dex_error)
+
+    if ENGINE == "dex":
+        skipped_rules = smali_rules or []
+    elif smali_rules is None or smali_rules:
+        scan_root = work_dir
+        if enable_apktool:
+            apktool_ok, apktool_error, apktool_reused, apktool_queued_ms = _apktool_cached(entry, apk_path, cancelled)
+            if apktool_ok:
+                scan_root = work_dir / "apktool_out"
+
+        try:
+            out = run_smali_sast(
+                scan_root, rules_path, on_finding=on_finding, rule_ids=smali_rules, cache=FILE_CACHE, scope=scope,
+                rule_file=rule_file,
+            )
+            findings_list.extend(out.get("findings", []))
+            sast_stats = out.get("stats")
+            engines_ok.append("smali_sast")
+            if enable_apktool and apktool_ok:
+                engines_ok.append("apktool")
+        except Exception as e:
+            engine_errors.append(f"sast failed: {e}")
+
+    scope_stats: Optional[Dict[str, Any]] = None
+    if scope is not None:
+        walked = dex_stats or sast_stats or {}
+        scope_stats = {
+            "classes_scanned": walked.get("classes", walked.get("files", 0)),
+            # smali walk: files excluded one by one; pruned directories are not listed, see dirs_skipped
+            "classes_skipped": walked.get("skipped_classes", walked.get("skipped_files", 0)),
+            "dirs_skipped": walked.get("skipped_dirs"),
+            **scope.describe(),
+        }
 
     status = "COMPLETED" if engines_ok else "FAILED"
     error = "; ".join(engine_errors) if engine_errors else None
@@ -69,14 +204,31 @@ def scan_crypto(
             "error": error,
             "duration_ms": timer.ms(),
             "engine": engines_ok,
+            # sha256 of the rule file the findings come from (GET /rules)
+            "ruleset_hash": rule_file.hash if rule_file is not None else None,
             "context": {
                 "file_name": apk_path.name,
                 "sha256": sha256,
-                "scan_root": str(scan_root),
+                "engine_mode": ENGINE,
+                # None when every rule ran on the DEX (no apktool decode)
+                "scan_root": str(scan_root) if scan_root else None,
                 "apktool_enabled": enable_apktool,
                 "apktool_ok": apktool_ok,
                 "apktool_error": apktool_error,
+                "apktool_reused": apktool_reused,
+                # time spent waiting for an apktool slot
+                "apktool_queued_ms": apktool_queued_ms,
                 "findings_count": len(findings_list),
+                "rules_hash": rules_hash(rules_path, enable_apktool),
+                # files, workers, per-shard timing (slowest first) and file cache hit rate of the SAST pass
+                "sast": sast_stats,
+                # dex files, classes, methods and rendered lines of the DEX pass
+                "dex": dex_stats,
+                "dex_error": dex_error,
+                # classes scanned / skipped by the package scope, None if disabled
+                "scope": scope_stats,
+                # smali-only rules not evaluated (CC_ENGINE=dex)
+                "skipped_rules": skipped_rules,
             },
         },
     }
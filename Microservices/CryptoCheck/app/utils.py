@@ -1,10 +1,14 @@
 import hashlib
 import time
+from datetime import datetime, timezone
 from pathlib import Path
 
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
+def utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
 def sha256_file(path: Path) -> str:
     h = hashlib.sha256()
     with path.open("rb") as f:
@@ -0,0 +1,253 @@
+import struct
+import zipfile
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from app.engines.dex_engine import OPCODE_WIDTH, DexFile, run_dex_sast
+from app.engines.smali_sast_engine import run_smali_sast
+
+RULES = Path(__file__).resolve().parents[1] / "config" / "crypto_rules.json"
+
+CIPHER_GET_INSTANCE = "Ljavax/crypto/Cipher;->getInstance(Ljava/lang/String;)Ljavax/crypto/Cipher;"
+
+
+def _uleb(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+class _DexBuilder:
+    """Just enough of the DEX format for DexFile: id tables, one class, its code item."""
+
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self.types: List[int] = []
+        self.protos: List[Tuple[int, int, Tuple[int, ...]]] = []
+        self.fields: List[Tuple[int, int, int]] = []
+        self.methods: List[Tuple[int, int, int]] = []
+
+    def string(self, s: str) -> int:
+        if s not in self.strings:
+            self.strings.append(s)
+        return self.strings.index(s)
+
+    def type(self, desc: str) -> int:
+        idx = self.string(desc)
+        if idx not in self.types:
+            self.types.append(idx)
+        return self.types.index(idx)
+
+    def proto(self, ret: str, params: Tuple[str, ...] = ()) -> int:
+        key = (self.string("V"), self.type(ret), tuple(self.type(p) for p in params))
+        if key not in self.protos:
+            self.protos.append(key)
+        return self.protos.index(key)
+
+    def field(self, cls: str, name: str, type_: str) -> int:
+        self.fields.append((self.type(cls), self.type(type_), self.string(name)))
+        return len(self.fields) - 1
+
+    def method(self, cls: str, name: str, ret: str, params: Tuple[str, ...] = ()) -> int:
+        self.methods.append((self.type(cls), self.proto(ret, params), self.string(name)))
+        return len(self.methods) - 1
+
+    def build(self, cls: str, static_field: Tuple[int, str], method: Tuple[int, List[int], int]) -> bytes:
+        """static_field: (field idx, string value); method: (method idx, insns, registers)."""
+        class_idx, super_idx = self.type(cls), self.type("Ljava/lang/Object;")
+        value_idx = self.string(static_field[1])
+        sizes = (len(self.strings), len(self.types), len(self.protos), len(self.fields), len(self.methods), 1)
+        offs, off = [], 0x70
+        for size, width in zip(sizes, (4, 4, 12, 8, 8, 32)):
+            offs.append(off)
+            off += size * width
+        data = bytearray(off)
+
+        def align() -> None:
+            data.extend(b"\x00" * (-len(data) % 4))
+
+        string_offs = []
+        for s in self.strings:
+            string_offs.append(len(data))
+            data += _uleb(len(s)) + s.encode() + b"\x00"
+        align()
+        params_offs = []
+        for _, _, params in self.protos:
+            if params:
+                params_offs.append(len(data))
+                data += struct.pack(f"<I{len(params)}H", len(params), *params)
+                align()
+            else:
+                params_offs.append(0)
+        method_idx, insns, registers = method
+        code_off = len(data)
+        data += struct.pack("<4HII", registers, 0, 1, 0, 0, len(insns)) + struct.pack(f"<{len(insns)}H", *insns)
+        align()
+        static_values_off = len(data)
+        data += _uleb(1) + bytes([(0 << 5) | 0x17, value_idx])  # encoded_array of one string (1 byte index)
+        class_data_off = len(data)
+        data += _uleb(1) + _uleb(0) + _uleb(1) + _uleb(0)
+        data += _uleb(static_field[0]) + _uleb(0x19)  # public static final
+        data += _uleb(method_idx) + _uleb(0x9) + _uleb(code_off)  # public static
+
+        struct.pack_into("<8s", data, 0, b"dex\n035\x00")
+        struct.pack_into("<12I", data, 0x38, *(v for pair in zip(sizes, offs) for v in pair))
+        for k, s_off in enumerate(string_offs):
+            struct.pack_into("<I", data, offs[0] + 4 * k, s_off)
+        for k, t in enumerate(self.types):
+            struct.pack_into("<I", data, offs[1] + 4 * k, t)
+        for k, (shorty, ret, _) in enumerate(self.protos):
+            struct.pack_into("<3I", data, offs[2] + 12 * k, shorty, ret, params_offs[k])
+        for k, (c, t, n) in enumerate(self.fields):
+            struct.pack_into("<HHI", data, offs[3] + 8 * k, c, t, n)
+        for k, (c, p, n) in enumerate(self.methods):
+            struct.pack_into("<HHI", data, offs[4] + 8 * k, c, p, n)
+        struct.pack_into("<8I", data, offs[5], class_idx, 0x1, super_idx, 0, 0, 0, class_data_off, static_values_off)
+        return bytes(data)
+
+
+def _fixture() -> bytes:
+    b = _DexBuilder()
+    cls = "Lcom/example/Crypto;"
+    key = b.field(cls, "KEY", "Ljava/lang/String;")
+    enc = b.method(cls, "enc", "V")
+    get_instance = b.method("Ljavax/crypto/Cipher;", "getInstance", "Ljavax/crypto/Cipher;", ("Ljava/lang/String;",))
+    transformation, md5, byte_array = b.string("AES/ECB/PKCS5Padding"), b.string("MD5"), b.type("[B")
+    insns = [
+        0x1012,                                  # 0   const/4 v0, 0x1
+        0x0113, 0x03E8,                          # 1   const/16 v1, 0x3e8
+        0x0218, 0x7788, 0x5566, 0x3344, 0x1122,  # 3   const-wide v2, 0x1122334455667788L
+        0x001A, transformation,                  # 8   const-string v0, "AES/ECB/PKCS5Padding"
+        0x1071, get_instance, 0x0000,            # 10  invoke-static {v0}, Cipher.getInstance
+        0x000C,                                  # 13  move-result-object v0
+        0x01D8, 0x1001,                          # 14  add-int/lit8 v1, v1, 0x10
+        0x1323, byte_array,                      # 16  new-array v3, v1, [B
+        0x0326, 10, 0,                           # 18  fill-array-data v3, +10
+        0x012B, 13, 0,                           # 21  packed-switch v1, +13
+        0x001A, md5,                             # 24  const-string v0, "MD5"
+        0x000E,                                  # 26  return-void
+        0x0000,                                  # 27  nop (payload alignment)
+        # 28  array payload: its bytes read as opcodes would be const-string / invoke-virtual
+        0x0300, 1, 4, 0, 0x001A, 0x016E,
+        # 34  packed-switch payload, keys / targets that look like opcodes too
+        0x0100, 2, 0x001A, 0, 0x0071, 0, 0x0022, 0,
+    ]
+    return b.build(cls, (key, "0123456789abcdef"), (enc, insns, 4))
+
+
+SMALI = """.class public Lcom/example/Crypto;
+.super Ljava/lang/Object;
+.source "Crypto.java"
+
+
+# static fields
+.field public static final KEY:Ljava/lang/String; = "0123456789abcdef"
+
+
+# direct methods
+.method public static enc()V
+    .registers 4
+
+    const/4 v0, 0x1
+
+    const/16 v1, 0x3e8
+
+    const-wide v2, 0x1122334455667788L
+
+    const-string v0, "AES/ECB/PKCS5Padding"
+
+    invoke-static {v0}, Ljavax/crypto/Cipher;->getInstance(Ljava/lang/String;)Ljavax/crypto/Cipher;
+
+    move-result-object v0
+
+    add-int/lit8 v1, v1, 0x10
+
+    new-array v3, v1, [B
+
+    fill-array-data v3, :array_0
+
+    packed-switch v1, :pswitch_data_0
+
+    const-string v0, "MD5"
+
+    :pswitch_0
+    :pswitch_1
+    return-void
+
+    nop
+
+    :array_0
+    .array-data 1
+        0x1at
+        0x0t
+        0x6et
+        0x1t
+    .end array-data
+
+    :pswitch_data_0
+    .packed-switch 0x1a
+        :pswitch_0
+        :pswitch_1
+    .end packed-switch
+.end method
+"""
+
+
+def test_opcode_widths():
+    assert [OPCODE_WIDTH[op] for op in (0x12, 0x13, 0x18, 0x1A, 0x1B, 0x26, 0x2B, 0x6E, 0x74, 0xD8)] == [
+        1, 2, 5, 2, 3, 3, 3, 3, 3, 2,
+    ]
+
+
+def test_render_skips_payloads():
+    ((desc, text, methods),) = DexFile(_fixture()).render_classes()
+    assert desc == "Lcom/example/Crypto;"
+    assert text.split("\n") == [
+        ".class Lcom/example/Crypto;",
+        ".super Ljava/lang/Object;",
+        '.field public static final KEY:Ljava/lang/String; = "0123456789abcdef"',
+        ".method public static enc()V",
+        "    const/4 v0, 0x1",
+        "    const/16 v1, 0x3e8",
+        "    const-wide v2, 0x1122334455667788L",
+        '    const-string v0, "AES/ECB/PKCS5Padding"',
+        f"    invoke-static {{v0}}, {CIPHER_GET_INSTANCE}",
+        "    move-result-object v0",
+        "    add-int/lit8 v1",
+        "    new-array v3, v1, [B",
+        "    fill-array-data v3, :array_1c",
+        '    const-string v0, "MD5"',
+        "    :array_1c",
+        "    .array-data 1",
+        "        0x1at",
+        "        0x0t",
+        "        0x6et",
+        "        0x1t",
+        "    .end array-data",
+        ".end method",
+    ]
+    assert methods == [(4, "enc()V")]
+
+
+def test_same_rule_ids_as_smali(tmp_path):
+    apk = tmp_path / "fixture.apk"
+    with zipfile.ZipFile(apk, "w") as z:
+        z.writestr("classes.dex", _fixture())
+    smali_dir = tmp_path / "apktool_out" / "smali" / "com" / "example"
+    smali_dir.mkdir(parents=True)
+    (smali_dir / "Crypto.smali").write_text(SMALI, encoding="utf-8")
+
+    dex = run_dex_sast(apk, RULES)
+    smali = run_smali_sast(tmp_path / "apktool_out", RULES, workers=1)
+    smali_only = set(dex["smali_rules"])
+    dex_ids: Dict[str, int] = Counter(f["id"] for f in dex["findings"])
+    smali_ids: Dict[str, int] = Counter(f["id"] for f in smali["findings"] if f["id"] not in smali_only)
+    assert dex_ids  # the fixture hits ECB, MD5, ...
+    assert dex_ids == smali_ids
+    assert {f["evidence"]["file"] for f in dex["findings"]} == {"classes.dex"}
+    assert {f["evidence"]["class"] for f in dex["findings"]} == {"Lcom/example/Crypto;"}
@@ -0,0 +1,67 @@
+from app.engines.method_index import build_method_index
+
+TARGET = "Ljavax/crypto/spec/SecretKeySpec;-><init>("
+
+HEADER = """
+.class public Lcom/example/Crypto;
+.super Ljava/lang/Object;
+"""
+
+
+def _key_arg(body: str):
+    text = HEADER + f"""
+.method public static key([B)Ljavax/crypto/spec/SecretKeySpec;
+    .registers 6
+{body}
+    new-instance v0, Ljavax/crypto/spec/SecretKeySpec;
+    const-string v4, "AES"
+    invoke-direct {{v0, v1, v4}}, Ljavax/crypto/spec/SecretKeySpec;-><init>([BLjava/lang/String;)V
+    return-object v0
+.end method
+"""
+    (index,) = build_method_index(text, [TARGET])
+    (site,) = index.invokes
+    return site.args[0]
+
+
+def test_array_copied_from_parameter_is_not_constant():
+    body = """
+    const/16 v0, 0x10
+    new-array v1, v0, [B
+    const/4 v2, 0x0
+    :loop
+    if-ge v2, v0, :done
+    aget-byte v3, p0, v2
+    aput-byte v3, v1, v2
+    add-int/lit8 v2, v2, 0x1
+    goto :loop
+    :done
+"""
+    assert _key_arg(body) is None
+
+
+def test_array_filled_with_constants_stays_constant():
+    body = """
+    const/16 v0, 0x10
+    new-array v1, v0, [B
+    const/4 v2, 0x0
+    const/4 v3, 0x7
+    aput-byte v3, v1, v2
+"""
+    assert _key_arg(body) == ("array", None)
+
+
+def test_fill_array_data_is_constant():
+    body = """
+    const/4 v0, 0x2
+    new-array v1, v0, [B
+    fill-array-data v1, :key
+    goto :use
+    :key
+    .array-data 1
+        0x1t
+        0x2t
+    .end array-data
+    :use
+"""
+    assert _key_arg(body) == ("array", [1, 2])
@@ -1,12 +1,18 @@
 import json
+import os
 import re
+from pathlib import Path
 from typing import Any, Dict, List, Tuple, Optional
 
+from .rule_registry import RULES
 from .utils import safe_preview
 
-def _load_json(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+DEFAULT_HEADER_RULES = os.getenv("HEADER_RULES", str(Path("config") / "header_rules.json"))
+DEFAULT_TLS_RULES = os.getenv("TLS_RULES", str(Path("config") / "tls_rules.json"))
+DEFAULT_LEAK_PATTERNS = os.getenv("LEAK_PATTERNS", str(Path("config") / "leak_patterns.json"))
+
+def rule_paths() -> List[Path]:
+    return [Path(DEFAULT_HEADER_RULES), Path(DEFAULT_TLS_RULES), Path(DEFAULT_LEAK_PATTERNS)]
 
 def compile_leak_regex(leak_cfg: Dict[str, Any]) -> List[Tuple[str, str, str, re.Pattern]]:
     """
@@ -17,7 +23,10 @@ def compile_leak_regex(leak_cfg: Dict[str, Any]) -> List[Tuple[str, str, str, re
         rid = r.get("id", "NI-LEAK-XXX")
         title = r.get("title", "Sensitive data pattern")
         severity = r.get("severity", "MEDIUM")
-        pattern = r.get("pattern", "")
+        # leak_patterns.json names it "regex"
+        pattern = r.get("pattern") or r.get("regex") or ""
+        if not pattern:
+            continue  # an empty regex matches every text
         flags = 0
         if r.get("ignore_case", True):
             flags |= re.IGNORECASE
@@ -34,11 +43,13 @@ def analyze_flows(
     tls_rules_path: str,
     leak_patterns_path: str,
 ) -> List[Dict[str, Any]]:
-    header_cfg = _load_json(header_rules_path)
-    tls_cfg = _load_json(tls_rules_path)
-    leak_cfg = _load_json(leak_patterns_path)
+    # parsed / compiled once per version of each file (RULES reloads them when they change)
+    header_cfg = RULES.get(Path(header_rules_path)).data
+    tls_cfg = RULES.get(Path(tls_rules_path)).data
+    leak_file = RULES.get(Path(leak_patterns_path))
+    leak_cfg = leak_file.data
 
-    leak_res = compile_leak_regex(leak_cfg)
+    leak_res = leak_file.compiled("leak_regex", lambda: compile_leak_regex(leak_cfg))
 
     findings: List[Dict[str, Any]] = []
 
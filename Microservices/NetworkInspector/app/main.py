@@ -1,5 +1,7 @@
 from fastapi import FastAPI
+from .analyzer import rule_paths
 from .models import ScanRequest, ScanResponse
+from .rule_registry import RULES
 from .scanner import scan_network
 from .db import init_db, save_scan, get_scan, list_scans
 
@@ -32,6 +34,15 @@ def get_scan_endpoint(scan_id: int):
         return {"error": "not found", "scan_id": scan_id}
     return data
 
+@app.get("/rules")
+def rules_endpoint():
+    return RULES.describe()
+
+@app.post("/rules/reload")
+def rules_reload_endpoint():
+    """Re-reads the rule files now (they are otherwise reloaded when their mtime changes)."""
+    return RULES.reload(rule_paths())
+
 @app.get("/scans")
 def list_scans_endpoint(limit: int = 20):
     return list_scans(limit=limit)
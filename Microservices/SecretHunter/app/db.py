@@ -2,7 +2,7 @@
 import json
 import sqlite3
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from .utils import ensure_dir, utc_now_iso
 
@@ -15,6 +15,18 @@ ensure_dir(WORK_DIR)
 
 DB_PATH = DATA_DIR / "secrethunter.db"
 
+SEVERITIES = ("CRITICAL", "HIGH", "MEDIUM", "LOW", "INFO")
+
+# columns added to sh_scans after its first version (ALTER TABLE at startup)
+ADDED_COLUMNS = {
+    "rules_hash": "TEXT",
+    # summary of the findings stored in sh_findings
+    "findings_count": "INTEGER NOT NULL DEFAULT 0",
+    **{f"{sev.lower()}_count": "INTEGER NOT NULL DEFAULT 0" for sev in SEVERITIES},
+    "engine_counts_json": "TEXT",
+    "findings_split": "INTEGER NOT NULL DEFAULT 0",
+}
+
 def get_conn() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
@@ -41,13 +53,131 @@ def init_db() -> None:
             )
             """
         )
+        existing = {r["name"] for r in cur.execute("PRAGMA table_info(sh_scans)")}
+        for col, decl in ADDED_COLUMNS.items():
+            if col not in existing:
+                cur.execute(f"ALTER TABLE sh_scans ADD COLUMN {col} {decl}")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sh_scans_sha256 ON sh_scans (sha256, rules_hash, id)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sh_findings (
+                scan_id INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                severity TEXT,
+                rule_id TEXT,
+                engine TEXT,
+                file TEXT,
+                history_status TEXT,
+                finding_json TEXT NOT NULL,
+                PRIMARY KEY (scan_id, idx)
+            ) WITHOUT ROWID
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sh_findings_severity ON sh_findings (scan_id, severity, idx)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sh_secret_index (
+                package_name TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                first_seen_scan_id INTEGER,
+                last_seen_scan_id INTEGER,
+                first_seen_at TEXT,
+                last_seen_at TEXT,
+                seen_count INTEGER NOT NULL DEFAULT 0,
+                baselined INTEGER NOT NULL DEFAULT 0,
+                baseline_reason TEXT,
+                baselined_at TEXT,
+                PRIMARY KEY (package_name, fingerprint)
+            ) WITHOUT ROWID
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sh_pattern_stats (
+                pattern_id TEXT PRIMARY KEY,
+                scans INTEGER NOT NULL DEFAULT 0,
+                total_ms REAL NOT NULL DEFAULT 0,
+                max_ms REAL NOT NULL DEFAULT 0,
+                matches INTEGER NOT NULL DEFAULT 0,
+                disabled_count INTEGER NOT NULL DEFAULT 0,
+                last_scan_id INTEGER,
+                updated_at TEXT
+            )
+            """
+        )
         conn.commit()
+        _split_legacy_scans(conn)
     finally:
         conn.close()
 
+def _summary(findings: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Counts per severity and per engine (a merged finding counts for each of its engines)."""
+    severity = {sev: 0 for sev in SEVERITIES}
+    engines: Dict[str, int] = {}
+    for f in findings:
+        sev = str(f.get("severity") or "").upper()
+        if sev in severity:
+            severity[sev] += 1
+        ev = f.get("evidence") or {}
+        for name in ev.get("engines") or [ev.get("engine") or "unknown"]:
+            engines[name] = engines.get(name, 0) + 1
+    return {"findings_count": len(findings), "severity": severity, "engines": engines}
+
+def _finding_rows(scan_id: int, findings: Iterable[Dict[str, Any]]) -> Iterable[Tuple[Any, ...]]:
+    for i, f in enumerate(findings):
+        ev = f.get("evidence") or {}
+        yield (
+            scan_id,
+            i,
+            str(f.get("severity") or "").upper() or None,
+            f.get("id"),
+            ev.get("engine"),
+            ev.get("file"),
+            (ev.get("history") or {}).get("status"),
+            json.dumps(f),
+        )
+
+def _store_findings(conn: sqlite3.Connection, scan_id: int, payload: Dict[str, Any]) -> None:
+    """Findings rows + summary columns; payload_json keeps everything but findings_list."""
+    findings = payload.get("findings_list") or []
+    summary = _summary(findings)
+    head = {k: v for k, v in payload.items() if k != "findings_list"}
+
+    conn.execute("DELETE FROM sh_findings WHERE scan_id = ?", (scan_id,))
+    conn.executemany(
+        """
+        INSERT INTO sh_findings (scan_id, idx, severity, rule_id, engine, file, history_status, finding_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        _finding_rows(scan_id, findings),
+    )
+    sev_cols = ", ".join(f"{sev.lower()}_count = ?" for sev in SEVERITIES)
+    conn.execute(
+        f"""
+        UPDATE sh_scans SET payload_json = ?, findings_split = 1, findings_count = ?, {sev_cols}, engine_counts_json = ?
+        WHERE id = ?
+        """,
+        (
+            json.dumps(head),
+            summary["findings_count"],
+            *(summary["severity"][sev] for sev in SEVERITIES),
+            json.dumps(summary["engines"]),
+            scan_id,
+        ),
+    )
+
+def _split_legacy_scans(conn: sqlite3.Connection) -> None:
+    """One-off migration of rows stored before sh_findings existed (whole payload in payload_json)."""
+    ids = [r["id"] for r in conn.execute("SELECT id FROM sh_scans WHERE findings_split = 0")]
+    for scan_id in ids:
+        row = conn.execute("SELECT payload_json FROM sh_scans WHERE id = ?", (scan_id,)).fetchone()
+        _store_findings(conn, scan_id, json.loads(row["payload_json"]))
+        conn.commit()
+
 def save_scan(payload: Dict[str, Any]) -> int:
     """
-    Stores the whole unified payload + indexed columns.
+    Stores the scan: indexed columns + payload (without findings) in sh_scans,
+    one row per finding in sh_findings.
     """
     meta = payload.get("meta", {}) or {}
     context = meta.get("context", {}) or {}
@@ -58,8 +188,9 @@ def save_scan(payload: Dict[str, Any]) -> int:
         cur.execute(
             """
             INSERT INTO sh_scans
-              (created_at, parent_scan_id, file_name, sha256, package_name, status, duration_ms, engines_json, error, payload_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+              (created_at, parent_scan_id, file_name, sha256, package_name, status, duration_ms, engines_json, error,
+               rules_hash, payload_json)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 utc_now_iso(),
@@ -71,15 +202,19 @@ def save_scan(payload: Dict[str, Any]) -> int:
                 meta.get("duration_ms"),
                 json.dumps(meta.get("engine", [])),
                 meta.get("error"),
-                json.dumps(payload),
+                context.get("rules_hash"),
+                "{}",
             ),
         )
+        scan_id = int(cur.lastrowid)
+        _store_findings(conn, scan_id, payload)
         conn.commit()
-        return int(cur.lastrowid)
+        return scan_id
     finally:
         conn.close()
 
-def get_scan(scan_id: int) -> Optional[Dict[str, Any]]:
+def get_scan(scan_id: int, include_findings: bool = True) -> Optional[Dict[str, Any]]:
+    """The stored payload; findings_list is only assembled from sh_findings when asked for."""
     conn = get_conn()
     try:
         cur = conn.cursor()
@@ -87,16 +222,228 @@ def get_scan(scan_id: int) -> Optional[Dict[str, Any]]:
         row = cur.fetchone()
         if not row:
             return None
-        return json.loads(row["payload_json"])
+        payload = json.loads(row["payload_json"])
+        if include_findings:
+            cur.execute("SELECT finding_json FROM sh_findings WHERE scan_id = ? ORDER BY idx", (scan_id,))
+            payload["findings_list"] = [json.loads(r["finding_json"]) for r in cur.fetchall()]
+        return payload
     finally:
         conn.close()
 
+def find_completed_scan(sha256: str, rules_hash: str) -> Optional[int]:
+    """Latest scan of this APK that completed without engine errors under the same rules."""
+    conn = get_conn()
+    try:
+        row = conn.execute(
+            """
+            SELECT id FROM sh_scans
+            WHERE sha256 = ? AND rules_hash = ? AND status = 'COMPLETED' AND error IS NULL
+            ORDER BY id DESC LIMIT 1
+            """,
+            (sha256, rules_hash),
+        ).fetchone()
+        return int(row["id"]) if row else None
+    finally:
+        conn.close()
+
+def list_findings(
+    scan_id: int,
+    offset: int = 0,
+    limit: int = 100,
+    severity: Optional[str] = None,
+    history_status: Optional[str] = None,
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """One page of a scan's findings, in report order. Returns (total matching, page)."""
+    where = "scan_id = ?"
+    params: List[Any] = [scan_id]
+    if severity:
+        where += " AND severity = ?"
+        params.append(severity.upper())
+    if history_status:
+        where += " AND history_status = ?"
+        params.append(history_status)
+
+    conn = get_conn()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) AS n FROM sh_findings WHERE {where}", params).fetchone()["n"]
+        cur = conn.execute(
+            f"SELECT finding_json FROM sh_findings WHERE {where} ORDER BY idx LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        )
+        return int(total), [json.loads(r["finding_json"]) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def _scan_summary(r: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "scan_id": r["id"],
+        "parent_scan_id": r["parent_scan_id"],
+        "created_at": r["created_at"],
+        "file_name": r["file_name"],
+        "sha256": r["sha256"],
+        "package": r["package_name"],
+        "status": r["status"],
+        "duration_ms": r["duration_ms"],
+        "engine": json.loads(r["engines_json"] or "[]"),
+        "error": r["error"],
+        "findings_count": r["findings_count"],
+        "severity_counts": {sev: r[f"{sev.lower()}_count"] for sev in SEVERITIES},
+        "engine_counts": json.loads(r["engine_counts_json"] or "{}"),
+    }
+
 def list_scans(limit: int = 20) -> List[Dict[str, Any]]:
+    """Summaries from the indexed columns only (no payload is deserialized)."""
     conn = get_conn()
     try:
         cur = conn.cursor()
-        cur.execute("SELECT id, payload_json FROM sh_scans ORDER BY id DESC LIMIT ?", (limit,))
-        rows = cur.fetchall()
-        return [json.loads(r["payload_json"]) for r in rows]
+        cur.execute(
+            f"""
+            SELECT id, parent_scan_id, created_at, file_name, sha256, package_name, status, duration_ms,
+                   engines_json, error, findings_count, {", ".join(f"{sev.lower()}_count" for sev in SEVERITIES)},
+                   engine_counts_json
+            FROM sh_scans ORDER BY id DESC LIMIT ?
+            """,
+            (limit,),
+        )
+        return [_scan_summary(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def update_scan_payload(scan_id: int, payload: Dict[str, Any]) -> None:
+    conn = get_conn()
+    try:
+        _store_findings(conn, scan_id, payload)
+        conn.commit()
+    finally:
+        conn.close()
+
+# --- secret history index (see history.py) ---
+
+def list_secret_fingerprints(package: str) -> List[str]:
+    conn = get_conn()
+    try:
+        cur = conn.execute("SELECT fingerprint FROM sh_secret_index WHERE package_name = ?", (package,))
+        return [r["fingerprint"] for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def lookup_secret_index(package: str, fingerprints: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    conn = get_conn()
+    try:
+        fps = list(fingerprints)
+        for i in range(0, len(fps), 500):  # stay under SQLITE_MAX_VARIABLE_NUMBER
+            batch = fps[i:i + 500]
+            cur = conn.execute(
+                f"SELECT * FROM sh_secret_index WHERE package_name = ? AND fingerprint IN ({','.join('?' * len(batch))})",
+                (package, *batch),
+            )
+            for r in cur.fetchall():
+                out[r["fingerprint"]] = dict(r)
+        return out
+    finally:
+        conn.close()
+
+def record_secret_index(package: str, scan_id: int, fingerprints: Sequence[str]) -> None:
+    now = utc_now_iso()
+    conn = get_conn()
+    try:
+        conn.executemany(
+            """
+            INSERT INTO sh_secret_index
+              (package_name, fingerprint, first_seen_scan_id, last_seen_scan_id, first_seen_at, last_seen_at, seen_count)
+            VALUES (?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(package_name, fingerprint) DO UPDATE SET
+              first_seen_scan_id = COALESCE(first_seen_scan_id, excluded.first_seen_scan_id),
+              first_seen_at = COALESCE(first_seen_at, excluded.first_seen_at),
+              last_seen_scan_id = excluded.last_seen_scan_id,
+              last_seen_at = excluded.last_seen_at,
+              seen_count = seen_count + 1
+            """,
+            [(package, fp, scan_id, scan_id, now, now) for fp in dict.fromkeys(fingerprints)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def set_baseline(package: str, fingerprints: Sequence[str], baselined: bool = True, reason: Optional[str] = None) -> int:
+    """(Un)baselines fingerprints; unknown ones are added so they are suppressed when first seen."""
+    now = utc_now_iso()
+    conn = get_conn()
+    try:
+        cur = conn.executemany(
+            """
+            INSERT INTO sh_secret_index (package_name, fingerprint, baselined, baseline_reason, baselined_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(package_name, fingerprint) DO UPDATE SET
+              baselined = excluded.baselined,
+              baseline_reason = excluded.baseline_reason,
+              baselined_at = excluded.baselined_at
+            """,
+            [(package, fp, int(baselined), reason, now if baselined else None) for fp in dict.fromkeys(fingerprints)],
+        )
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def list_baseline(package: str) -> List[Dict[str, Any]]:
+    conn = get_conn()
+    try:
+        cur = conn.execute(
+            """
+            SELECT fingerprint, first_seen_scan_id, last_seen_scan_id, seen_count, baseline_reason, baselined_at
+            FROM sh_secret_index WHERE package_name = ? AND baselined = 1
+            ORDER BY baselined_at DESC
+            """,
+            (package,),
+        )
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+# --- regex pattern cost (see regex_engine.PatternProfile) ---
+
+def record_pattern_stats(scan_id: int, patterns: Sequence[Dict[str, Any]]) -> None:
+    now = utc_now_iso()
+    conn = get_conn()
+    try:
+        conn.executemany(
+            """
+            INSERT INTO sh_pattern_stats (pattern_id, scans, total_ms, max_ms, matches, disabled_count, last_scan_id, updated_at)
+            VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(pattern_id) DO UPDATE SET
+              scans = scans + 1,
+              total_ms = total_ms + excluded.total_ms,
+              max_ms = MAX(max_ms, excluded.max_ms),
+              matches = matches + excluded.matches,
+              disabled_count = disabled_count + excluded.disabled_count,
+              last_scan_id = excluded.last_scan_id,
+              updated_at = excluded.updated_at
+            """,
+            [
+                (p["id"], p["time_ms"], p["time_ms"], p.get("matches", 0), int(bool(p.get("disabled"))), scan_id, now)
+                for p in patterns
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def list_pattern_stats(limit: int = 100) -> List[Dict[str, Any]]:
+    """Most expensive patterns first (total time across scans)."""
+    conn = get_conn()
+    try:
+        cur = conn.execute(
+            """
+            SELECT pattern_id, scans, total_ms, max_ms, total_ms / scans AS avg_ms,
+                   matches, disabled_count, last_scan_id, updated_at
+            FROM sh_pattern_stats
+            ORDER BY total_ms DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        return [dict(r) for r in cur.fetchall()]
     finally:
         conn.close()
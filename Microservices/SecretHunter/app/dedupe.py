@@ -0,0 +1,171 @@
+# app/dedupe.py
+import hashlib
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+SH_DEDUPE = os.getenv("SH_DEDUPE", "1") == "1"
+DEDUPE_MAX_LOCATIONS = int(os.getenv("SH_DEDUPE_MAX_LOCATIONS", "20"))
+
+SEVERITY_RANK = {"CRITICAL": 4, "HIGH": 3, "MEDIUM": 2, "LOW": 1, "INFO": 0}
+
+# Engines name the same detector differently (SH-RX-001 / Secret_001_AWS_AccessKey /
+# aws-access-token). The first family whose keyword appears in the normalized
+# "<id> <rule> <title>" wins, so the order matters (bearer/oauth before api_key ...).
+RULE_FAMILIES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("private_key", ("private key", "privatekey", "rsa key", "openssh", "pgp")),
+    ("aws", ("aws",)),
+    ("google", ("google", "gcp", "firebase", "aiza")),
+    ("github", ("github", "ghp ")),
+    ("gitlab", ("gitlab", "glpat")),
+    ("slack", ("slack",)),
+    ("stripe", ("stripe",)),
+    ("twilio", ("twilio",)),
+    ("sendgrid", ("sendgrid",)),
+    ("mailgun", ("mailgun",)),
+    ("dropbox", ("dropbox",)),
+    ("digitalocean", ("digitalocean",)),
+    ("telegram", ("telegram",)),
+    ("discord", ("discord",)),
+    ("jwt", ("jwt",)),
+    ("azure", ("azure",)),
+    ("sentry", ("sentry",)),
+    ("okta", ("okta",)),
+    ("auth0", ("auth0",)),
+    ("braintree", ("braintree", "paypal")),
+    ("square", ("square",)),
+    ("shopify", ("shopify",)),
+    ("npm", ("npm",)),
+    ("pypi", ("pypi",)),
+    ("heroku", ("heroku",)),
+    ("database_uri", ("mongo", "postgres", "mysql", "redis")),
+    ("basic_auth", ("basic auth", "basicauth")),
+    ("bearer", ("bearer", "authheader", "auth header")),
+    ("oauth", ("oauth", "client secret", "clientsecret", "client id", "refresh token", "refreshtoken")),
+    ("password", ("password",)),
+    ("api_key", ("api key", "apikey")),
+)
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_DEX_NAME = re.compile(r"classes\d*\.dex$")
+
+
+def secret_sha256(secret: Optional[str]) -> Optional[str]:
+    s = (secret or "").strip()
+    if not s:
+        return None
+    return hashlib.sha256(s.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def rule_family(finding: Dict[str, Any]) -> str:
+    ev = finding.get("evidence") or {}
+    text = " ".join(str(x) for x in (finding.get("id"), ev.get("rule"), finding.get("title")) if x)
+    text = " " + _NON_ALNUM.sub(" ", text.lower()) + " "
+    for family, keywords in RULE_FAMILIES:
+        if any(k in text for k in keywords):
+            return family
+    return "generic"
+
+
+def location_bucket(path: Optional[str]) -> str:
+    """
+    Coarse location of a file in the APK, so the copy of a secret in smali,
+    dex_strings.txt and the extracted classes.dex count as one place ("code").
+    """
+    parts = [p for p in (path or "").replace("\\", "/").lower().split("/") if p]
+    if not parts:
+        return "unknown"
+    name, dirs = parts[-1], parts[:-1]
+    if name == "androidmanifest.xml":
+        return "manifest"
+    if (
+        name == "dex_strings.txt"
+        or _DEX_NAME.match(name)
+        or name.endswith((".smali", ".java", ".kt"))
+        or any(d.startswith("smali") for d in dirs)
+    ):
+        return "code"
+    if "assets" in dirs:
+        return "assets"
+    if "lib" in dirs or name.endswith(".so"):
+        return "native"
+    if "res" in dirs or name == "resources.arsc":
+        return "resources"
+    return "other"
+
+
+def fingerprint(finding: Dict[str, Any]) -> str:
+    """
+    sha256(secret hash | rule family | location bucket). Findings without a
+    recoverable secret keep a per-location fingerprint and are never merged.
+    """
+    ev = finding.get("evidence") or {}
+    secret_hash = ev.get("secret_sha256")
+    if secret_hash:
+        key = f"{secret_hash}|{rule_family(finding)}|{location_bucket(ev.get('file'))}"
+    else:
+        line = ev.get("line", ev.get("start_line"))
+        key = f"{ev.get('engine')}|{finding.get('id')}|{ev.get('file')}|{line}|{ev.get('offset')}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def _location(ev: Dict[str, Any]) -> Dict[str, Any]:
+    return {"engine": ev.get("engine"), "file": ev.get("file"), "line": ev.get("line", ev.get("start_line"))}
+
+
+class FindingMerger:
+    """
+    Folds findings of every engine into one record per fingerprint. The first
+    finding seen stays the primary evidence; later ones only add their engine,
+    rule id and location (and may raise the severity).
+    """
+
+    def __init__(self, max_locations: int = DEDUPE_MAX_LOCATIONS) -> None:
+        self.max_locations = max_locations
+        self.received = 0
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._seen_locations: Dict[str, set] = {}
+
+    def add(self, finding: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns the new record, or None if the finding was merged into an existing one."""
+        self.received += 1
+        fp = fingerprint(finding)
+        ev = finding.get("evidence") or {}
+        loc = _location(ev)
+        loc_key = (loc["engine"], loc["file"], loc["line"])
+
+        rec = self._records.get(fp)
+        if rec is None:
+            rec = dict(finding)
+            rec["evidence"] = {
+                **ev,
+                "fingerprint": fp,
+                "engines": [ev.get("engine")] if ev.get("engine") else [],
+                "rules": [finding.get("id")],
+                "occurrences": 1,
+                "locations": [loc],
+            }
+            self._records[fp] = rec
+            self._seen_locations[fp] = {loc_key}
+            return rec
+
+        rev = rec["evidence"]
+        rev["occurrences"] += 1
+        if ev.get("engine") and ev["engine"] not in rev["engines"]:
+            rev["engines"].append(ev["engine"])
+        if finding.get("id") not in rev["rules"]:
+            rev["rules"].append(finding.get("id"))
+        seen = self._seen_locations[fp]
+        if loc_key not in seen and len(rev["locations"]) < self.max_locations:
+            seen.add(loc_key)
+            rev["locations"].append(loc)
+        sev = finding.get("severity")
+        if SEVERITY_RANK.get(str(sev).upper(), -1) > SEVERITY_RANK.get(str(rec.get("severity")).upper(), -1):
+            rec["severity"] = sev
+        return None
+
+    def findings(self) -> List[Dict[str, Any]]:
+        return list(self._records.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {"received": self.received, "merged": self.received - len(self._records), "records": len(self._records)}
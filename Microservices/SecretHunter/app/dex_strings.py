@@ -0,0 +1,147 @@
+# app/dex_strings.py
+import mmap
+import os
+import re
+import sys
+import zipfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+DEX_HEADER_SIZE = 0x70
+# header: string_ids_size @ 0x38, string_ids_off @ 0x3C
+STRING_IDS_SIZE_OFF = 0x38
+
+Buffer = Union[bytes, bytearray, mmap.mmap]
+
+
+def _u32_array(mv: memoryview) -> array:
+    """Load a little-endian uint32 table in one call (no per-entry struct.unpack)."""
+    table = array("I")
+    table.frombytes(mv)
+    if sys.byteorder == "big":
+        table.byteswap()
+    return table
+
+
+def decode_mutf8(raw: memoryview) -> str:
+    """
+    DEX strings are MUTF-8: NUL is encoded as C0 80 and supplementary characters
+    are stored as two 3-byte encoded surrogates. Plain UTF-8 covers almost every
+    string, so it is tried first.
+    """
+    try:
+        return str(raw, "utf-8")
+    except UnicodeDecodeError:
+        pass
+    data = bytes(raw).replace(b"\xc0\x80", b"\x00")
+    try:
+        s = data.decode("utf-8", errors="surrogatepass")
+        # recombine surrogate pairs into real code points
+        return s.encode("utf-16-le", errors="surrogatepass").decode("utf-16-le", errors="replace")
+    except UnicodeDecodeError:
+        return data.decode("utf-8", errors="ignore")
+
+
+def read_dex_strings(dex: Buffer, max_strings: int = 200000, max_len: int = 4000) -> List[str]:
+    """
+    Extract the string pool of a DEX buffer (bytes or mmap).
+    string_ids is read as a single array('I'); string data is decoded straight
+    from a memoryview of the buffer.
+    """
+    if len(dex) < DEX_HEADER_SIZE:
+        return []
+    if not (dex[:4] == b"dex\n" and dex[7] == 0):
+        return []
+
+    mv = memoryview(dex)
+    try:
+        string_ids_size, string_ids_off = _u32_array(mv[STRING_IDS_SIZE_OFF:STRING_IDS_SIZE_OFF + 8])
+        if string_ids_off <= 0 or string_ids_off + string_ids_size * 4 > len(dex):
+            return []
+
+        n = min(string_ids_size, max_strings)
+        offsets = _u32_array(mv[string_ids_off:string_ids_off + n * 4])
+
+        size = len(dex)
+        find = dex.find
+        strings: List[str] = []
+        append = strings.append
+
+        for str_off in offsets:
+            if str_off <= 0 or str_off >= size:
+                continue
+            # skip the ULEB128 utf16 length (1 byte for strings < 128 chars)
+            p = str_off
+            while p < size and dex[p] & 0x80:
+                p += 1
+            p += 1
+            end = find(b"\x00", p)
+            if end <= p:
+                continue
+            s = decode_mutf8(mv[p:end]).strip()
+            if 0 < len(s) <= max_len:
+                append(s)
+        return strings
+    finally:
+        mv.release()
+
+
+def read_dex_file_strings(dex_path: Path, max_strings: int = 200000, max_len: int = 4000) -> List[str]:
+    """mmap a dex file and extract its strings (the file is never read into Python bytes)."""
+    with dex_path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size < DEX_HEADER_SIZE:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return read_dex_strings(mm, max_strings=max_strings, max_len=max_len)
+
+
+def _dex_sort_key(path: Path):
+    # classes.dex, classes2.dex, ..., classes10.dex
+    m = re.match(r"classes(\d*)\.dex$", path.name)
+    return int(m.group(1) or 1) if m else sys.maxsize
+
+
+def find_dex_files(root: Path) -> List[Path]:
+    return sorted((p for p in root.glob("classes*.dex") if p.is_file()), key=_dex_sort_key)
+
+
+def extract_dex_strings(dex_paths: Sequence[Path], workers: Optional[int] = None) -> List[str]:
+    """
+    Multidex: every dex is parsed in its own process, results keep the classes*.dex order.
+    """
+    if not dex_paths:
+        return []
+    if workers is None:
+        workers = int(os.getenv("SH_DEX_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(dex_paths)))
+
+    if workers == 1:
+        chunks = [read_dex_file_strings(p) for p in dex_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            chunks = list(ex.map(read_dex_file_strings, dex_paths))
+
+    out: List[str] = []
+    for c in chunks:
+        out.extend(c)
+    return out
+
+
+def extract_apk_dex_strings(apk_path: Path, extracted_dir: Optional[Path] = None) -> List[str]:
+    """
+    Prefer the dex files already extracted to the work dir (mmap'd); fall back to
+    reading them from the APK when they are not on disk.
+    """
+    if extracted_dir is not None:
+        dex_paths = find_dex_files(extracted_dir)
+        if dex_paths:
+            return extract_dex_strings(dex_paths)
+
+    strings: List[str] = []
+    with zipfile.ZipFile(apk_path, "r") as z:
+        names = [n for n in z.namelist() if n.startswith("classes") and n.endswith(".dex")]
+        for name in sorted(names, key=lambda n: _dex_sort_key(Path(n))):
+            strings.extend(read_dex_strings(z.read(name)))
+    return strings
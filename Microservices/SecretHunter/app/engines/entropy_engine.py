@@ -0,0 +1,174 @@
+# app/engines/entropy_engine.py
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from ..dedupe import secret_sha256
+from ..utils import LineIndex, mask_secret
+
+TOKEN_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=_-"
+HEX_CHARS = set("0123456789abcdefABCDEF")
+ALNUM_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+DIGITS = set("0123456789")
+
+# most specific class first: a hex token is also alphanumeric and base64
+CHARSET_ORDER = ("hex", "alphanumeric", "base64")
+
+def load_entropy_rules(rules_path: Path) -> Dict[str, Any]:
+    data = json.loads(rules_path.read_text(encoding="utf-8"))
+    if not isinstance(data, dict) or not isinstance(data.get("charsets"), dict):
+        raise ValueError("entropy_rules.json must be an object with a 'charsets' map")
+    return data
+
+def _token_regex(min_len: int, max_len: int) -> re.Pattern:
+    cls = re.escape(TOKEN_ALPHABET)
+    return re.compile(rf"(?<![{cls}])[{cls}]{{{min_len},{max_len}}}(?![{cls}])")
+
+def _sources(work_dir: Path, scan_root: Path) -> Iterator[Tuple[Path, str]]:
+    """DEX string pool + decoded (text) resources, as (path, reported name)."""
+    dex_strings = work_dir / "dex_strings.txt"
+    if dex_strings.exists():
+        yield dex_strings, "dex_strings.txt"
+    res = scan_root / "res"
+    if res.is_dir():
+        for p in sorted(res.rglob("*.xml")):
+            try:
+                with p.open("rb") as f:
+                    head = f.read(1)
+            except OSError:
+                continue
+            if head == b"<":  # skip binary AXML when apktool did not run
+                yield p, str(p.relative_to(scan_root))
+
+def _class_masks(np: Any) -> Dict[str, Any]:
+    """Per charset: boolean mask over TOKEN_ALPHABET of the chars it allows."""
+    sets = {"hex": HEX_CHARS, "alphanumeric": ALNUM_CHARS, "base64": set(TOKEN_ALPHABET)}
+    return {name: np.array([c in s for c in TOKEN_ALPHABET]) for name, s in sets.items()}
+
+def score_tokens(np: Any, tokens: List[str]) -> Tuple[Any, Any, Any]:
+    """
+    One pass over a batch: tokens are packed into a single uint8 buffer, mapped to
+    alphabet indexes and histogrammed per token with one bincount.
+    Returns (entropy bits/char, charset index into CHARSET_ORDER or -1, has_digit).
+    """
+    n = len(tokens)
+    k = len(TOKEN_ALPHABET)
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=n)
+    buf = np.frombuffer("".join(tokens).encode("ascii"), dtype=np.uint8)
+
+    lut = np.full(256, 0, dtype=np.int64)
+    lut[np.frombuffer(TOKEN_ALPHABET.encode("ascii"), dtype=np.uint8)] = np.arange(k)
+    rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+    counts = np.bincount(rows * k + lut[buf], minlength=n * k).reshape(n, k)
+
+    p = counts / lengths[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(counts > 0, p * np.log2(p), 0.0).sum(axis=1)
+
+    masks = _class_masks(np)
+    charset = np.full(n, -1, dtype=np.int64)
+    for i in reversed(range(len(CHARSET_ORDER))):
+        outside = counts[:, ~masks[CHARSET_ORDER[i]]].sum(axis=1)
+        charset[outside == 0] = i
+    digit_cols = np.array([c in DIGITS for c in TOKEN_ALPHABET])
+    has_digit = counts[:, digit_cols].sum(axis=1) > 0
+    return entropy, charset, has_digit
+
+def run_entropy_engine(work_dir: Path, scan_root: Path, rules_path: Path) -> Dict[str, Any]:
+    """
+    Generic high-entropy tokens (hex / alphanumeric / base64) in the DEX string
+    pool and decoded resources. Uses NumPy if installed.
+    """
+    try:
+        import numpy as np  # type: ignore
+    except Exception as e:
+        return {
+            "engine": "entropy",
+            "findings": [],
+            "stats": {"scanned_files": 0, "candidates": 0, "matches": 0},
+            "error": f"numpy not installed: {e}",
+        }
+
+    rules = load_entropy_rules(rules_path)
+    charsets: Dict[str, Dict[str, Any]] = rules["charsets"]
+    token_rx = _token_regex(int(rules.get("token_min_length", 20)), int(rules.get("token_max_length", 256)))
+    ignore = [re.compile(r) for r in rules.get("ignore_regex", [])]
+    batch_size = int(rules.get("batch_size", 8192))
+    max_findings = int(rules.get("max_findings", 500))
+    recommendation = rules.get("recommendation", "")
+
+    # thresholds indexed like CHARSET_ORDER (charsets missing from the config are never reported)
+    min_len = np.array([charsets.get(c, {}).get("min_length", 1 << 30) for c in CHARSET_ORDER] + [1 << 30])
+    min_ent = np.array([charsets.get(c, {}).get("min_entropy", 99.0) for c in CHARSET_ORDER] + [99.0])
+    need_digit = np.array([bool(charsets.get(c, {}).get("require_digit", False)) for c in CHARSET_ORDER] + [False])
+
+    findings: List[Dict[str, Any]] = []
+    scanned_files = 0
+    candidates = 0
+    truncated = False
+
+    for path, name in _sources(work_dir, scan_root):
+        try:
+            text = path.read_text(encoding="utf-8", errors="ignore")
+        except OSError:
+            continue
+        scanned_files += 1
+        lines = LineIndex(text)
+
+        spans = [(m.start(), m.group(0)) for m in token_rx.finditer(text)]
+        spans = [(s, t) for s, t in spans if not any(r.search(t) for r in ignore)]
+        candidates += len(spans)
+
+        for b in range(0, len(spans), batch_size):
+            batch = spans[b:b + batch_size]
+            tokens = [t for _, t in batch]
+            entropy, charset, has_digit = score_tokens(np, tokens)
+            lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+            hit = (
+                (lengths >= min_len[charset])
+                & (entropy >= min_ent[charset])
+                & (has_digit | ~need_digit[charset])
+            )
+            for i in np.flatnonzero(hit):
+                if len(findings) >= max_findings:
+                    truncated = True
+                    break
+                start, token = batch[i]
+                cs = CHARSET_ORDER[charset[i]]
+                rule = charsets[cs]
+                line, column = lines.locate(start)
+                findings.append(
+                    {
+                        "id": rule.get("id", f"SH-EN-{cs.upper()}"),
+                        "title": rule.get("title", f"Chaîne à forte entropie ({cs})"),
+                        "severity": rule.get("severity", "MEDIUM"),
+                        "evidence": {
+                            "engine": "entropy",
+                            "file": name,
+                            "line": line,
+                            "column": column,
+                            "charset": cs,
+                            "entropy": round(float(entropy[i]), 3),
+                            "length": len(token),
+                            "match_preview": mask_secret(token),
+                            "secret_sha256": secret_sha256(token),
+                        },
+                        "recommendation": recommendation,
+                    }
+                )
+            if truncated:
+                break
+        if truncated:
+            break
+
+    return {
+        "engine": "entropy",
+        "findings": findings,
+        "stats": {
+            "scanned_files": scanned_files,
+            "candidates": candidates,
+            "matches": len(findings),
+            "truncated": truncated,
+        },
+    }
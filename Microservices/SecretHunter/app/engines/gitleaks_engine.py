@@ -1,67 +1,235 @@
 # app/engines/gitleaks_engine.py
 import json
+import os
+import re
 import shutil
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from ..utils import mask_secret
+from ..dedupe import secret_sha256
+from ..utils import BINARY_EXT_BLOCKLIST, ensure_dir, iter_files, mask_secret
+from .regex_engine import load_regex_patterns
+
+REDACTED = "REDACTED"
+
+GITLEAKS_MAX_MB = float(os.getenv("GITLEAKS_MAX_MB", "10"))
+GITLEAKS_SHARDS = int(os.getenv("SH_GITLEAKS_SHARDS", "0") or 0) or min(4, os.cpu_count() or 1)
+GITLEAKS_SHARD_TIMEOUT = float(os.getenv("SH_GITLEAKS_SHARD_TIMEOUT", "600"))
+GITLEAKS_USE_DEFAULT = os.getenv("SH_GITLEAKS_USE_DEFAULT", "1") == "1"
+# top-level dirs of the scan root left out of the manifest (apktool's untouched copies)
+GITLEAKS_EXCLUDE_DIRS = {d for d in os.getenv("SH_GITLEAKS_EXCLUDE_DIRS", "original").split(",") if d}
+# shard mirrors (hard links) live here, on the same volume as data/work
+GITLEAKS_TMP_DIR = Path(os.getenv("SH_GITLEAKS_TMP_DIR", "data/tmp/gitleaks"))
+
+# Go RE2 has no lookarounds / backreferences
+RE2_UNSUPPORTED = re.compile(r"\(\?<?[=!]|\\[1-9]")
 
 def _find_gitleaks_bin(explicit: Optional[str] = None) -> Optional[str]:
     if explicit:
         return explicit
     return shutil.which("gitleaks")
 
-def run_gitleaks_engine(work_dir: Path, gitleaks_bin: Optional[str] = None) -> Dict[str, Any]:
+def _read_secret(item: Dict[str, Any]) -> Optional[str]:
     """
-    Runs: gitleaks detect --source <dir> --no-git --report-format json --report-path out.json --exit-code 0
-    If binary missing -> returns error but doesn't crash scan.
+    The report is --redact'ed; the secret is read back from the file so it can be
+    hashed (Match is the matched text with the secret replaced by REDACTED).
     """
-    bin_path = _find_gitleaks_bin(gitleaks_bin)
-    if not bin_path:
-        return {
-            "engine": "gitleaks",
-            "findings": [],
-            "stats": {"matches": 0},
-            "error": "gitleaks binary not found in PATH (install it or enable in Dockerfile).",
-        }
+    path = item.get("File")
+    start = item.get("StartLine")
+    match = item.get("Match") or ""
+    if not path or not start or REDACTED not in match:
+        return None
+    end = item.get("EndLine") or start
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            text = "".join(islice(f, start - 1, end))
+    except OSError:
+        return None
+
+    before, _, after = match.partition(REDACTED)
+    col = item.get("StartColumn") or 1
+    if not before and not after:
+        # the whole match is the secret: use the columns (single-line matches)
+        end_col = item.get("EndColumn")
+        if not end_col:
+            return None
+        return text[col - 1:end_col].strip() or None
+    # the match starts at StartColumn: an empty prefix must not resolve to the line start
+    i = text.find(before, col - 1)
+    if i == -1:
+        return None
+    i += len(before)
+    j = text.find(after, i) if after else len(text.rstrip("\r\n"))
+    return text[i:j] if j > i else None
+
+def build_manifest(scan_root: Path, max_mb: float = GITLEAKS_MAX_MB) -> Tuple[List[Tuple[Path, int]], Dict[str, int]]:
+    """
+    Files worth giving to gitleaks: no excluded top-level dirs (apktool's original/),
+    no binaries, nothing above GITLEAKS_MAX_MB. Returns ([(path, size)], skipped counts).
+    """
+    max_bytes = int(max_mb * 1024 * 1024)
+    manifest: List[Tuple[Path, int]] = []
+    skipped = {"excluded_dir": 0, "binary": 0, "too_large": 0}
+    for f in iter_files(scan_root):
+        rel = f.relative_to(scan_root)
+        if rel.parts[0] in GITLEAKS_EXCLUDE_DIRS or rel.name.startswith("_gitleaks"):
+            skipped["excluded_dir"] += 1
+            continue
+        if f.suffix.lower() in BINARY_EXT_BLOCKLIST:
+            skipped["binary"] += 1
+            continue
+        try:
+            size = f.stat().st_size
+        except OSError:
+            continue
+        if max_bytes and size > max_bytes:
+            skipped["too_large"] += 1
+            continue
+        manifest.append((f, size))
+    return manifest, skipped
 
-    report_path = work_dir / "_gitleaks_report.json"
+def split_shards(manifest: List[Tuple[Path, int]], n: int) -> List[List[Path]]:
+    """Greedy size balancing: biggest file first into the lightest shard."""
+    n = max(1, min(n, len(manifest)))
+    shards: List[List[Path]] = [[] for _ in range(n)]
+    loads = [0] * n
+    for f, size in sorted(manifest, key=lambda e: -e[1]):
+        i = loads.index(min(loads))
+        shards[i].append(f)
+        loads[i] += size
+    return [s for s in shards if s]
 
+def _toml_literal(value: str) -> Optional[str]:
+    if "\'\'\'" in value or "\n" in value:
+        return None
+    return "\'\'\'" + value + "\'\'\'"
+
+def build_gitleaks_config(patterns_path: Path, use_default: bool = GITLEAKS_USE_DEFAULT) -> Tuple[str, List[str]]:
+    """
+    gitleaks TOML generated from regex_patterns.json, so gitleaks reports the
+    same detectors as the regex engine (on top of its own rules if use_default).
+    Patterns RE2 cannot run (lookarounds, backreferences) are skipped.
+    Returns (toml, skipped pattern ids).
+    """
+    lines = ['title = "SecretHunter (generated from regex_patterns.json)"', ""]
+    if use_default:
+        lines += ["[extend]", "useDefault = true", ""]
+    skipped: List[str] = []
+    for p in load_regex_patterns(patterns_path):
+        pid = str(p.get("id") or "")
+        pattern = p.get("pattern") or ""
+        if p.get("ignore_case", False):
+            pattern = "(?i)" + pattern
+        regex = _toml_literal(pattern)
+        desc = _toml_literal(str(p.get("title") or pid))
+        if not pid or not pattern or RE2_UNSUPPORTED.search(pattern) or regex is None or desc is None:
+            skipped.append(pid or pattern)
+            continue
+        lines += ["[[rules]]", f"id = {json.dumps(pid)}", f"description = {desc}", f"regex = {regex}", ""]
+    return "\n".join(lines), skipped
+
+def _link_shard(files: List[Path], scan_root: Path, shard_dir: Path) -> None:
+    """Mirror a shard under shard_dir with hard links (copy if linking fails)."""
+    for f in files:
+        dst = shard_dir / f.relative_to(scan_root)
+        ensure_dir(dst.parent)
+        try:
+            os.link(f, dst)
+        except OSError:
+            shutil.copy2(f, dst)
+
+def _run_shard(bin_path: str, shard_dir: Path, config_path: Path) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    report_path = shard_dir.with_suffix(".json")
     cmd = [
         bin_path,
         "detect",
-        "--source", str(work_dir),
+        "--source", str(shard_dir),
         "--no-git",
+        "--config", str(config_path),
         "--report-format", "json",
         "--report-path", str(report_path),
         "--exit-code", "0",
         "--redact",
     ]
-
     try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-    except subprocess.CalledProcessError as e:
+        subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=GITLEAKS_SHARD_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return [], f"gitleaks shard {shard_dir.name} timed out after {GITLEAKS_SHARD_TIMEOUT:g}s"
+    except subprocess.CalledProcessError:
         # Sometimes gitleaks returns non-zero even with --exit-code, so we handle report if exists
         pass
 
+    try:
+        raw = json.loads(report_path.read_text(encoding="utf-8"))
+    except Exception:
+        raw = []
+    return (raw if isinstance(raw, list) else []), None
+
+def run_gitleaks_engine(work_dir: Path, gitleaks_bin: Optional[str] = None, patterns_path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Runs gitleaks detect (--no-git, --redact) over a filtered manifest of work_dir,
+    split into size-balanced shards scanned by parallel gitleaks processes.
+    Rules come from regex_patterns.json when patterns_path is given.
+    If binary missing -> returns error but doesn't crash scan.
+    """
+    bin_path = _find_gitleaks_bin(gitleaks_bin)
+    if not bin_path:
+        return {
+            "engine": "gitleaks",
+            "findings": [],
+            "stats": {"matches": 0},
+            "error": "gitleaks binary not found in PATH (install it or enable in Dockerfile).",
+        }
+
+    manifest, skipped = build_manifest(work_dir)
+    shards = split_shards(manifest, GITLEAKS_SHARDS)
+
+    ensure_dir(GITLEAKS_TMP_DIR)
+    # outside the scan root: the other engines scan it concurrently
+    run_dir = Path(tempfile.mkdtemp(prefix="run-", dir=GITLEAKS_TMP_DIR))
+
     findings: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    skipped_rules: List[str] = []
     matches = 0
 
-    if report_path.exists():
-        try:
-            raw = json.loads(report_path.read_text(encoding="utf-8"))
-        except Exception:
-            raw = []
+    try:
+        config_path = run_dir / "gitleaks.toml"
+        if patterns_path is not None:
+            toml, skipped_rules = build_gitleaks_config(patterns_path)
+        else:
+            toml = "[extend]\nuseDefault = true\n"
+        config_path.write_text(toml, encoding="utf-8")
+
+        shard_dirs = []
+        for i, files in enumerate(shards):
+            shard_dir = run_dir / f"shard_{i}"
+            _link_shard(files, work_dir, shard_dir)
+            shard_dirs.append(shard_dir)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(shard_dirs))) as ex:
+            results = list(ex.map(lambda d: (d, *_run_shard(bin_path, d, config_path)), shard_dirs))
 
-        if isinstance(raw, list):
-            for item in raw:
+        for shard_dir, items, err in results:
+            if err:
+                errors.append(err)
+            for item in items:
                 matches += 1
                 rule_id = item.get("RuleID") or "UNKNOWN"
                 desc = item.get("Description") or "Secret détecté par GitLeaks"
                 file_ = item.get("File") or "UNKNOWN"
                 secret = item.get("Secret") or item.get("Match") or ""
                 preview = mask_secret(secret)
+                # read back through the shard link, before run_dir is removed
+                real_secret = _read_secret(item) if secret == REDACTED else secret
+                try:
+                    file_ = str(Path(file_).relative_to(shard_dir))
+                except ValueError:
+                    pass
 
                 findings.append(
                     {
@@ -75,13 +243,28 @@ def run_gitleaks_engine(work_dir: Path, gitleaks_bin: Optional[str] = None) -> D
                             "match_preview": preview,
                             "start_line": item.get("StartLine"),
                             "end_line": item.get("EndLine"),
+                            "secret_sha256": secret_sha256(real_secret),
                         },
                         "recommendation": "Révoquer/rotater le secret, supprimer du code/historique, utiliser un gestionnaire de secrets et des variables d’environnement.",
                     }
                 )
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
 
-    return {
+    out: Dict[str, Any] = {
         "engine": "gitleaks",
         "findings": findings,
-        "stats": {"matches": matches},
+        "stats": {
+            "matches": matches,
+            "files": len(manifest),
+            "bytes": sum(size for _, size in manifest),
+            "skipped": skipped,
+            "shards": len(shards),
+            "skipped_rules": skipped_rules,
+        },
     }
+    if errors and not findings and len(errors) == len(shards):
+        out["error"] = "; ".join(errors)
+    elif errors:
+        out["warnings"] = errors
+    return out
@@ -0,0 +1,253 @@
+# app/engines/native_engine.py
+import hashlib
+import json
+import os
+import re
+import struct
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from ..dedupe import secret_sha256
+from ..utils import ensure_dir, mask_secret, sha256_file
+from .regex_engine import compile_patterns, load_regex_patterns
+
+NATIVE_CACHE_DIR = Path(os.getenv("SH_NATIVE_CACHE_DIR", "data/cache/native"))
+NATIVE_CHUNK_SIZE = int(os.getenv("SH_NATIVE_CHUNK_BYTES", str(1024 * 1024)))
+NATIVE_MIN_RUN = int(os.getenv("SH_NATIVE_MIN_RUN", "8"))
+NATIVE_MAX_RUN = 4096
+# sections holding string literals / initialized data (and their .rodata.str1.1 style variants)
+NATIVE_SECTIONS = tuple(s for s in os.getenv("SH_NATIVE_SECTIONS", ".rodata,.data").split(",") if s)
+
+# bump when the extraction changes, so cached results are recomputed
+EXTRACTOR_VERSION = "1"
+
+SHT_NOBITS = 8
+
+_PRINTABLE = frozenset(range(0x20, 0x7F)) | {0x09}
+
+
+def elf_sections(f: BinaryIO, file_size: int) -> Optional[List[Tuple[str, int, int]]]:
+    """
+    (name, file offset, size) of every section with file content, from the ELF
+    section header table. None if the file is not ELF or has no usable table.
+    """
+    f.seek(0)
+    ident = f.read(16)
+    if len(ident) < 16 or ident[:4] != b"\x7fELF":
+        return None
+    end = "<" if ident[5] == 1 else ">"
+    if ident[4] == 2:  # ELFCLASS64
+        ehdr, shdr = end + "HHIQQQIHHHHHH", end + "IIQQQQIIQQ"
+    elif ident[4] == 1:  # ELFCLASS32
+        ehdr, shdr = end + "HHIIIIIHHHHHH", end + "IIIIIIIIII"
+    else:
+        return None
+
+    raw = f.read(struct.calcsize(ehdr))
+    if len(raw) < struct.calcsize(ehdr):
+        return None
+    _, _, _, _, _, shoff, _, _, _, _, shentsize, shnum, shstrndx = struct.unpack(ehdr, raw)
+    if not shoff or not shnum or shentsize < struct.calcsize(shdr) or shoff + shnum * shentsize > file_size:
+        return None
+
+    f.seek(shoff)
+    table = f.read(shnum * shentsize)
+    headers = []
+    for i in range(shnum):
+        name, sh_type, _, _, offset, size = struct.unpack_from(shdr, table, i * shentsize)[:6]
+        headers.append((name, sh_type, offset, size))
+
+    if shstrndx >= shnum:
+        return None
+    _, _, str_off, str_size = headers[shstrndx]
+    if str_off + str_size > file_size:
+        return None
+    f.seek(str_off)
+    names = f.read(str_size)
+
+    out: List[Tuple[str, int, int]] = []
+    for name_off, sh_type, offset, size in headers:
+        if sh_type == SHT_NOBITS or not size or offset + size > file_size:
+            continue
+        end_name = names.find(b"\x00", name_off)
+        name = names[name_off:end_name if end_name != -1 else None].decode("ascii", errors="replace")
+        out.append((name, offset, size))
+    return out
+
+
+def _wanted(name: str) -> bool:
+    return any(name == s or name.startswith(s + ".") for s in NATIVE_SECTIONS)
+
+
+def iter_printable_runs(
+    f: BinaryIO,
+    start: int,
+    size: int,
+    chunk_size: int = NATIVE_CHUNK_SIZE,
+    min_len: int = NATIVE_MIN_RUN,
+    max_len: int = NATIVE_MAX_RUN,
+) -> Iterator[List[Tuple[int, bytes]]]:
+    """
+    `strings` over [start, start + size): yields, per chunk, the printable runs
+    as (file offset, bytes). A run cut by the chunk end is carried to the next
+    chunk, so memory stays at chunk_size + max_len.
+    """
+    run_rx = re.compile(rb"[\x20-\x7e\t]{%d,}" % min_len)
+    pos = start
+    end = start + size
+    carry = b""
+    while pos < end:
+        f.seek(pos)
+        chunk = f.read(min(chunk_size, end - pos))
+        if not chunk:
+            break
+        buf = carry + chunk
+        base = pos - len(carry)
+        pos += len(chunk)
+
+        cut = len(buf)
+        if pos < end:
+            while cut > 0 and buf[cut - 1] in _PRINTABLE and len(buf) - cut < max_len:
+                cut -= 1
+        runs = [(base + m.start(), m.group(0)[:max_len]) for m in run_rx.finditer(buf, 0, cut)]
+        if runs:
+            yield runs
+        carry = buf[cut:]
+
+
+def _patterns_digest(patterns_path: Path) -> str:
+    h = hashlib.sha256(patterns_path.read_bytes())
+    h.update(f"|{EXTRACTOR_VERSION}|{NATIVE_SECTIONS}|{NATIVE_MIN_RUN}|{NATIVE_MAX_RUN}".encode())
+    return h.hexdigest()[:16]
+
+
+def scan_library(path: Path, compiled: List[Tuple[Dict[str, Any], re.Pattern]]) -> Dict[str, Any]:
+    """
+    Match the regex patterns against the strings of one .so. Runs of a chunk are
+    joined with newlines and matched in one pass per pattern; matches spanning two
+    runs are dropped. Only masked previews and secret hashes are kept.
+    """
+    hits: List[Dict[str, Any]] = []
+    bytes_scanned = 0
+    file_size = path.stat().st_size
+    with path.open("rb") as f:
+        sections = elf_sections(f, file_size)
+        if sections is None:
+            regions = [("", 0, file_size)]
+        else:
+            regions = [s for s in sections if _wanted(s[0])]
+
+        for section, offset, size in regions:
+            bytes_scanned += size
+            for runs in iter_printable_runs(f, offset, size):
+                buf = b"\n".join(r for _, r in runs)
+                starts: List[int] = []
+                pos = 0
+                for _, r in runs:
+                    starts.append(pos)
+                    pos += len(r) + 1
+
+                for p, rx in compiled:
+                    for m in rx.finditer(buf):
+                        data = m.group(0)
+                        if b"\n" in data:
+                            continue
+                        k = bisect_right(starts, m.start()) - 1
+                        secret = data.decode("utf-8", errors="ignore")
+                        hits.append(
+                            {
+                                "id": p.get("id", "SH-RX-XXX"),
+                                "section": section or None,
+                                "offset": runs[k][0] + (m.start() - starts[k]),
+                                "match_preview": mask_secret(secret),
+                                "secret_sha256": secret_sha256(secret),
+                            }
+                        )
+    return {"hits": hits, "bytes_scanned": bytes_scanned, "elf": sections is not None}
+
+
+def _cached_scan(
+    path: Path,
+    compiled: List[Tuple[Dict[str, Any], re.Pattern]],
+    digest: str,
+) -> Tuple[Dict[str, Any], bool]:
+    """Results per (library sha256, patterns digest): vendor .so files recur across apps."""
+    lib_sha = sha256_file(path)
+    cache_file = NATIVE_CACHE_DIR / f"{lib_sha}-{digest}.json"
+    try:
+        return json.loads(cache_file.read_text(encoding="utf-8")), True
+    except Exception:
+        pass
+
+    result = scan_library(path, compiled)
+    try:
+        ensure_dir(NATIVE_CACHE_DIR)
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(result), encoding="utf-8")
+        tmp.replace(cache_file)
+    except Exception:
+        pass  # cache is best-effort
+    return result, False
+
+
+def run_native_engine(work_dir: Path, patterns_path: Path) -> Dict[str, Any]:
+    """
+    Scans the .rodata/.data strings of the native libraries (lib/**/*.so) of the
+    extracted APK with the regex patterns.
+    """
+    patterns = load_regex_patterns(patterns_path)
+    compiled = compile_patterns(patterns)
+    by_id = {p.get("id"): p for p, _ in compiled}
+    digest = _patterns_digest(patterns_path)
+
+    findings: List[Dict[str, Any]] = []
+    libraries = 0
+    cache_hits = 0
+    bytes_scanned = 0
+
+    for lib in sorted(work_dir.glob("lib/**/*.so")):
+        if not lib.is_file():
+            continue
+        libraries += 1
+        try:
+            result, cached = _cached_scan(lib, compiled, digest)
+        except OSError:
+            continue
+        cache_hits += int(cached)
+        if not cached:
+            bytes_scanned += result.get("bytes_scanned", 0)
+
+        rel = str(lib.relative_to(work_dir))
+        for h in result.get("hits", []):
+            p = by_id.get(h["id"], {})
+            findings.append(
+                {
+                    "id": h["id"],
+                    "title": p.get("title", "Secret détecté dans une librairie native"),
+                    "severity": p.get("severity", "MEDIUM"),
+                    "evidence": {
+                        "engine": "native",
+                        "file": rel,
+                        "section": h.get("section"),
+                        "offset": h.get("offset"),
+                        "match_preview": h.get("match_preview"),
+                        "secret_sha256": h.get("secret_sha256"),
+                    },
+                    "recommendation": p.get(
+                        "recommendation",
+                        "Ne pas embarquer de secret dans le code natif: le déplacer côté serveur et le révoquer/rotater.",
+                    ),
+                }
+            )
+
+    return {
+        "engine": "native",
+        "findings": findings,
+        "stats": {
+            "libraries": libraries,
+            "cache_hits": cache_hits,
+            "bytes_scanned": bytes_scanned,
+            "matches": len(findings),
+        },
+    }
@@ -1,10 +1,34 @@
 # app/engines/regex_engine.py
 import json
+import os
 import re
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from ..utils import iter_files, is_probably_text_file, safe_read_text, mask_secret
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+
+from ..dedupe import secret_sha256
+from ..utils import (
+    SCAN_MAX_OVERLAP,
+    LineIndex,
+    ScanWindow,
+    detect_utf16,
+    iter_byte_windows,
+    iter_files,
+    iter_wide_windows,
+    is_probably_text_file,
+    mask_secret,
+    wide_span_is_ascii,
+)
+
+# also scan UTF-16 files through their ASCII "wide" view (like YARA's `ascii wide`)
+REGEX_WIDE = os.getenv("SH_REGEX_WIDE", "1") == "1"
+# cumulative time a single pattern may spend in one scan before it is disabled (0 = no limit)
+PATTERN_BUDGET_MS = float(os.getenv("SH_REGEX_PATTERN_BUDGET_MS", "10000"))
 
 def load_regex_patterns(patterns_path: Path) -> List[Dict[str, Any]]:
     """
@@ -21,6 +45,7 @@ def load_regex_patterns(patterns_path: Path) -> List[Dict[str, Any]]:
     return data
 
 def compile_patterns(patterns: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], re.Pattern]]:
+    """Patterns are compiled as bytes: files are matched without being decoded."""
     compiled: List[Tuple[Dict[str, Any], re.Pattern]] = []
     for p in patterns:
         pat = p.get("pattern")
@@ -29,57 +54,204 @@ def compile_patterns(patterns: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any
         flags = 0
         if p.get("ignore_case", False):
             flags |= re.IGNORECASE
-        compiled.append((p, re.compile(pat, flags)))
+        compiled.append((p, re.compile(pat.encode("utf-8"), flags)))
     return compiled
 
+def max_match_len(compiled: List[Tuple[Dict[str, Any], re.Pattern]], cap: int = SCAN_MAX_OVERLAP) -> int:
+    """
+    Longest possible match over all patterns, used as the window overlap.
+    Unbounded repeats ({n,}, +, *) are capped to `cap`.
+    """
+    longest = 0
+    for _, rx in compiled:
+        try:
+            _, hi = sre_parse.parse(rx.pattern, rx.flags).getwidth()
+        except Exception:
+            hi = cap
+        longest = max(longest, min(hi, cap))
+    return longest
+
+def pattern_key(p: Dict[str, Any]) -> str:
+    return str(p.get("id") or p.get("pattern"))
+
+class PatternProfile:
+    """
+    Time and match count per pattern for one scan. A pattern that exceeds the
+    budget is disabled for the rest of the scan. Python's re cannot be
+    interrupted, so the check runs between windows: one window
+    (SH_SCAN_CHUNK_BYTES) bounds the overrun.
+    """
+
+    def __init__(self, budget_ms: float = PATTERN_BUDGET_MS) -> None:
+        self.budget_ns = int(budget_ms * 1_000_000)
+        self.time_ns: Dict[str, int] = {}
+        self.matches: Dict[str, int] = {}
+        self.calls: Dict[str, int] = {}
+        self.disabled: Dict[str, str] = {}
+
+    def active(self, key: str) -> bool:
+        return key not in self.disabled
+
+    def add(self, key: str, ns: int, matches: int) -> None:
+        total = self.time_ns.get(key, 0) + ns
+        self.time_ns[key] = total
+        self.matches[key] = self.matches.get(key, 0) + matches
+        self.calls[key] = self.calls.get(key, 0) + 1
+        if self.budget_ns and total > self.budget_ns and key not in self.disabled:
+            self.disabled[key] = (
+                f"regex pattern {key} disabled for the rest of the scan: "
+                f"{total / 1e6:.0f} ms > budget {self.budget_ns / 1e6:g} ms"
+            )
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Per pattern, slowest first."""
+        return [
+            {
+                "id": k,
+                "time_ms": round(ns / 1e6, 3),
+                "matches": self.matches.get(k, 0),
+                "calls": self.calls.get(k, 0),
+                "disabled": k in self.disabled,
+            }
+            for k, ns in sorted(self.time_ns.items(), key=lambda kv: -kv[1])
+        ]
+
+    def warnings(self) -> List[str]:
+        return list(self.disabled.values())
+
+def _scan_windows(
+    windows: Iterator[ScanWindow],
+    compiled: List[Tuple[Dict[str, Any], re.Pattern]],
+    overlap: int,
+    profile: Optional[PatternProfile] = None,
+) -> Iterator[Tuple[int, int, int, bytes, int, int]]:
+    """
+    Yields (pattern index, absolute start, absolute end, matched bytes, line, column)
+    once per match, exactly as one finditer over the whole file would.
+    A match starting in the last `overlap` bytes of a window may be cut by the chunk
+    boundary: it is left to the next window, whose search resumes (per pattern)
+    where the whole-file search would, so overlapping candidates line up the same.
+    """
+    keys = [pattern_key(p) for p, _ in compiled]
+    # per pattern: absolute offset where the whole-file search continues
+    resume = [0] * len(compiled)
+
+    for w in windows:
+        tail_start = max(0, len(w.data) - overlap) if not w.is_last else len(w.data) + 1
+        lines = LineIndex(w.data, w.line, w.column)
+
+        for i, (_, rx) in enumerate(compiled):
+            if profile is not None and not profile.active(keys[i]):
+                continue
+            pos = max(0, resume[i] - w.offset)
+            found = []
+            t0 = time.perf_counter_ns()
+            for m in rx.finditer(w.data, pos):
+                if m.start() >= tail_start:
+                    break  # may be cut by the chunk boundary: the next window sees it whole
+                found.append(m)
+            if profile is not None:
+                profile.add(keys[i], time.perf_counter_ns() - t0, len(found))
+
+            # positions up to the tail were all tried: the next window starts there at the earliest
+            resume[i] = max(resume[i], w.offset + min(tail_start, len(w.data)))
+            for m in found:
+                start, end = m.span()
+                resume[i] = max(resume[i], w.offset + end)
+                line, column = lines.locate(start)
+                yield i, w.offset + start, w.offset + end, m.group(0), line, column
+
 def run_regex_engine(work_dir: Path, patterns_path: Path) -> Dict[str, Any]:
     """
     Returns:
       {
         "engine": "regex",
         "findings": [...],
-        "stats": {"scanned_files": x, "matches": y}
+        "stats": {"scanned_files": x, "wide_files": w, "matches": y, "patterns": [...]},
+        "warnings": [...]   # patterns disabled by the time budget
       }
+    Files are scanned as bytes; only matched spans are decoded. UTF-16 files are
+    scanned through their `wide` view (see utils.iter_wide_windows) with the
+    patterns that do not opt out ("wide": false).
     """
     patterns = load_regex_patterns(patterns_path)
     compiled = compile_patterns(patterns)
+    wide_compiled = [(p, rx) for p, rx in compiled if p.get("wide", True)]
 
     findings: List[Dict[str, Any]] = []
     scanned_files = 0
+    wide_files = 0
     matches = 0
 
+    overlap = max_match_len(compiled)
+    profile = PatternProfile()
+
     for f in iter_files(work_dir):
         if not is_probably_text_file(f):
             continue
 
         scanned_files += 1
-        text = safe_read_text(f)
-
-        for p, rx in compiled:
-            for m in rx.finditer(text):
-                matches += 1
-                raw_match = m.group(0)
-                preview = mask_secret(raw_match)
-
-                findings.append(
-                    {
-                        "id": p.get("id", "SH-RX-XXX"),
-                        "title": p.get("title", "Secret détecté via regex"),
-                        "severity": p.get("severity", "MEDIUM"),
-                        "evidence": {
-                            "engine": "regex",
-                            "file": str(f.relative_to(work_dir)),
-                            "match_preview": preview,
-                        },
-                        "recommendation": p.get(
-                            "recommendation",
-                            "Supprimer le secret du code, le révoquer/rotater et utiliser un gestionnaire de secrets.",
-                        ),
+        rel = str(f.relative_to(work_dir))
+        phase = detect_utf16(f) if REGEX_WIDE else None
+
+        try:
+            if phase is None:
+                subset = compiled
+                hits = _scan_windows(iter_byte_windows(f, overlap=overlap), subset, overlap, profile)
+            else:
+                wide_files += 1
+                subset = wide_compiled
+                hits = _scan_windows(iter_wide_windows(f, phase, overlap=overlap), subset, overlap, profile)
+
+            raw = f.open("rb") if phase is not None else None
+            try:
+                for i, start, end, data, line, column in hits:
+                    if raw is not None:
+                        if not wide_span_is_ascii(raw, phase, start, end):
+                            continue
+                        start *= 2  # code units -> bytes
+
+                    p = subset[i][0]
+                    matches += 1
+                    secret = data.decode("utf-8", errors="ignore")
+                    evidence: Dict[str, Any] = {
+                        "engine": "regex",
+                        "file": rel,
+                        "offset": start,
+                        "line": line,
+                        "column": column,
+                        "match_preview": mask_secret(secret),
+                        "secret_sha256": secret_sha256(secret),
                     }
-                )
+                    if raw is not None:
+                        evidence["encoding"] = "utf-16le" if phase == 0 else "utf-16be"
+
+                    findings.append(
+                        {
+                            "id": p.get("id", "SH-RX-XXX"),
+                            "title": p.get("title", "Secret détecté via regex"),
+                            "severity": p.get("severity", "MEDIUM"),
+                            "evidence": evidence,
+                            "recommendation": p.get(
+                                "recommendation",
+                                "Supprimer le secret du code, le révoquer/rotater et utiliser un gestionnaire de secrets.",
+                            ),
+                        }
+                    )
+            finally:
+                if raw is not None:
+                    raw.close()
+        except OSError:
+            continue
 
     return {
         "engine": "regex",
         "findings": findings,
-        "stats": {"scanned_files": scanned_files, "matches": matches},
+        "stats": {
+            "scanned_files": scanned_files,
+            "wide_files": wide_files,
+            "matches": matches,
+            "patterns": profile.summary(),
+        },
+        "warnings": profile.warnings(),
     }
@@ -1,8 +1,71 @@
 # app/engines/yara_engine.py
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
-from ..utils import iter_files, mask_secret, is_probably_text_file, safe_read_text
+from ..dedupe import secret_sha256
+from ..utils import ensure_dir, iter_files, mask_secret, is_probably_text_file
+
+YARA_CACHE_DIR = Path(os.getenv("SH_YARA_CACHE_DIR", "data/cache/yara"))
+YARA_THREADS = int(os.getenv("SH_YARA_THREADS", "0") or 0) or min(8, (os.cpu_count() or 1) * 2)
+YARA_TIMEOUT_S = int(os.getenv("SH_YARA_TIMEOUT", "60"))
+# per-file timeouts / errors listed in the result (all of them are counted)
+MAX_REPORTED_ERRORS = 20
+
+# rules-file hash -> compiled yara.Rules (loaded once per process)
+_RULES_CACHE: Dict[str, Any] = {}
+_RULES_LOCK = threading.Lock()
+
+def _rules_digest(yara: Any, rules_path: Path) -> str:
+    h = hashlib.sha256(rules_path.read_bytes())
+    # compiled rules are only loadable by the same libyara
+    h.update(str(getattr(yara, "YARA_VERSION", "")).encode())
+    return h.hexdigest()
+
+def load_compiled_rules(yara: Any, rules_path: Path) -> Any:
+    """
+    Returns compiled rules for rules_path: in-process cache, then <digest>.yarc on
+    disk, then yara.compile (whose result is saved for the next process).
+    """
+    digest = _rules_digest(yara, rules_path)
+    with _RULES_LOCK:
+        rules = _RULES_CACHE.get(digest)
+        if rules is not None:
+            return rules
+
+        yarc = YARA_CACHE_DIR / f"{digest}.yarc"
+        if yarc.exists():
+            try:
+                rules = yara.load(filepath=str(yarc))
+            except Exception:
+                rules = None
+
+        if rules is None:
+            rules = yara.compile(filepath=str(rules_path))
+            try:
+                ensure_dir(YARA_CACHE_DIR)
+                tmp = yarc.with_suffix(f".{os.getpid()}.tmp")
+                rules.save(filepath=str(tmp))
+                tmp.replace(yarc)
+            except Exception:
+                pass  # cache is best-effort
+
+        _RULES_CACHE[digest] = rules
+        return rules
+
+def _first_string_match(m: Any) -> Tuple[Optional[int], bytes]:
+    """(offset, matched bytes) of the first string instance of a yara match."""
+    for s in getattr(m, "strings", None) or []:
+        instances = getattr(s, "instances", None)
+        if instances is not None:  # yara-python >= 4.3: StringMatch objects
+            for inst in instances:
+                return inst.offset, bytes(inst.matched_data)
+        else:  # older yara-python: (offset, identifier, data)
+            return s[0], s[2]
+    return None, b""
 
 def run_yara_engine(work_dir: Path, rules_path: Path) -> Dict[str, Any]:
     """
@@ -20,7 +83,7 @@ def run_yara_engine(work_dir: Path, rules_path: Path) -> Dict[str, Any]:
         }
 
     try:
-        rules = yara.compile(filepath=str(rules_path))
+        rules = load_compiled_rules(yara, rules_path)
     except Exception as e:
         return {
             "engine": "yara",
@@ -29,35 +92,34 @@ def run_yara_engine(work_dir: Path, rules_path: Path) -> Dict[str, Any]:
             "error": f"YARA compile error ({rules_path}): {e}",
         }
 
-    findings: List[Dict[str, Any]] = []
-    scanned_files = 0
-    matches_count = 0
-
-    for f in iter_files(work_dir):
-        # YARA can scan binaries too, but to reduce noise we keep text-ish by default
-        if not is_probably_text_file(f):
-            continue
-        scanned_files += 1
+    # YARA can scan binaries too, but to reduce noise we keep text-ish by default
+    files = [f for f in iter_files(work_dir) if is_probably_text_file(f)]
 
+    def _match(f: Path) -> Tuple[List[Any], Optional[str]]:
+        # libyara maps the file itself and releases the GIL while scanning
         try:
-            data = f.read_bytes()
-        except Exception:
-            continue
+            return rules.match(filepath=str(f), timeout=YARA_TIMEOUT_S), None
+        except yara.TimeoutError:
+            return [], f"yara {f.relative_to(work_dir)}: timed out after {YARA_TIMEOUT_S}s"
+        except yara.Error as e:
+            return [], f"yara {f.relative_to(work_dir)}: {e}"
 
-        try:
-            matches = rules.match(data=data)
-        except Exception:
-            continue
-
-        if not matches:
-            continue
+    findings: List[Dict[str, Any]] = []
+    matches_count = 0
+    errors: List[str] = []
 
-        # Add some context preview
-        text_preview = safe_read_text(f, max_bytes=50_000)
-        preview = mask_secret(text_preview[:200])
+    with ThreadPoolExecutor(max_workers=YARA_THREADS) as ex:
+        results = list(ex.map(_match, files))
 
+    for f, (matches, err) in zip(files, results):
+        if err is not None:
+            errors.append(err)
         for m in matches:
             matches_count += 1
+            offset, data = _first_string_match(m)
+            # wide strings carry interleaved NULs
+            secret = data.replace(b"\x00", b"").decode("utf-8", errors="ignore")
+            preview = mask_secret(secret[:200])
             findings.append(
                 {
                     "id": f"SH-YR-{m.rule}",
@@ -67,14 +129,22 @@ def run_yara_engine(work_dir: Path, rules_path: Path) -> Dict[str, Any]:
                         "engine": "yara",
                         "file": str(f.relative_to(work_dir)),
                         "rule": m.rule,
+                        "offset": offset,
                         "preview": preview,
+                        "secret_sha256": secret_sha256(secret),
                     },
                     "recommendation": "Vérifier le fichier concerné, supprimer le secret, révoquer/rotater le token et utiliser un gestionnaire de secrets.",
                 }
             )
 
-    return {
+    out: Dict[str, Any] = {
         "engine": "yara",
         "findings": findings,
-        "stats": {"scanned_files": scanned_files, "matches": matches_count},
+        "stats": {"scanned_files": len(files), "matches": matches_count, "failed_files": len(errors)},
     }
+    # a file YARA could not finish is not a clean file: say so
+    if errors and len(errors) == len(files):
+        out["error"] = "; ".join(errors[:MAX_REPORTED_ERRORS])
+    elif errors:
+        out["warnings"] = errors[:MAX_REPORTED_ERRORS]
+    return out
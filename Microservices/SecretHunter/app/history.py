@@ -0,0 +1,169 @@
+# app/history.py
+import hashlib
+import hmac
+import math
+import os
+import secrets
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from .db import DATA_DIR, list_secret_fingerprints, lookup_secret_index, record_secret_index
+from .dedupe import rule_family
+
+SALT_PATH = DATA_DIR / "fingerprint.salt"
+BLOOM_ERROR_RATE = float(os.getenv("SH_BLOOM_ERROR_RATE", "0.01"))
+
+STATUS_NEW = "new"
+STATUS_RECURRING = "recurring"
+STATUS_BASELINED = "baselined"
+
+
+def _load_salt() -> bytes:
+    """SH_FINGERPRINT_SALT, else a random salt generated once and kept in data/."""
+    env = os.getenv("SH_FINGERPRINT_SALT")
+    if env:
+        return env.encode("utf-8")
+    try:
+        return SALT_PATH.read_bytes()
+    except FileNotFoundError:
+        salt = secrets.token_hex(32).encode("ascii")
+        try:
+            fd = os.open(SALT_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:  # another worker created it first
+            return SALT_PATH.read_bytes()
+        with os.fdopen(fd, "wb") as f:
+            f.write(salt)
+        return salt
+
+
+class BloomFilter:
+    """Bit array + k probes derived from the (already uniform) hex fingerprint."""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE) -> None:
+        self.capacity = max(1024, capacity)
+        self.m = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / self.capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _probes(self, fp: str) -> Iterable[int]:
+        h1 = int(fp[:16], 16)
+        h2 = int(fp[16:32], 16) | 1
+        m = self.m
+        return ((h1 + i * h2) % m for i in range(self.k))
+
+    def add(self, fp: str) -> None:
+        for b in self._probes(fp):
+            self.bits[b >> 3] |= 1 << (b & 7)
+        self.count += 1
+
+    def __contains__(self, fp: str) -> bool:
+        bits = self.bits
+        return all(bits[b >> 3] & (1 << (b & 7)) for b in self._probes(fp))
+
+
+class SecretHistory:
+    """
+    Per-package index of salted secret fingerprints (sh_secret_index).
+    A Bloom filter per package, loaded lazily from the table, answers the common
+    "never seen" case without touching SQLite; only possible hits are looked up.
+    """
+
+    def __init__(self, salt: Optional[bytes] = None) -> None:
+        self._salt = salt
+        self._blooms: Dict[str, BloomFilter] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def salt(self) -> bytes:
+        if self._salt is None:
+            self._salt = _load_salt()
+        return self._salt
+
+    def secret_fingerprint(self, finding: Dict[str, Any]) -> str:
+        """HMAC(salt, secret hash | rule family): stable across builds, locations and engines."""
+        ev = finding.get("evidence") or {}
+        secret_hash = ev.get("secret_sha256") or ev.get("fingerprint") or f"{finding.get('id')}|{ev.get('file')}"
+        msg = f"{secret_hash}|{rule_family(finding)}".encode("utf-8")
+        return hmac.new(self.salt, msg, hashlib.sha256).hexdigest()
+
+    def _bloom(self, package: str) -> BloomFilter:
+        with self._lock:
+            bloom = self._blooms.get(package)
+            if bloom is None:
+                fps = list_secret_fingerprints(package)
+                bloom = BloomFilter(2 * len(fps))
+                for fp in fps:
+                    bloom.add(fp)
+                self._blooms[package] = bloom
+            return bloom
+
+    def _remember(self, package: str, fps: Iterable[str]) -> None:
+        bloom = self._bloom(package)
+        with self._lock:
+            for fp in fps:
+                bloom.add(fp)
+            if bloom.count > bloom.capacity:
+                # past its capacity the false-positive rate climbs: rebuild bigger next time
+                self._blooms.pop(package, None)
+
+    def track(self, payload: Dict[str, Any], scan_id: int) -> Dict[str, int]:
+        """
+        Annotates every finding with evidence.history = {status, first_seen_scan_id,
+        secret_fingerprint} and records them in the index. Returns counts per status.
+        """
+        package = history_key(payload)
+        findings: List[Dict[str, Any]] = payload.get("findings_list") or []
+        fps = [self.secret_fingerprint(f) for f in findings]
+
+        bloom = self._bloom(package)
+        maybe = [fp for fp in set(fps) if fp in bloom]
+        known = lookup_secret_index(package, maybe) if maybe else {}
+
+        counts = {STATUS_NEW: 0, STATUS_RECURRING: 0, STATUS_BASELINED: 0}
+        for f, fp in zip(findings, fps):
+            row = known.get(fp)
+            if row is not None and row["baselined"]:
+                status = STATUS_BASELINED
+            elif row is not None and row["first_seen_scan_id"] is not None:
+                status = STATUS_RECURRING
+            else:
+                status = STATUS_NEW
+            counts[status] += 1
+            first_seen = row["first_seen_scan_id"] if row is not None and row["first_seen_scan_id"] is not None else scan_id
+            f.setdefault("evidence", {})["history"] = {
+                "status": status,
+                "first_seen_scan_id": first_seen,
+                "secret_fingerprint": fp,
+            }
+
+        record_secret_index(package, scan_id, fps)
+        self._remember(package, fps)
+        return counts
+
+    def forget(self, package: str) -> None:
+        """Drops the cached Bloom filter (after baseline changes that add rows)."""
+        with self._lock:
+            self._blooms.pop(package, None)
+
+
+def history_key(payload: Dict[str, Any]) -> str:
+    """Index key: the package name, or the APK hash when it could not be parsed."""
+    package = payload.get("package")
+    if package:
+        return package
+    sha = ((payload.get("meta") or {}).get("context") or {}).get("sha256")
+    return f"sha256:{sha}" if sha else "unknown"
+
+
+def filter_new(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Diff-only view: the payload with only the findings first seen in this scan."""
+    out = dict(payload)
+    out["findings_list"] = [
+        f for f in payload.get("findings_list") or []
+        if ((f.get("evidence") or {}).get("history") or {}).get("status") == STATUS_NEW
+    ]
+    return out
+
+
+HISTORY = SecretHistory()
@@ -1,18 +1,53 @@
 # app/main.py
+import hashlib
 import os
-import shutil
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 
-from fastapi import FastAPI, File, Form, UploadFile
+from fastapi import FastAPI, File, Form, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 
-from .db import init_db, save_scan, get_scan, list_scans, UPLOADS_DIR
-from .scanner import scan_secrets
+from .db import (
+    init_db, save_scan, get_scan, list_scans, list_findings, update_scan_payload, set_baseline, list_baseline,
+    record_pattern_stats, list_pattern_stats, find_completed_scan, UPLOADS_DIR,
+)
+from .history import HISTORY, STATUS_NEW, filter_new, history_key
+from .models import BaselineRequest
+from .scanner import WORKDIRS, rules_hash, scan_secrets
+from .singleflight import SingleFlight
+from .streaming import stream_scan, wants_ndjson
 from .utils import ensure_dir, sanitize_parent_scan_id
 
 app = FastAPI(title="SecretHunter", version="1.0")
 
+MAX_FINDINGS_PAGE = int(os.getenv("SH_MAX_FINDINGS_PAGE", "1000"))
+
+# one pipeline per APK at a time: WORK_DIR/<sha256> is shared by every scan of it
+SCANS_IN_FLIGHT = SingleFlight()
+
+def _store_upload(file: UploadFile) -> Tuple[Path, str]:
+    """Hashes while copying; the APK lands in UPLOADS_DIR/<sha256>/<name>, never over another upload."""
+    h = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(dir=UPLOADS_DIR, suffix=".part")
+    with os.fdopen(fd, "wb") as out:
+        for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+            h.update(chunk)
+            out.write(chunk)
+    sha256 = h.hexdigest()
+    dest_dir = UPLOADS_DIR / sha256
+    ensure_dir(dest_dir)
+    dest = dest_dir / (Path(file.filename or "upload.apk").name or "upload.apk")
+    os.replace(tmp_name, dest)
+    return dest, sha256
+
+def _deduplicated(payload: Dict[str, Any], source: str) -> Dict[str, Any]:
+    """Copy of a shared / stored payload, marked with where it came from (in_flight | completed)."""
+    meta = dict(payload.get("meta") or {})
+    meta["context"] = {**(meta.get("context") or {}), "deduplicated": source}
+    return {**payload, "meta": meta}
+
 @app.on_event("startup")
 def on_startup() -> None:
     init_db()
@@ -24,8 +59,11 @@ def health():
 
 @app.post("/scan-secrets")
 async def scan_secrets_endpoint(
+    request: Request,
     file: UploadFile = File(...),
     parent_scan_id: Optional[str] = Form(None),  # IMPORTANT: avoid 422 on ""
+    only_new: bool = Form(False),
+    force: bool = Form(False),
 ):
     try:
         parent_id = sanitize_parent_scan_id(parent_scan_id)
@@ -35,38 +73,132 @@ async def scan_secrets_endpoint(
             content={"detail": "parent_scan_id must be an integer or null"},
         )
 
-    # Save upload to disk
-    tmp_path = UPLOADS_DIR / file.filename
-    with tmp_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # Save upload to disk (blocking hash + copy: off the event loop)
+    apk_path, sha256 = await run_in_threadpool(_store_upload, file)
 
     # Flags via env (docker-friendly)
     enable_regex = os.getenv("SH_ENABLE_REGEX", "1") == "1"
     enable_yara = os.getenv("SH_ENABLE_YARA", "0") == "1"
     enable_gitleaks = os.getenv("SH_ENABLE_GITLEAKS", "0") == "1"
+    enable_entropy = os.getenv("SH_ENABLE_ENTROPY", "0") == "1"
+    enable_native = os.getenv("SH_ENABLE_NATIVE", "1") == "1"
     gitleaks_bin = os.getenv("SH_GITLEAKS_BIN")  # optional
 
-    payload = scan_secrets(
-        apk_path=tmp_path,
-        parent_scan_id=parent_id,
-        enable_regex=enable_regex,
-        enable_yara=enable_yara,
-        enable_gitleaks=enable_gitleaks,
-        gitleaks_bin=gitleaks_bin,
-    )
+    engines = [
+        name for name, on in (
+            ("regex", enable_regex), ("yara", enable_yara), ("gitleaks", enable_gitleaks),
+            ("entropy", enable_entropy), ("native", enable_native),
+        ) if on
+    ]
+    config_hash = rules_hash(engines)
+
+    def _run(on_finding=None):
+        # same APK + same rules already scanned: answer from storage (force=true rescans)
+        if not force:
+            done_id = find_completed_scan(sha256, config_hash)
+            if done_id is not None:
+                done = get_scan(done_id)
+                if done:
+                    return _deduplicated(done, "completed")
+
+        def _scan_and_store():
+            return _store(scan_secrets(
+                apk_path=apk_path,
+                parent_scan_id=parent_id,
+                enable_regex=enable_regex,
+                enable_yara=enable_yara,
+                enable_gitleaks=enable_gitleaks,
+                enable_entropy=enable_entropy,
+                enable_native=enable_native,
+                gitleaks_bin=gitleaks_bin,
+                on_finding=on_finding,
+                sha256=sha256,
+            ))
+
+        # the same APK is being scanned: wait for that scan instead of starting another one
+        payload, shared = SCANS_IN_FLIGHT.run(sha256, _scan_and_store)
+        return _deduplicated(payload, "in_flight") if shared else payload
+
+    def _store(payload):
+        scan_id = save_scan(payload)
+        payload["scan_id"] = scan_id
+
+        pattern_stats = payload["meta"]["context"].get("pattern_stats")
+        if pattern_stats:
+            record_pattern_stats(scan_id, pattern_stats)
 
-    scan_id = save_scan(payload)
-    payload["scan_id"] = scan_id
+        # new / recurring / baselined against previous scans of the same package
+        if os.getenv("SH_HISTORY", "1") == "1":
+            payload["meta"]["context"]["history"] = HISTORY.track(payload, scan_id)
+            update_scan_payload(scan_id, payload)
+        return payload
 
-    return payload
+    def _finish(payload):
+        return filter_new(payload) if only_new else payload
+
+    if wants_ndjson(request):
+        # only_new needs the history of every finding: they are sent after the scan
+        return stream_scan(_run, _finish, live=not only_new)
+    return _finish(await run_in_threadpool(_run))
 
 @app.get("/scans/{scan_id}")
-def get_scan_endpoint(scan_id: int):
-    data = get_scan(scan_id)
+def get_scan_endpoint(scan_id: int, only_new: bool = False, include_findings: bool = True):
+    # include_findings=false: meta/context only, page findings with /scans/{id}/findings
+    data = get_scan(scan_id, include_findings=include_findings)
     if not data:
         return JSONResponse(status_code=404, content={"detail": "scan not found"})
-    return data
+    return filter_new(data) if only_new and include_findings else data
+
+@app.get("/scans/{scan_id}/findings")
+def list_findings_endpoint(
+    scan_id: int,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_FINDINGS_PAGE),
+    severity: Optional[str] = None,
+    only_new: bool = False,
+):
+    if get_scan(scan_id, include_findings=False) is None:
+        return JSONResponse(status_code=404, content={"detail": "scan not found"})
+    total, items = list_findings(
+        scan_id, offset=offset, limit=limit, severity=severity,
+        history_status=STATUS_NEW if only_new else None,
+    )
+    return {"scan_id": scan_id, "total": total, "offset": offset, "limit": limit, "items": items}
 
 @app.get("/scans")
 def list_scans_endpoint(limit: int = 20):
     return list_scans(limit=limit)
+
+@app.get("/stats/patterns")
+def pattern_stats_endpoint(limit: int = 100):
+    return {"items": list_pattern_stats(limit=limit)}
+
+@app.get("/workdirs")
+def workdirs_endpoint():
+    return {**WORKDIRS.stats(), "scans_in_flight": SCANS_IN_FLIGHT.running(), "shared_scans": SCANS_IN_FLIGHT.shared}
+
+@app.post("/baseline")
+def baseline_endpoint(req: BaselineRequest):
+    package = req.package
+    fingerprints = list(req.fingerprints)
+    if req.scan_id is not None:
+        data = get_scan(req.scan_id)
+        if not data:
+            return JSONResponse(status_code=404, content={"detail": "scan not found"})
+        package = package or history_key(data)
+        for f in data.get("findings_list") or []:
+            fp = ((f.get("evidence") or {}).get("history") or {}).get("secret_fingerprint")
+            if fp:
+                fingerprints.append(fp)
+    if not package:
+        return JSONResponse(status_code=422, content={"detail": "package or scan_id is required"})
+    if not fingerprints:
+        return JSONResponse(status_code=422, content={"detail": "no fingerprints to baseline"})
+
+    updated = set_baseline(package, fingerprints, baselined=req.baselined, reason=req.reason)
+    HISTORY.forget(package)
+    return {"package": package, "baselined": req.baselined, "updated": updated}
+
+@app.get("/baseline")
+def list_baseline_endpoint(package: str):
+    return {"package": package, "items": list_baseline(package)}
@@ -0,0 +1,17 @@
+# app/models.py
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class BaselineRequest(BaseModel):
+    """
+    Suppress (or un-suppress) secrets for a package. Either list the
+    evidence.history.secret_fingerprint values, or give a scan_id to baseline
+    every finding of that scan.
+    """
+    package: Optional[str] = None
+    scan_id: Optional[int] = None
+    fingerprints: List[str] = Field(default_factory=list)
+    reason: Optional[str] = None
+    baselined: bool = True
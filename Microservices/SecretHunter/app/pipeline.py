@@ -0,0 +1,169 @@
+# app/pipeline.py
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+STATUS_OK = "OK"
+STATUS_FAILED = "FAILED"
+STATUS_TIMEOUT = "TIMEOUT"
+
+
+@dataclass
+class Stage:
+    """
+    One node of the scan DAG.
+    - deps: stages that must have finished (whatever their status) before this one starts
+    - kind: "thread" (I/O, subprocesses, GIL-releasing C code) or "process" (CPU-bound Python)
+    - args: builds the call arguments from the results of finished stages
+    """
+    name: str
+    fn: Callable[..., Any]
+    deps: Tuple[str, ...] = ()
+    kind: str = "thread"
+    timeout: Optional[float] = None
+    args: Callable[[Dict[str, Any]], tuple] = field(default=lambda results: ())
+
+
+def _process_main(conn: Any, fn: Callable[..., Any], args: tuple) -> None:
+    try:
+        conn.send((True, fn(*args)))
+    except BaseException as e:
+        conn.send((False, str(e) or type(e).__name__))  # the exception itself may not pickle
+    finally:
+        conn.close()
+
+
+class _StageProcess:
+    """
+    A process stage in a process of its own, so that a timeout can kill it
+    (Process.kill) without touching the stages of other scans. result() is
+    waited for from a thread of the stage pool.
+    """
+
+    def __init__(self, fn: Callable[..., Any], args: tuple) -> None:
+        ctx = multiprocessing.get_context()
+        self._conn, child = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=_process_main, args=(child, fn, args))
+        self.process.start()
+        child.close()
+
+    def result(self) -> Any:
+        try:
+            ok, value = self._conn.recv()
+        except EOFError:
+            raise RuntimeError(f"stage process exited (code {self.process.exitcode})") from None
+        finally:
+            self._conn.close()
+            self.process.join()
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def kill(self) -> None:
+        # the waiting thread then gets EOFError and ends
+        self.process.kill()
+
+
+def run_stages(
+    stages: Sequence[Stage],
+    on_stage_done: Optional[Callable[[str, Dict[str, Any], Any], None]] = None,
+    abandoned: Optional[List[Future]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Runs every stage as soon as its deps are finished; independent stages overlap.
+    Returns (results, report):
+      results[name] = return value of each stage that finished OK
+      report[name]  = {"status": OK|FAILED|TIMEOUT, "kind", "duration_ms", "error"}
+    A timed-out stage is abandoned (its result is discarded) and its dependents still run.
+    A process stage is killed on timeout. A thread stage cannot be: its future is
+    appended to `abandoned`, and the caller must not hand out what the stage writes
+    to (the work dir) before that future is done.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        for d in s.deps:
+            if d not in by_name:
+                raise ValueError(f"stage {s.name!r} depends on unknown stage {d!r}")
+
+    pending: Dict[str, Stage] = dict(by_name)
+    running: Dict[Future, Tuple[Stage, float]] = {}
+    results: Dict[str, Any] = {}
+    report: Dict[str, Dict[str, Any]] = {}
+
+    threads = ThreadPoolExecutor(max_workers=max(1, len(stages)))
+    processes: Dict[Future, _StageProcess] = {}
+
+    def _finish(s: Stage, t0: float, status: str, value: Any = None, error: Optional[str] = None) -> None:
+        report[s.name] = {
+            "status": status,
+            "kind": s.kind,
+            "duration_ms": int((time.perf_counter() - t0) * 1000),
+            "error": error,
+        }
+        if status == STATUS_OK:
+            results[s.name] = value
+        if on_stage_done is not None:
+            on_stage_done(s.name, report[s.name], value)
+
+    try:
+        while pending or running:
+            for name, s in list(pending.items()):
+                if not all(d in report for d in s.deps):
+                    continue
+                del pending[name]
+                t0 = time.perf_counter()
+                try:
+                    call_args = s.args(results)
+                    if s.kind == "process":
+                        proc = _StageProcess(s.fn, call_args)
+                        fut = threads.submit(proc.result)
+                        processes[fut] = proc
+                    else:
+                        fut = threads.submit(s.fn, *call_args)
+                    running[fut] = (s, t0)
+                except Exception as e:
+                    _finish(s, t0, STATUS_FAILED, error=str(e))
+
+            if not running:
+                if pending and not any(all(d in report for d in s.deps) for s in pending.values()):
+                    raise ValueError(f"stage dependency cycle: {sorted(pending)}")
+                continue
+
+            now = time.perf_counter()
+            deadlines = [t0 + s.timeout - now for s, t0 in running.values() if s.timeout]
+            done, _ = wait(
+                list(running),
+                timeout=max(0.0, min(deadlines)) if deadlines else None,
+                return_when=FIRST_COMPLETED,
+            )
+
+            for fut in done:
+                s, t0 = running.pop(fut)
+                try:
+                    value = fut.result()
+                except Exception as e:
+                    _finish(s, t0, STATUS_FAILED, error=str(e) or type(e).__name__)
+                    continue
+                _finish(s, t0, STATUS_OK, value=value)
+
+            now = time.perf_counter()
+            for fut, (s, t0) in list(running.items()):
+                if s.timeout and now - t0 >= s.timeout:
+                    running.pop(fut)
+                    if fut in processes:
+                        processes[fut].kill()
+                    elif not fut.cancel() and abandoned is not None:
+                        abandoned.append(fut)
+                    _finish(s, t0, STATUS_TIMEOUT, error=f"timed out after {s.timeout:g}s")
+    finally:
+        # on an error, stop the process stages still running
+        for fut in running:
+            if fut in processes:
+                processes[fut].kill()
+            elif not fut.cancel() and abandoned is not None:
+                abandoned.append(fut)
+        threads.shutdown(wait=False, cancel_futures=True)
+
+    return results, report
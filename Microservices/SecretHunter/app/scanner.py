@@ -1,20 +1,35 @@
 # app/scanner.py
+import copy
+import hashlib
+import os
 import subprocess
 import zipfile
-import struct
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 from androguard.core.apk import APK
 
 from .db import WORK_DIR
 from .utils import Timer, ensure_dir, sha256_file
+from .dedupe import SH_DEDUPE, FindingMerger
+from .dex_strings import extract_apk_dex_strings
+from .pipeline import STATUS_OK, STATUS_TIMEOUT, Stage, run_stages
+from .workdir_cache import WorkDirCache, WorkDirEntry
 from .engines.regex_engine import run_regex_engine
 from .engines.yara_engine import run_yara_engine
 from .engines.gitleaks_engine import run_gitleaks_engine
+from .engines.entropy_engine import run_entropy_engine
+from .engines.native_engine import run_native_engine
 
 SERVICE_NAME = "SecretHunter"
 
+WORKDIRS = WorkDirCache(WORK_DIR)
+
+DEFAULT_REGEX_PATTERNS = Path("config") / "regex_patterns.json"
+DEFAULT_YARA_RULES = Path("rules") / "secrets.yar"
+DEFAULT_ENTROPY_RULES = Path("config") / "entropy_rules.json"
+
 
 def _extract_apk(apk_path: Path, out_dir: Path) -> int:
     ensure_dir(out_dir)
@@ -36,99 +51,101 @@ def _get_package(apk_path: Path) -> Optional[str]:
         return None
 
 
-def _apktool_decode(apk_path: Path, out_dir: Path) -> Tuple[bool, Optional[str]]:
+def _apktool_decode(apk_path: Path, out_dir: Path, timeout: Optional[float] = None) -> Tuple[bool, Optional[str]]:
     """
     Approach #1:
     apktool decode -> produces smali + decoded resources (best for regex/yara/gitleaks).
     """
     ensure_dir(out_dir)
     cmd = ["apktool", "d", "-f", "-o", str(out_dir), str(apk_path)]
-    p = subprocess.run(cmd, capture_output=True, text=True)
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False, f"apktool timed out after {timeout:g}s"
     if p.returncode != 0:
         err = (p.stderr or p.stdout or "").strip()
         return False, err[-1500:] if err else "apktool failed (no output)"
     return True, None
 
 
-def _uleb128(data: bytes, off: int) -> Tuple[int, int]:
-    """Decode ULEB128 value starting at off. Return (value, new_off)."""
-    result = 0
-    shift = 0
-    while True:
-        b = data[off]
-        off += 1
-        result |= (b & 0x7F) << shift
-        if (b & 0x80) == 0:
-            break
-        shift += 7
-        if shift > 35:
-            break
-    return result, off
-
-
-def _dex_extract_strings(dex: bytes, max_strings: int = 200000, max_len: int = 4000) -> List[str]:
+def _write_dex_strings_file(apk_path: Path, work_dir: Path, out_file: Path) -> Tuple[int, Optional[str]]:
     """
     Approach #2:
-    Extract strings from DEX without using unstable androguard internal modules.
+    Extract classes*.dex string pools (mmap'd from work_dir, multidex in parallel)
+    and write them to out_file (one per line).
+    Returns (count, error).
     """
-    if len(dex) < 0x70:
-        return []
-    magic = dex[:8]
-    if not (magic.startswith(b"dex\n") and magic.endswith(b"\x00")):
-        return []
+    try:
+        all_strings = extract_apk_dex_strings(apk_path, extracted_dir=work_dir)
+        ensure_dir(out_file.parent)
+        out_file.write_text("\n".join(all_strings), encoding="utf-8", errors="ignore")
+        return len(all_strings), None
+    except Exception as e:
+        return 0, str(e)
 
-    # header: string_ids_size @ 0x38, string_ids_off @ 0x3C
-    string_ids_size = struct.unpack_from("<I", dex, 0x38)[0]
-    string_ids_off = struct.unpack_from("<I", dex, 0x3C)[0]
 
-    if string_ids_off <= 0 or string_ids_off + string_ids_size * 4 > len(dex):
-        return []
+def _extract_cached(entry: WorkDirEntry, apk_path: Path) -> Tuple[int, bool]:
+    """Returns (extracted_files, reused)."""
+    info = entry.reuse("extract")
+    if info is not None:
+        return int(info.get("files", 0)), True
+    n = _extract_apk(apk_path, entry.path)
+    entry.mark_done("extract", verify=["AndroidManifest.xml"], files=n)
+    return n, False
 
-    n = min(string_ids_size, max_strings)
-    strings: List[str] = []
 
-    for i in range(n):
-        (str_off,) = struct.unpack_from("<I", dex, string_ids_off + i * 4)
-        if str_off <= 0 or str_off >= len(dex):
-            continue
+def _dex_strings_cached(entry: WorkDirEntry, apk_path: Path) -> Tuple[int, Optional[str], bool]:
+    """Returns (count, error, reused)."""
+    info = entry.reuse("dex_strings")
+    if info is not None:
+        return int(info.get("count", 0)), None, True
+    count, err = _write_dex_strings_file(apk_path, entry.path, entry.path / "dex_strings.txt")
+    if err is None:
+        entry.mark_done("dex_strings", verify=["dex_strings.txt"], count=count)
+    return count, err, False
 
-        try:
-            _, p = _uleb128(dex, str_off)  # utf16 length, not needed
-            # read until null terminator
-            end = dex.find(b"\x00", p)
-            if end == -1:
-                continue
-            raw = dex[p:end]
-            if not raw:
-                continue
-            s = raw.decode("utf-8", errors="ignore")
-            s = s.strip()
-            if 0 < len(s) <= max_len:
-                strings.append(s)
-        except Exception:
-            continue
 
-    return strings
+def _apktool_cached(entry: WorkDirEntry, apk_path: Path, timeout: Optional[float]) -> Tuple[bool, Optional[str], bool]:
+    """Returns (ok, error, reused). A decode is reused only if it completed (stamp + apktool.yml)."""
+    if entry.reuse("apktool") is not None:
+        return True, None, True
+    ok, err = _apktool_decode(apk_path, entry.path / "apktool_out", timeout)
+    if ok:
+        entry.mark_done("apktool", verify=["apktool_out/apktool.yml"])
+    return ok, err, False
 
 
-def _write_dex_strings_file(apk_path: Path, out_file: Path) -> Tuple[int, Optional[str]]:
+def rules_hash(
+    engines: Sequence[str],
+    regex_patterns_path: Optional[Path] = None,
+    yara_rules_path: Optional[Path] = None,
+    entropy_rules_path: Optional[Path] = None,
+) -> str:
     """
-    Reads classes*.dex from APK and writes extracted strings to out_file (one per line).
-    Returns (count, error).
+    Identifies what a scan looked for: enabled engines + content of the rule files.
+    Two scans of the same APK with the same hash give the same findings.
     """
-    try:
-        all_strings: List[str] = []
-        with zipfile.ZipFile(apk_path, "r") as z:
-            dex_names = [n for n in z.namelist() if n.startswith("classes") and n.endswith(".dex")]
-            for name in dex_names:
-                dex = z.read(name)
-                all_strings.extend(_dex_extract_strings(dex))
+    h = hashlib.sha256(",".join(sorted(engines)).encode("utf-8"))
+    for path in (
+        regex_patterns_path or DEFAULT_REGEX_PATTERNS,
+        yara_rules_path or DEFAULT_YARA_RULES,
+        entropy_rules_path or DEFAULT_ENTROPY_RULES,
+    ):
+        h.update(b"\0")
+        try:
+            h.update(path.read_bytes())
+        except OSError:
+            pass
+    return h.hexdigest()
 
-        ensure_dir(out_file.parent)
-        out_file.write_text("\n".join(all_strings), encoding="utf-8", errors="ignore")
-        return len(all_strings), None
-    except Exception as e:
-        return 0, str(e)
+
+def _stage_timeout(name: str) -> float:
+    """SH_TIMEOUT_<STAGE> (seconds), defaulting to SH_STAGE_TIMEOUT."""
+    default = float(os.getenv("SH_STAGE_TIMEOUT", "900"))
+    try:
+        return float(os.getenv(f"SH_TIMEOUT_{name.upper()}", default))
+    except ValueError:
+        return default
 
 
 def scan_secrets(
@@ -139,78 +156,209 @@ def scan_secrets(
     enable_gitleaks: bool = True,
     enable_apktool: bool = True,
     enable_dex_strings: bool = True,
+    enable_entropy: bool = False,
+    enable_native: bool = True,
     regex_patterns_path: Optional[Path] = None,
     yara_rules_path: Optional[Path] = None,
+    entropy_rules_path: Optional[Path] = None,
     gitleaks_bin: Optional[str] = None,
+    on_finding: Optional[Callable[[Dict[str, Any]], None]] = None,
+    sha256: Optional[str] = None,
 ) -> Dict[str, Any]:
+    """
+    Stages run as a DAG (see pipeline.run_stages):
+
+      package ─────────────────────────────────────┐
+      extract ──> dex_strings ──┐                  │
+             └──> native (lib/**/*.so)             │
+      apktool ──────────────────┴──> regex / yara / gitleaks / entropy
+
+    Subprocess engines (apktool, gitleaks) and YARA run in threads, the pure-Python
+    regex engine and the Androguard parse in processes. Timing and status of every
+    stage are reported in meta.context.stages. A timed-out process stage is killed;
+    a timed-out thread stage keeps WORK_DIR/<sha256> pinned until it ends.
+
+    WORK_DIR/<sha256> is a cache: completed extraction / dex strings / apktool decode
+    of a previous scan of the same APK are reused (see workdir_cache).
+
+    on_finding (streaming mode) is called with each finding as soon as its engine
+    finishes; with SH_DEDUPE, once per merged record, when it is created. The record
+    sent is a snapshot of that first sighting: later merges (occurrences, engines,
+    locations, severity) only show in the final payload.
+    sha256 (already computed at upload) skips hashing the APK again.
+    """
     timer = Timer()
 
-    sha256 = sha256_file(apk_path)
-    package = _get_package(apk_path)
+    sha256 = sha256 or sha256_file(apk_path)
+
+    with WORKDIRS.use(sha256) as entry:
+        return _scan_in_workdir(
+            entry, timer, apk_path, sha256, parent_scan_id,
+            enable_regex=enable_regex,
+            enable_yara=enable_yara,
+            enable_gitleaks=enable_gitleaks,
+            enable_apktool=enable_apktool,
+            enable_dex_strings=enable_dex_strings,
+            enable_entropy=enable_entropy,
+            enable_native=enable_native,
+            regex_patterns_path=regex_patterns_path,
+            yara_rules_path=yara_rules_path,
+            entropy_rules_path=entropy_rules_path,
+            gitleaks_bin=gitleaks_bin,
+            on_finding=on_finding,
+        )
 
-    work_dir = WORK_DIR / sha256
-    ensure_dir(work_dir)
 
-    extracted_files = _extract_apk(apk_path, work_dir)
+def _scan_in_workdir(
+    entry: WorkDirEntry,
+    timer: Timer,
+    apk_path: Path,
+    sha256: str,
+    parent_scan_id: Optional[int],
+    enable_regex: bool,
+    enable_yara: bool,
+    enable_gitleaks: bool,
+    enable_apktool: bool,
+    enable_dex_strings: bool,
+    enable_entropy: bool,
+    enable_native: bool,
+    regex_patterns_path: Optional[Path],
+    yara_rules_path: Optional[Path],
+    entropy_rules_path: Optional[Path],
+    gitleaks_bin: Optional[str],
+    on_finding: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    work_dir = entry.path
+    apktool_out = work_dir / "apktool_out"
+
+    if regex_patterns_path is None:
+        regex_patterns_path = DEFAULT_REGEX_PATTERNS
+    if yara_rules_path is None:
+        yara_rules_path = DEFAULT_YARA_RULES
+    if entropy_rules_path is None:
+        entropy_rules_path = DEFAULT_ENTROPY_RULES
+
+    def scan_root(results: Dict[str, Any]) -> Path:
+        # scan decoded folder if available; otherwise work_dir
+        ok = (results.get("apktool") or (False,))[0]
+        return apktool_out if ok else work_dir
+
+    stages: List[Stage] = [
+        Stage("package", _get_package, kind="process", timeout=_stage_timeout("package"),
+              args=lambda r: (apk_path,)),
+        Stage("extract", _extract_cached, timeout=_stage_timeout("extract"),
+              args=lambda r: (entry, apk_path)),
+    ]
+    engine_deps: List[str] = ["extract"]
 
     # Optionally generate dex_strings.txt in work_dir
-    dex_strings_count = 0
-    dex_strings_error: Optional[str] = None
     if enable_dex_strings:
-        dex_strings_count, dex_strings_error = _write_dex_strings_file(
-            apk_path, work_dir / "dex_strings.txt"
+        stages.append(
+            Stage("dex_strings", _dex_strings_cached, deps=("extract",), timeout=_stage_timeout("dex_strings"),
+                  args=lambda r: (entry, apk_path))
         )
+        engine_deps.append("dex_strings")
 
     # Optionally apktool decode
-    scan_root = work_dir  # fallback
-    apktool_ok = False
-    apktool_error: Optional[str] = None
     if enable_apktool:
-        apktool_out = work_dir / "apktool_out"
-        apktool_ok, apktool_error = _apktool_decode(apk_path, apktool_out)
-        if apktool_ok:
-            scan_root = apktool_out
+        apktool_timeout = _stage_timeout("apktool")
+        stages.append(
+            Stage("apktool", _apktool_cached, timeout=apktool_timeout,
+                  args=lambda r: (entry, apk_path, apktool_timeout))
+        )
+        engine_deps.append("apktool")
+
+    engines: List[str] = []
+    if enable_regex:
+        stages.append(
+            Stage("regex", run_regex_engine, deps=tuple(engine_deps), kind="process", timeout=_stage_timeout("regex"),
+                  args=lambda r: (scan_root(r), regex_patterns_path))
+        )
+        engines.append("regex")
+    if enable_yara:
+        stages.append(
+            Stage("yara", run_yara_engine, deps=tuple(engine_deps), timeout=_stage_timeout("yara"),
+                  args=lambda r: (scan_root(r), yara_rules_path))
+        )
+        engines.append("yara")
+    if enable_gitleaks:
+        stages.append(
+            Stage("gitleaks", run_gitleaks_engine, deps=tuple(engine_deps), timeout=_stage_timeout("gitleaks"),
+                  args=lambda r: (scan_root(r), gitleaks_bin, regex_patterns_path))
+        )
+        engines.append("gitleaks")
+    if enable_entropy:
+        stages.append(
+            Stage("entropy", run_entropy_engine, deps=tuple(engine_deps), kind="process", timeout=_stage_timeout("entropy"),
+                  args=lambda r: (work_dir, scan_root(r), entropy_rules_path))
+        )
+        engines.append("entropy")
+    if enable_native:
+        # native libs come straight from the extracted APK: no need to wait for apktool
+        stages.append(
+            Stage("native", run_native_engine, deps=("extract",), kind="process", timeout=_stage_timeout("native"),
+                  args=lambda r: (work_dir, regex_patterns_path))
+        )
+        engines.append("native")
+
+    # one record per secret / rule family / location across engines and trees
+    merger = FindingMerger() if SH_DEDUPE else None
+
+    def _emit(name: str, stage_report: Dict[str, Any], value: Any) -> None:
+        # streaming: merge in completion order so records can be sent as soon as they exist
+        if name not in engines or stage_report["status"] != STATUS_OK:
+            return
+        for f in value.get("findings", []):
+            rec = merger.add(f) if merger is not None else f
+            if rec is not None:
+                # the merger keeps updating rec while the response thread serializes it
+                on_finding(copy.deepcopy(rec) if merger is not None else rec)
+
+    abandoned: List[Future] = []
+    results, report = run_stages(stages, on_stage_done=_emit if on_finding is not None else None, abandoned=abandoned)
+    # timed-out thread stages may still write into work_dir: keep it pinned until they end
+    entry.linger(abandoned)
+
+    package = results.get("package")
+    extracted_files, extract_reused = results.get("extract") or (0, False)
+    dex_strings_count, dex_strings_error, dex_strings_reused = results.get("dex_strings") or (0, None, False)
+    apktool_ok, apktool_error, apktool_reused = results.get("apktool") or (False, None, False)
+    for name in ("extract", "dex_strings", "apktool"):
+        if name in report and report[name]["status"] != STATUS_OK:
+            if name == "dex_strings":
+                dex_strings_error = report[name]["error"]
+            elif name == "apktool":
+                apktool_error = report[name]["error"]
 
     findings_list: List[Dict[str, Any]] = []
     engines_ok: List[str] = []
     engine_errors: List[str] = []
+    warnings: List[str] = []
 
-    # REGEX
-    if enable_regex:
-        try:
-            if regex_patterns_path is None:
-                regex_patterns_path = Path("config") / "regex_patterns.json"
-            out = run_regex_engine(scan_root, regex_patterns_path)
-            engines_ok.append("regex")
-            findings_list.extend(out.get("findings", []))
-        except Exception as e:
-            engine_errors.append(f"regex engine failed: {e}")
-
-    # YARA
-    if enable_yara:
-        try:
-            if yara_rules_path is None:
-                yara_rules_path = Path("rules") / "secrets.yar"
-            out = run_yara_engine(scan_root, yara_rules_path)
-            if out.get("error"):
-                engine_errors.append(out["error"])
-            else:
-                engines_ok.append("yara")
-            findings_list.extend(out.get("findings", []))
-        except Exception as e:
-            engine_errors.append(f"yara engine failed: {e}")
-
-    # GITLEAKS (scan decoded folder if available; otherwise work_dir)
-    if enable_gitleaks:
-        try:
-            out = run_gitleaks_engine(scan_root, gitleaks_bin=gitleaks_bin)
-            if out.get("error"):
-                engine_errors.append(out["error"])
-            else:
-                engines_ok.append("gitleaks")
-            findings_list.extend(out.get("findings", []))
-        except Exception as e:
-            engine_errors.append(f"gitleaks engine failed: {e}")
+    for name in engines:
+        st = report[name]
+        if st["status"] != STATUS_OK:
+            verb = "timed out" if st["status"] == STATUS_TIMEOUT else "failed"
+            engine_errors.append(f"{name} engine {verb}: {st['error']}")
+            continue
+        out = results[name]
+        if out.get("error"):
+            engine_errors.append(out["error"])
+        else:
+            engines_ok.append(name)
+        findings_list.extend(out.get("findings", []))
+        warnings.extend(out.get("warnings", []))
+
+    # per-pattern time / matches of the regex engine (aggregated in sh_pattern_stats)
+    pattern_stats = (results.get("regex") or {}).get("stats", {}).get("patterns")
+
+    dedupe_stats: Optional[Dict[str, int]] = None
+    if merger is not None:
+        if on_finding is None:
+            for f in findings_list:
+                merger.add(f)
+        findings_list = merger.findings()
+        dedupe_stats = merger.stats()
 
     # status
     if engines_ok:
@@ -231,11 +379,12 @@ def scan_secrets(
             "error": error,
             "duration_ms": timer.ms(),
             "engine": engines_ok,
+            "warnings": warnings,
             "context": {
                 "file_name": apk_path.name,
                 "sha256": sha256,
                 "extracted_files": extracted_files,
-                "scan_root": str(scan_root),
+                "scan_root": str(scan_root(results)),
                 "apktool_enabled": enable_apktool,
                 "apktool_ok": apktool_ok,
                 "apktool_error": apktool_error,
@@ -243,6 +392,15 @@ def scan_secrets(
                 "dex_strings_count": dex_strings_count,
                 "dex_strings_error": dex_strings_error,
                 "secrets_count": len(findings_list),
+                "rules_hash": rules_hash(engines, regex_patterns_path, yara_rules_path, entropy_rules_path),
+                "dedupe": dedupe_stats,
+                "pattern_stats": pattern_stats,
+                "stages": report,
+                "workdir_reused": {
+                    "extract": extract_reused,
+                    "dex_strings": dex_strings_reused,
+                    "apktool": apktool_reused,
+                },
             },
         },
     }
@@ -0,0 +1,47 @@
+# app/singleflight.py
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class SingleFlight:
+    """
+    Per-key registry of running calls: a call for a key that is already running
+    waits for it and gets its result instead of running again (CI retries, two
+    pipelines uploading the same APK). Per process: the service runs one worker.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._running: Dict[str, Future] = {}
+        self.shared = 0
+
+    def run(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True if another caller ran fn."""
+        with self._lock:
+            fut = self._running.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._running[key] = fut
+            else:
+                self.shared += 1
+
+        if not leader:
+            return fut.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+
+    def running(self) -> List[str]:
+        with self._lock:
+            return sorted(self._running)
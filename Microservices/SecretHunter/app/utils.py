@@ -3,9 +3,12 @@ import hashlib
 import os
 import re
 import time
+from array import array
+from bisect import bisect_right
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Iterator, Optional
+from typing import AnyStr, BinaryIO, Generic, Iterator, NamedTuple, Optional, Tuple, Union
 
 TEXT_EXT_ALLOWLIST = {
     ".txt", ".xml", ".json", ".yml", ".yaml", ".properties", ".gradle", ".kt", ".java",
@@ -29,17 +32,140 @@ def sha256_file(path: Path) -> str:
             h.update(chunk)
     return h.hexdigest()
 
-def safe_read_text(path: Path, max_bytes: int = 512_000) -> str:
+SCAN_CHUNK_SIZE = int(os.getenv("SH_SCAN_CHUNK_BYTES", str(1024 * 1024)))
+# upper bound for the window overlap (patterns with unbounded repeats)
+SCAN_MAX_OVERLAP = int(os.getenv("SH_SCAN_OVERLAP", "4096"))
+
+class ScanWindow(NamedTuple):
+    offset: int      # absolute offset of data[0] in the file
+    line: int        # 1-based line number of data[0]
+    column: int      # 1-based column of data[0]
+    seen: int        # data[:seen] is the overlap already scanned in the previous window
+    data: Union[str, bytes]
+    is_last: bool
+
+def _iter_windows(chunks: Iterator[AnyStr], overlap: int, newline: AnyStr) -> Iterator[ScanWindow]:
     """
-    Read as text with fallback; avoids loading huge files.
+    Turn a stream of chunks into windows, each prefixed with the last `overlap`
+    items of the previous one, so a match of length <= overlap that straddles a
+    chunk boundary is always fully inside one window. Memory stays at
+    chunk_size + overlap whatever the file size.
+    """
+    overlap = max(0, overlap)
+    offset = 0
+    line = 1
+    column = 1
+    empty = newline[:0]
+    tail = empty
+    chunk = next(chunks, empty)
+    while chunk:
+        nxt = next(chunks, empty)
+        data = tail + chunk
+        yield ScanWindow(offset, line, column, len(tail), data, not nxt)
+
+        tail = data[-overlap:] if overlap else empty
+        consumed = len(data) - len(tail)
+        newlines = data.count(newline, 0, consumed)
+        if newlines:
+            line += newlines
+            column = consumed - data.rfind(newline, 0, consumed)
+        else:
+            column += consumed
+        offset += consumed
+        chunk = nxt
+
+def iter_byte_windows(
+    path: Path,
+    chunk_size: int = SCAN_CHUNK_SIZE,
+    overlap: int = SCAN_MAX_OVERLAP,
+) -> Iterator[ScanWindow]:
+    """Stream a file as raw byte windows (offsets/columns in bytes), no decoding."""
+    with path.open("rb") as f:
+        yield from _iter_windows(iter(partial(f.read, chunk_size), b""), overlap, b"\n")
+
+def detect_utf16(path: Path, sample_size: int = 4096) -> Optional[int]:
+    """
+    Byte phase of the low (ASCII) byte of each UTF-16 code unit: 0 for LE, 1 for BE,
+    None if the file does not look like UTF-16 (BOM, or NULs on one parity only).
     """
-    data = path.read_bytes()
-    if len(data) > max_bytes:
-        data = data[:max_bytes]
     try:
-        return data.decode("utf-8", errors="ignore")
-    except Exception:
-        return data.decode(errors="ignore")
+        with path.open("rb") as f:
+            head = f.read(sample_size)
+    except OSError:
+        return None
+    if head.startswith(b"\xff\xfe"):
+        return 0
+    if head.startswith(b"\xfe\xff"):
+        return 1
+    if len(head) < 16:
+        return None
+    even, odd = head[0::2], head[1::2]
+    even_nul = even.count(0) / len(even)
+    odd_nul = odd.count(0) / len(odd)
+    if odd_nul > 0.4 and even_nul < 0.05:
+        return 0
+    if even_nul > 0.4 and odd_nul < 0.05:
+        return 1
+    return None
+
+def iter_wide_windows(
+    path: Path,
+    phase: int,
+    chunk_size: int = SCAN_CHUNK_SIZE,
+    overlap: int = SCAN_MAX_OVERLAP,
+) -> Iterator[ScanWindow]:
+    """
+    Stream a UTF-16 file as its low bytes only (the `wide` view YARA matches for
+    ASCII strings). Offsets/columns are in code units: byte offset = 2 * offset.
+    The high bytes are dropped, so matches must be checked with wide_span_is_ascii.
+    """
+    chunk_size += chunk_size % 2  # keep every chunk aligned on code units
+    with path.open("rb") as f:
+        raw = iter(partial(f.read, chunk_size), b"")
+        yield from _iter_windows((c[phase::2] for c in raw), overlap, b"\n")
+
+def wide_span_is_ascii(f: BinaryIO, phase: int, start: int, end: int) -> bool:
+    """True if code units [start, end) of a UTF-16 file all have a zero high byte."""
+    f.seek(2 * start)
+    raw = f.read(2 * (end - start))
+    high = raw[1 - phase::2]
+    return len(high) == end - start and not high.strip(b"\x00")
+
+class LineIndex(Generic[AnyStr]):
+    """
+    Newline offsets of a scanned buffer (str or bytes), built once on the first
+    lookup (most buffers have no hit and never pay for it). Offsets are then
+    resolved to (line, column) with a binary search instead of counting newlines
+    per match. `line`/`column` locate data[0] when the buffer is a window of a
+    larger file. Columns are in the buffer's unit (chars or bytes).
+    """
+
+    def __init__(self, data: AnyStr, line: int = 1, column: int = 1) -> None:
+        self.data = data
+        self.line = line
+        self.column = column
+        self._newlines: Optional[array] = None
+
+    def newlines(self) -> array:
+        if self._newlines is None:
+            nl = array("q")
+            append = nl.append
+            find = self.data.find
+            newline = "\n" if isinstance(self.data, str) else b"\n"
+            i = find(newline)
+            while i != -1:
+                append(i)
+                i = find(newline, i + 1)
+            self._newlines = nl
+        return self._newlines
+
+    def locate(self, offset: int) -> Tuple[int, int]:
+        """1-based (line, column) of data[offset]."""
+        nl = self.newlines()
+        k = bisect_right(nl, offset - 1)  # newlines before offset
+        if k == 0:
+            return self.line, self.column + offset
+        return self.line + k, offset - nl[k - 1]
 
 def is_probably_text_file(path: Path) -> bool:
     ext = path.suffix.lower()
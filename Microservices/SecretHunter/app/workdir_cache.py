@@ -0,0 +1,238 @@
+# app/workdir_cache.py
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from .utils import ensure_dir, utc_now_iso
+
+# stamps live next to the dirs (WORK_DIR/<sha256>.workdir.json) so the engines never scan them
+STAMP_SUFFIX = ".workdir.json"
+
+WORKDIR_CLEANUP = os.getenv("WORKDIR_CLEANUP", "false").strip().lower() in {"1", "true", "yes", "on"}
+WORKDIR_MAX_MB = int(os.getenv("WORKDIR_MAX_MB", "4096"))
+
+
+def _tree_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class WorkDirEntry:
+    """
+    WORK_DIR/<sha256> seen as a cache entry. Completed steps (extract, apktool, ...)
+    are recorded in a stamp file together with the paths that prove they are complete;
+    a step is reused only if the stamp matches the APK hash and those paths exist.
+    """
+
+    def __init__(self, cache: "WorkDirCache", sha256: str) -> None:
+        self.cache = cache
+        self.sha256 = sha256
+        self.path = cache.root / sha256
+        self._lock = threading.Lock()
+        self._changed = False
+        ensure_dir(self.path)
+        self.stamp = self._load_stamp()
+
+    @property
+    def stamp_path(self) -> Path:
+        return self.cache.root / f"{self.sha256}{STAMP_SUFFIX}"
+
+    def _load_stamp(self) -> Dict[str, Any]:
+        try:
+            data = json.loads(self.stamp_path.read_text(encoding="utf-8"))
+            if data.get("sha256") == self.sha256:
+                return data
+        except Exception:
+            pass
+        return {"sha256": self.sha256, "created_at": utc_now_iso(), "steps": {}, "size_bytes": None}
+
+    def _write_stamp(self) -> None:
+        tmp = self.stamp_path.with_name(f"{self.stamp_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(self.stamp), encoding="utf-8")
+        tmp.replace(self.stamp_path)
+
+    def reuse(self, step: str) -> Optional[Dict[str, Any]]:
+        """Info recorded for a completed step, or None if it must be (re)done."""
+        with self._lock:
+            info = self.stamp["steps"].get(step)
+            ok = info is not None and all((self.path / p).exists() for p in info.get("verify", []))
+        self.cache._count(step, hit=ok)
+        return info if ok else None
+
+    def invalidate(self, step: str) -> None:
+        with self._lock:
+            if self.stamp["steps"].pop(step, None) is not None:
+                self._write_stamp()
+
+    def mark_done(self, step: str, verify: Sequence[str] = (), **info: Any) -> None:
+        with self._lock:
+            self.stamp["steps"][step] = {"verify": list(verify), "done_at": utc_now_iso(), **info}
+            self.stamp["size_bytes"] = None
+            self._changed = True
+            self._write_stamp()
+
+    def linger(self, futures: Iterable[Future]) -> None:
+        """Stage threads abandoned on timeout that may still write here (see WorkDirCache.linger)."""
+        self.cache.linger(self.sha256, futures)
+
+    def finalize(self) -> None:
+        """Refresh the recorded size if something was written, and mark the entry as used."""
+        with self._lock:
+            if self._changed or self.stamp.get("size_bytes") is None:
+                self.stamp["size_bytes"] = _tree_size(self.path)
+                self._write_stamp()
+                self._changed = False
+        try:
+            os.utime(self.stamp_path)  # LRU clock
+        except OSError:
+            pass
+
+
+class WorkDirCache:
+    def __init__(self, root: Path, max_bytes: Optional[int] = None, cleanup: Optional[bool] = None) -> None:
+        self.root = root
+        self.max_bytes = max_bytes if max_bytes is not None else WORKDIR_MAX_MB * 1024 * 1024
+        self.cleanup = WORKDIR_CLEANUP if cleanup is None else cleanup
+        self._lock = threading.Lock()
+        self._active: Dict[str, int] = {}
+        self._lingering: Dict[str, List[Future]] = {}  # abandoned stage threads still writing, per dir
+        self._sizes: Dict[str, int] = {}  # size of dirs without a stamp (legacy), computed once
+        self._stats: Dict[str, Any] = {"evictions": 0, "evicted_bytes": 0, "reuse": {}}
+
+    def _count(self, step: str, hit: bool) -> None:
+        with self._lock:
+            c = self._stats["reuse"].setdefault(step, {"hits": 0, "misses": 0})
+            c["hits" if hit else "misses"] += 1
+
+    def linger(self, sha256: str, futures: Iterable[Future]) -> None:
+        """
+        Keeps the dir pinned until these futures are done, and makes the next use()
+        of it wait for them: a timed-out thread stage cannot be stopped and would
+        otherwise write into a tree another scan (or eviction) is reading.
+        """
+        futures = [f for f in futures if not f.done()]
+        if not futures:
+            return
+        with self._lock:
+            self._active[sha256] = self._active.get(sha256, 0) + len(futures)
+            self._lingering.setdefault(sha256, []).extend(futures)
+        for fut in futures:  # outside the lock: runs the callback now if already done
+            fut.add_done_callback(lambda f, sha256=sha256: self._unlinger(sha256, f))
+
+    def _unlinger(self, sha256: str, fut: Future) -> None:
+        with self._lock:
+            self._lingering[sha256].remove(fut)
+            if not self._lingering[sha256]:
+                del self._lingering[sha256]
+            self._active[sha256] -= 1
+            if not self._active[sha256]:
+                del self._active[sha256]
+
+    @contextmanager
+    def use(self, sha256: str) -> Iterator[WorkDirEntry]:
+        """
+        Pins the entry (never evicted while in use), then enforces the disk budget.
+        Waits first for the abandoned stages of a previous scan still writing to it.
+        """
+        with self._lock:
+            lingering = list(self._lingering.get(sha256, ()))
+        if lingering:
+            wait(lingering)
+        with self._lock:
+            self._active[sha256] = self._active.get(sha256, 0) + 1
+        entry = WorkDirEntry(self, sha256)
+        try:
+            yield entry
+        finally:
+            try:
+                entry.finalize()
+            finally:
+                with self._lock:
+                    self._active[sha256] -= 1
+                    if not self._active[sha256]:
+                        del self._active[sha256]
+            if self.cleanup:
+                self.enforce_budget()
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        if not self.root.exists():
+            return out
+        for d in self.root.iterdir():
+            if not d.is_dir():
+                continue
+            stamp = self.root / f"{d.name}{STAMP_SUFFIX}"
+            size = None
+            last_used = None
+            try:
+                data = json.loads(stamp.read_text(encoding="utf-8"))
+                size = data.get("size_bytes")
+                last_used = stamp.stat().st_mtime
+            except Exception:
+                pass
+            if size is None:
+                if d.name not in self._sizes:
+                    self._sizes[d.name] = _tree_size(d)
+                size = self._sizes[d.name]
+            if last_used is None:
+                try:
+                    last_used = d.stat().st_mtime
+                except OSError:
+                    last_used = 0.0
+            out.append({"sha256": d.name, "size_bytes": int(size), "last_used": last_used, "stamped": stamp.exists()})
+        return out
+
+    def enforce_budget(self) -> List[str]:
+        """Evicts least-recently-used dirs until the volume fits in max_bytes."""
+        evicted: List[str] = []
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e["last_used"])
+            total = sum(e["size_bytes"] for e in entries)
+            busy: Set[str] = set(self._active)
+            for e in entries:
+                if total <= self.max_bytes:
+                    break
+                if e["sha256"] in busy:
+                    continue
+                shutil.rmtree(self.root / e["sha256"], ignore_errors=True)
+                (self.root / f"{e['sha256']}{STAMP_SUFFIX}").unlink(missing_ok=True)
+                self._sizes.pop(e["sha256"], None)
+                total -= e["size_bytes"]
+                self._stats["evictions"] += 1
+                self._stats["evicted_bytes"] += e["size_bytes"]
+                evicted.append(e["sha256"])
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._entries()
+            reuse = {k: dict(v) for k, v in self._stats["reuse"].items()}
+            for v in reuse.values():
+                n = v["hits"] + v["misses"]
+                v["hit_rate"] = round(v["hits"] / n, 3) if n else None
+            return {
+                "root": str(self.root),
+                "cleanup_enabled": self.cleanup,
+                "max_bytes": self.max_bytes,
+                "total_bytes": sum(e["size_bytes"] for e in entries),
+                "entries": len(entries),
+                "active": sorted(self._active),
+                "lingering": {k: len(v) for k, v in self._lingering.items()},
+                "evictions": self._stats["evictions"],
+                "evicted_bytes": self._stats["evicted_bytes"],
+                "reuse": reuse,
+                "oldest_used_at": min((e["last_used"] for e in entries), default=None),
+                "checked_at": time.time(),
+            }
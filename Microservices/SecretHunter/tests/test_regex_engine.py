@@ -0,0 +1,67 @@
+import random
+import re
+
+from app.engines.regex_engine import _scan_windows, max_match_len
+from app.utils import iter_byte_windows
+
+PATTERNS = [
+    ({"id": "glpat"}, re.compile(rb"glpat-[0-9A-Za-z_\-]{20}")),
+    ({"id": "aws"}, re.compile(rb"AKIA[0-9A-Z]{16}")),
+    ({"id": "hex"}, re.compile(rb"[0-9a-f]{8,40}")),
+    ({"id": "kv"}, re.compile(rb"(?i)secret ?= ?\S{4,30}")),
+]
+
+
+def _random_buffer(rnd: random.Random) -> bytes:
+    parts = []
+    for _ in range(rnd.randint(5, 60)):
+        parts.append(rnd.choice([
+            b"glpat-" + bytes(rnd.choice(b"abcXYZ019_-") for _ in range(rnd.randint(15, 30))),
+            b"AKIA" + bytes(rnd.choice(b"ABCDEFGHIJ0123") for _ in range(rnd.randint(14, 20))),
+            bytes(rnd.choice(b"0123456789abcdefg") for _ in range(rnd.randint(1, 150))),
+            b"SECRET = " + bytes(rnd.choice(b"xyz$%") for _ in range(rnd.randint(1, 40))),
+            b"\n" * rnd.randint(1, 3),
+            b" ",
+        ]))
+    return b"".join(parts)
+
+
+def _whole(data: bytes):
+    return sorted((i, m.start(), m.end()) for i, (_, rx) in enumerate(PATTERNS) for m in rx.finditer(data))
+
+
+def test_windowed_scan_matches_whole_buffer(tmp_path):
+    rnd = random.Random(1234)
+    path = tmp_path / "blob.txt"
+    for _ in range(60):
+        data = _random_buffer(rnd)
+        path.write_bytes(data)
+        expected = _whole(data)
+        overlap = max_match_len(PATTERNS) + rnd.randint(0, 60)
+        for chunk_size in [1, len(data) or 1, *range(5, 300, 11)]:
+            windows = iter_byte_windows(path, chunk_size=chunk_size, overlap=overlap)
+            hits = sorted((i, start, end) for i, start, end, *_ in _scan_windows(windows, PATTERNS, overlap))
+            assert hits == expected, (chunk_size, overlap, data)
+
+
+def test_match_consumed_across_a_boundary(tmp_path):
+    # whole buffer: [10, 50) then [50, 90); the second one touches the end of the first window,
+    # and the next window must not restart inside the first match
+    data = b"x" * 10 + b"a" * 80
+    path = tmp_path / "hex.txt"
+    path.write_bytes(data)
+    windows = iter_byte_windows(path, chunk_size=80, overlap=45)
+    hits = [(i, start, end) for i, start, end, *_ in _scan_windows(windows, PATTERNS, 45)]
+    assert hits == [(2, 10, 50), (2, 50, 90)]
+
+
+def test_adjacent_tokens_across_a_boundary(tmp_path):
+    data = b"x" * 200 + b"glpat-" + b"a" * 20 + b"glpat-" + b"b" * 20 + b"\n"
+    path = tmp_path / "tokens.txt"
+    path.write_bytes(data)
+    overlap = max_match_len(PATTERNS)
+    expected = _whole(data)
+    for chunk_size in range(1, len(data) + 2):
+        windows = iter_byte_windows(path, chunk_size=chunk_size, overlap=overlap)
+        hits = sorted((i, start, end) for i, start, end, *_ in _scan_windows(windows, PATTERNS, overlap))
+        assert hits == expected, chunk_size
@@ -0,0 +1,115 @@
+# tools/bench_dex_strings.py
+"""
+Benchmark the DEX string extractor against the previous struct.unpack_from loop.
+
+Usage (from the SecretHunter directory):
+    python -m tools.bench_dex_strings path/to/app.apk [--repeat 5]
+"""
+import argparse
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.dex_strings import extract_dex_strings, find_dex_files  # noqa: E402
+
+
+def _legacy_uleb128(data: bytes, off: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        b = data[off]
+        off += 1
+        result |= (b & 0x7F) << shift
+        if (b & 0x80) == 0:
+            break
+        shift += 7
+        if shift > 35:
+            break
+    return result, off
+
+
+def legacy_dex_extract_strings(dex: bytes, max_strings: int = 200000, max_len: int = 4000) -> List[str]:
+    """Previous implementation (per-string struct.unpack_from + bytes slicing)."""
+    if len(dex) < 0x70:
+        return []
+    magic = dex[:8]
+    if not (magic.startswith(b"dex\n") and magic.endswith(b"\x00")):
+        return []
+    string_ids_size = struct.unpack_from("<I", dex, 0x38)[0]
+    string_ids_off = struct.unpack_from("<I", dex, 0x3C)[0]
+    if string_ids_off <= 0 or string_ids_off + string_ids_size * 4 > len(dex):
+        return []
+    n = min(string_ids_size, max_strings)
+    strings: List[str] = []
+    for i in range(n):
+        (str_off,) = struct.unpack_from("<I", dex, string_ids_off + i * 4)
+        if str_off <= 0 or str_off >= len(dex):
+            continue
+        try:
+            _, p = _legacy_uleb128(dex, str_off)
+            end = dex.find(b"\x00", p)
+            if end == -1:
+                continue
+            raw = dex[p:end]
+            if not raw:
+                continue
+            s = raw.decode("utf-8", errors="ignore").strip()
+            if 0 < len(s) <= max_len:
+                strings.append(s)
+        except Exception:
+            continue
+    return strings
+
+
+def _best_of(fn, repeat: int) -> Tuple[float, int]:
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = len(fn())
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, count
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("apk", type=Path)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        with zipfile.ZipFile(args.apk) as z:
+            for name in z.namelist():
+                if name.startswith("classes") and name.endswith(".dex"):
+                    z.extract(name, tmp_dir)
+        dex_paths = find_dex_files(tmp_dir)
+        if not dex_paths:
+            print("no classes*.dex in", args.apk)
+            return 1
+
+        def legacy() -> List[str]:
+            out: List[str] = []
+            for p in dex_paths:
+                out.extend(legacy_dex_extract_strings(p.read_bytes()))
+            return out
+
+        legacy_ms, legacy_n = _best_of(legacy, args.repeat)
+        new_ms, new_n = _best_of(lambda: extract_dex_strings(dex_paths, workers=args.workers), args.repeat)
+
+    print(f"dex files : {len(dex_paths)}")
+    print(f"legacy    : {legacy_ms:8.1f} ms  ({legacy_n} strings)")
+    print(f"mmap      : {new_ms:8.1f} ms  ({new_n} strings)")
+    print(f"speedup   : {legacy_ms / new_ms if new_ms else float('inf'):8.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
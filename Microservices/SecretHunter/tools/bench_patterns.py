@@ -0,0 +1,115 @@
+# tools/bench_patterns.py
+"""
+Time every pattern of regex_patterns.json against a fixed corpus, to catch slow
+(backtracking-prone) patterns before they ship.
+
+The default corpus is synthetic and seeded: ordinary smali/XML-like text plus
+adversarial lines (long runs of token chars, unterminated quotes, repeated
+keywords) that make greedy heuristics backtrack. Real files can be added.
+
+Usage (from the SecretHunter directory):
+    python -m tools.bench_patterns [--corpus path ...] [--size-mb 4] [--repeat 3]
+                                   [--max-ms-per-mb 50]
+Exits with 1 if a pattern is slower than --max-ms-per-mb.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.engines.regex_engine import compile_patterns, load_regex_patterns, pattern_key  # noqa: E402
+from app.utils import iter_files  # noqa: E402
+
+TOKEN = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-"
+
+
+def synthetic_corpus(size_mb: float, seed: int = 1337) -> bytes:
+    rnd = random.Random(seed)
+
+    def tok(n: int) -> str:
+        return "".join(rnd.choice(TOKEN) for _ in range(n))
+
+    normal = [
+        lambda: f'    const-string v{rnd.randint(0, 9)}, "{tok(rnd.randint(4, 30))}"',
+        lambda: f"    invoke-virtual {{v0, v1}}, Lcom/example/{tok(8)};->{tok(6)}(Ljava/lang/String;)V",
+        lambda: f'<string name="{tok(10)}">{tok(rnd.randint(5, 60))}</string>',
+        lambda: f"https://{tok(8)}.example.com/{tok(12)}?q={tok(6)}",
+    ]
+    adversarial = [
+        lambda: "aws " * rnd.randint(50, 400) + "key" + " " * 30,
+        lambda: "password = '" + tok(rnd.randint(500, 4000)),
+        lambda: "token: \"" + tok(rnd.randint(1000, 8000)),
+        lambda: "client_secret=" + "x" * rnd.randint(500, 3000),
+        lambda: "auth0 " + "client " * rnd.randint(50, 300) + "secret",
+        lambda: "http://" + tok(rnd.randint(200, 2000)) + ":" + tok(50),
+        lambda: tok(rnd.randint(2000, 20000)),
+    ]
+
+    target = int(size_mb * 1024 * 1024)
+    out: List[str] = []
+    size = 0
+    while size < target:
+        gen = rnd.choice(adversarial) if rnd.random() < 0.05 else rnd.choice(normal)
+        line = gen()
+        out.append(line)
+        size += len(line) + 1
+    return "\n".join(out).encode("utf-8")
+
+
+def load_corpus(paths: List[Path], size_mb: float) -> List[Tuple[str, bytes]]:
+    corpus = [("synthetic", synthetic_corpus(size_mb))] if size_mb > 0 else []
+    for p in paths:
+        files = [p] if p.is_file() else list(iter_files(p))
+        for f in files:
+            corpus.append((str(f), f.read_bytes()))
+    return corpus
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--patterns", type=Path, default=Path("config") / "regex_patterns.json")
+    ap.add_argument("--corpus", type=Path, nargs="*", default=[])
+    ap.add_argument("--size-mb", type=float, default=4.0, help="size of the synthetic corpus (0 to disable)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--max-ms-per-mb", type=float, default=50.0)
+    args = ap.parse_args()
+
+    compiled = compile_patterns(load_regex_patterns(args.patterns))
+    corpus = load_corpus(args.corpus, args.size_mb)
+    total_mb = sum(len(b) for _, b in corpus) / (1024 * 1024)
+    if not total_mb:
+        print("empty corpus")
+        return 1
+
+    rows = []
+    for p, rx in compiled:
+        best = float("inf")
+        matches = 0
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            matches = sum(len(rx.findall(data)) for _, data in corpus)
+            best = min(best, time.perf_counter() - t0)
+        rows.append((pattern_key(p), best * 1000, matches))
+
+    rows.sort(key=lambda r: -r[1])
+    slow = [r for r in rows if r[1] / total_mb > args.max_ms_per_mb]
+
+    print(f"corpus: {len(corpus)} buffer(s), {total_mb:.1f} MB; best of {args.repeat}")
+    print(f"{'pattern':<16}{'ms':>10}{'ms/MB':>10}{'matches':>10}")
+    for key, ms, n in rows:
+        flag = "  <-- slow" if (key, ms, n) in slow else ""
+        print(f"{key:<16}{ms:>10.1f}{ms / total_mb:>10.1f}{n:>10}{flag}")
+    print(f"total: {sum(r[1] for r in rows):.1f} ms")
+
+    if slow:
+        print(f"{len(slow)} pattern(s) above {args.max_ms_per_mb:g} ms/MB")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())